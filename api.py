@@ -1,10 +1,22 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel, Field
+from typing import List, Optional
+import asyncio
 import tempfile
+import json
+import time
 import os
 
 
 import rag_core
+from config.settings import EVAL_BATCH_SIZE
+from core.scheduler import scheduler, QueueFullError
+from core.jobs import ingestion_jobs
+from core.telemetry import REQUEST_SECONDS
+from data.gold_dataset import GOLD_DATASET
+
+UPLOAD_CHUNK_BYTES = 1 << 20
 
 app = FastAPI(
     title="Clinical RAG API",
@@ -16,8 +28,64 @@ app = FastAPI(
 # Startup: Load models once
 # -----------------------------
 @app.on_event("startup")
-def startup_event():
-    rag_core.load_models()
+async def startup_event():
+    # Memory-map the cached indexes (fast), then load + warm the models on a
+    # background thread: the server accepts connections right away and
+    # /health/ready turns 200 once the workers are warm
+    rag_core.restore_index()
+    await scheduler.start()
+    await rag_core.query_batcher.start()
+    rag_core.start_background_load()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await rag_core.query_batcher.stop()
+    await scheduler.stop()
+
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+
+    def observe(status):
+        # Route template (/jobs/{job_id}), not the raw path, keeps label cardinality bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.observe(time.perf_counter() - start, path=path, status=status)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        observe(500)
+        raise
+    body = getattr(response, "body_iterator", None)
+    if body is None:
+        observe(response.status_code)
+        return response
+
+    async def timed_body():
+        # Streamed answers: the request ends with the last chunk (or the client leaving), not the headers
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            if hasattr(body, "aclose"):
+                await body.aclose()
+            observe(response.status_code)
+
+    response.body_iterator = timed_body()
+    return response
+
+
+async def run_inference(fn, *args, timeout=None, **kwargs):
+    """Queue a model call on the inference worker; map backpressure and timeouts to HTTP errors."""
+    try:
+        return await scheduler.submit(fn, *args, timeout=timeout, **kwargs)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Inference timed out.")
 
 # -----------------------------
 # Request / Response Schemas
@@ -31,6 +99,11 @@ class QueryRequest(BaseModel):
         description="Enter a clinical question based on the uploaded PDF(s). Minimum 5 characters.",
         example="When is metformin permanently discontinued due to kidney function according to the protocol?"
     )
+    doc_ids: Optional[List[str]] = Field(
+        None,
+        title="Document Filter",
+        description="Restrict retrieval to these documents (defaults to the whole corpus)."
+    )
 
     # strip leading/trailing whitespace automatically
     @classmethod
@@ -48,6 +121,25 @@ class QueryResponse(BaseModel):
     answer: str
     context: str
 
+
+class QueryBatchRequest(BaseModel):
+    questions: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=50,
+        title="Clinical Questions",
+        description="A checklist of clinical questions answered together in one batch (max 50)."
+    )
+    doc_ids: Optional[List[str]] = Field(
+        None,
+        title="Document Filter",
+        description="Restrict retrieval to these documents (defaults to the whole corpus)."
+    )
+
+
+class QueryBatchResponse(BaseModel):
+    results: List[QueryResponse]
+
 # -----------------------------
 # Health Check
 # -----------------------------
@@ -55,31 +147,94 @@ class QueryResponse(BaseModel):
 def health():
     return rag_core.health_check()
 
+
+@app.get("/health/live")
+def health_live():
+    # Liveness: the event loop answers (never touches the models)
+    return rag_core.liveness()
+
+
+@app.get("/health/ready")
+def health_ready():
+    # Readiness: 503 until the models are loaded and warmed up, so orchestrators hold traffic
+    ready, details = rag_core.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=dict(details, ready=ready))
+
+# -----------------------------
+# Prometheus Metrics
+# -----------------------------
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Stage histograms (embed_query, bm25, dense, fusion, prefill, decode, judge ...),
+    # tokens, decode tokens/sec, queue depth, CPU/GPU memory
+    return PlainTextResponse(rag_core.metrics_text(), media_type="text/plain; version=0.0.4")
+
 # -----------------------------
 # Upload & Index PDF
 # -----------------------------
-@app.post("/upload_pdf")
-async def upload_pdf(file: UploadFile = File(...)):
+@app.post("/upload_pdf", status_code=202)
+async def upload_pdf(file: UploadFile = File(...), doc_id: Optional[str] = None):
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    if rag_core.is_read_only():
+        raise HTTPException(status_code=409, detail="Serving a read-only snapshot; index on the build host and rebuild it.")
 
+    # Stream the upload to disk in 1 MiB pieces instead of holding it in memory
     with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(await file.read())
+        while piece := await file.read(UPLOAD_CHUNK_BYTES):
+            tmp.write(piece)
         tmp_path = tmp.name
 
-    try:
-        status = rag_core.process_pdf(tmp_path)
-    finally:
-        os.remove(tmp_path)
+    # Parsing + embedding run as a background job; the temp file is removed when it finishes.
+    # Re-uploading under the same doc_id replaces that document only, once the new index is ready.
+    job_id = ingestion_jobs.submit(
+        rag_core.process_pdf, tmp_path, doc_id or os.path.splitext(file.filename)[0]
+    )
+    return {"job_id": job_id, "status": "queued"}
+
+# -----------------------------
+# Ingestion Job Status
+# -----------------------------
+@app.get("/jobs")
+def list_jobs():
+    return {"jobs": ingestion_jobs.list()}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'.")
+    return job
+
+# -----------------------------
+# Corpus Management
+# -----------------------------
+@app.get("/documents")
+def list_documents():
+    return {"documents": rag_core.list_documents()}
 
-    return {"status": status}
+
+@app.delete("/documents/{doc_id}")
+def delete_document(doc_id: str):
+    if rag_core.is_read_only():
+        raise HTTPException(status_code=409, detail="Serving a read-only snapshot; index on the build host and rebuild it.")
+    if doc_id not in {d["doc_id"] for d in rag_core.list_documents()}:
+        raise HTTPException(status_code=404, detail=f"'{doc_id}' is not in the corpus.")
+    return {"status": rag_core.remove_pdf(doc_id)}
 
 # -----------------------------
 # Ask Question (RAG)
 # -----------------------------
 @app.post("/query", response_model=QueryResponse)
-def query_rag(req: QueryRequest):
-    result = rag_core.ask_question(req.question)
+async def query_rag(req: QueryRequest):
+    # Micro-batched with other in-flight /query requests
+    try:
+        result = await rag_core.query_batcher.submit((req.question, req.doc_ids))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Inference timed out.")
 
     if isinstance(result, str):
         raise HTTPException(status_code=400, detail=result)
@@ -87,12 +242,71 @@ def query_rag(req: QueryRequest):
     answer, context = result
     return QueryResponse(answer=answer, context=context)
 
+# -----------------------------
+# Ask Question, Streamed (Server-Sent Events)
+# -----------------------------
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event.get('data', ''))}\n\n"
+
+
+@app.post("/query/stream")
+async def query_rag_stream(req: QueryRequest):
+    events = scheduler.submit_stream(rag_core.ask_question_stream, req.question, doc_ids=req.doc_ids)
+
+    # Surface backpressure, timeouts and setup errors as normal HTTP errors before the stream starts
+    try:
+        first = await events.__anext__()
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Inference timed out.")
+    if first["type"] == "error":
+        await events.aclose()
+        raise HTTPException(status_code=400, detail=first["data"])
+
+    async def sse():
+        try:
+            yield format_sse(first)
+            async for event in events:
+                yield format_sse(event)
+        except asyncio.TimeoutError:
+            yield format_sse({"type": "error", "data": "Inference timed out."})
+        finally:
+            # Client gone (Starlette cancels the body) or done: stop generating for nobody
+            await events.aclose()
+
+    return StreamingResponse(sse(), media_type="text/event-stream")
+
+# -----------------------------
+# Ask a Batch of Questions (RAG)
+# -----------------------------
+@app.post("/query_batch", response_model=QueryBatchResponse)
+async def query_rag_batch(req: QueryBatchRequest):
+    questions = [q.strip() for q in req.questions]
+    if any(len(q) < 5 for q in questions):
+        raise HTTPException(status_code=422, detail="Each question must be at least 5 characters.")
+
+    # A batch holds the worker longer than one question, so scale the timeout
+    results = await run_inference(
+        rag_core.ask_questions, questions, doc_ids=req.doc_ids,
+        timeout=scheduler.timeout_sec * max(1, len(questions) // 4)
+    )
+
+    if isinstance(results, str):
+        raise HTTPException(status_code=400, detail=results)
+
+    return QueryBatchResponse(
+        results=[QueryResponse(answer=answer, context=context) for answer, context in results]
+    )
+
 # -----------------------------
 # Run Evaluation Benchmark
 # -----------------------------
 @app.post("/run_evaluation")
-def run_evaluation():
-    results = rag_core.run_rag_benchmark()
+async def run_evaluation():
+    # Long-running: one request timeout per evaluation batch (the run checkpoints, so a rerun resumes)
+    num_batches = -(-len(GOLD_DATASET) // EVAL_BATCH_SIZE)
+    results = await run_inference(rag_core.run_rag_benchmark, timeout=scheduler.timeout_sec * max(1, num_batches))
 
     return {
         "summary": results["summary"],
@@ -1,8 +1,22 @@
 import gradio as gr
-from core.models import load_models
-from core.qa import ask_question
-from core.retriever import process_pdf
+from core.models import start_background_load
+from core.qa import ask_question_stream
+from core.retriever import process_pdf, restore_index
 from evaluation.benchmark import run_full_benchmark
+
+def stream_to_ui(question):
+    """Show the evidence first, then grow the answer box token by token."""
+    answer, context = "", ""
+    for event in ask_question_stream(question):
+        if event["type"] == "error":
+            yield event["data"], ""
+            return
+        if event["type"] == "context":
+            context = event["data"]
+        elif event["type"] == "token":
+            answer += event["data"]
+        yield answer, context
+
 # -----------------------------
 # Gradio UI (Separated Logic)
 # -----------------------------
@@ -27,12 +41,15 @@ with gr.Blocks(title="Clinical RAG QA system") as demo:
                 # This box shows the 'Evidence' from the PDF
                 context_output = gr.Textbox(label="Retrieved Evidence (Sources)", lines=12)
 
-        # Load models on startup to avoid delay during first query
-        demo.load(load_models)
+        # Load + warm the models on a background thread; questions asked before
+        # that finishes get the "still loading" message instead of a frozen UI
+        demo.load(start_background_load)
+        # Memory-map the last indexed protocol back in (no re-embedding)
+        demo.load(restore_index, outputs=[status_output])
         
         process_btn.click(process_pdf, inputs=[pdf_input], outputs=[status_output])
-        # Update the click function to handle TWO outputs
-        ask_btn.click(ask_question, inputs=[question_input], outputs=[answer_output, context_output])
+        # Update the click function to handle TWO outputs (streamed as they are generated)
+        ask_btn.click(stream_to_ui, inputs=[question_input], outputs=[answer_output, context_output])
 
     with gr.Tab("Evaluation"):
         gr.Markdown("### Run Automated Benchmark against Gold Standard")
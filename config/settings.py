@@ -1,11 +1,132 @@
-import torch
-DEVICE = "cuda"
-COMPUTE_DTYPE = torch.bfloat16
+import os
+import functools
+
+# Hardware-dependent defaults are functions, not constants: probing CUDA means importing
+# torch (seconds), and importing the app / serving /health must not pay for it.
+@functools.lru_cache(maxsize=None)
+def cuda_available():
+    import torch
+    return torch.cuda.is_available()
+
+def llm_backend():
+    """Inference engine: hf_bnb (GPU 4-bit), hf, cpu_int8, onnx, remote (model servers) or stub (see core.backends)."""
+    return os.getenv("RAG_LLM_BACKEND") or ("hf_bnb" if cuda_available() else "cpu_int8")
+
+def device():
+    return os.getenv("RAG_DEVICE") or ("cuda" if cuda_available() else "cpu")
+
+def compute_dtype():
+    import torch
+    return getattr(torch, os.getenv("RAG_COMPUTE_DTYPE", "bfloat16"))
+
+HF_CACHE_DIR = os.getenv("RAG_HF_CACHE_DIR") or None    # None -> Hugging Face default cache
+GPU_MAX_MEMORY = os.getenv("RAG_GPU_MAX_MEMORY", "4.8GiB")
+CPU_MAX_MEMORY = os.getenv("RAG_CPU_MAX_MEMORY", "16GiB")
+CPU_THREADS = int(os.getenv("RAG_CPU_THREADS", "0"))    # 0 -> torch default
+ONNX_MODEL_DIR = os.getenv("RAG_ONNX_MODEL_DIR") or None    # pre-exported ONNX model, skips export
 EMBEDDING_MODEL_NAME = "NeuML/pubmedbert-base-embeddings"
 LLM_MODEL_NAME = "BioMistral/BioMistral-7B-DARE"
 
-token_stats = {
-    "input_tokens": 0,
-    "output_tokens": 0,
-    "num_queries": 0
-}
+# Chunking (part of the index cache key, so changing these forces a re-index)
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+# On-disk, content-addressed index store
+INDEX_DIR = os.getenv("RAG_INDEX_DIR", "artifacts/index_store")
+
+# Batched generation (/query_batch, ask_questions)
+GEN_BATCH_SIZE = 8
+MAX_BATCH_QUESTIONS = 50
+
+# Sparse (BM25) engine: MaxScore top-k pruning (same top-k as exhaustive scoring; pays off
+# only when common query terms have low upper bounds, see core.sparse.BM25Index)
+BM25_PRUNING = os.getenv("RAG_BM25_PRUNING", "0") == "1"
+
+# Dense index: flat (exact), hnsw (needs hnswlib) or ivfpq (compressed, NumPy)
+DENSE_INDEX = os.getenv("RAG_DENSE_INDEX", "flat")
+HNSW_M = int(os.getenv("RAG_HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "0"))      # 0 -> 4 * sqrt(n_chunks)
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("RAG_PQ_M", "16"))     # bytes per vector; must divide the embedding dimension
+IVF_REFINE = int(os.getenv("RAG_IVF_REFINE", "4"))    # exact re-rank of k * refine PQ candidates (0 = off)
+IVF_TRAIN_SIZE = 50000
+
+# Semantic answer cache (cosine threshold on query embeddings, LRU + TTL)
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("RAG_CACHE_THRESHOLD", "0.95"))
+CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SEC = int(os.getenv("RAG_CACHE_TTL_SEC", "3600"))
+
+# Inference scheduler (API): bounded queue in front of the model-owning worker
+QUEUE_MAX_SIZE = int(os.getenv("RAG_QUEUE_MAX_SIZE", "64"))
+INFERENCE_WORKERS = int(os.getenv("RAG_INFERENCE_WORKERS", "1"))
+REQUEST_TIMEOUT_SEC = float(os.getenv("RAG_REQUEST_TIMEOUT_SEC", "120"))
+# Longest wait for the next streamed answer piece (prefill of a long prompt included)
+STREAM_TOKEN_TIMEOUT_SEC = float(os.getenv("RAG_STREAM_TOKEN_TIMEOUT_SEC", str(REQUEST_TIMEOUT_SEC)))
+# Dynamic micro-batching of concurrent /query requests
+MICRO_BATCH_MAX_SIZE = int(os.getenv("RAG_MICRO_BATCH_MAX_SIZE", str(GEN_BATCH_SIZE)))
+MICRO_BATCH_WINDOW_MS = float(os.getenv("RAG_MICRO_BATCH_WINDOW_MS", "10"))
+
+# Background PDF ingestion jobs
+INDEXING_WORKERS = int(os.getenv("RAG_INDEXING_WORKERS", "1"))
+JOB_HISTORY_SIZE = 100
+EMBED_BATCH_SIZE = 64   # chunks per embedding call (progress is reported per batch)
+
+# Embedding service: encoder engine, length-bucketed encode batches, on-disk vector cache
+EMBEDDING_ENGINE = os.getenv("RAG_EMBEDDING_ENGINE", "sentence_transformers")   # or onnx / int8 (CPU)
+EMBED_ENCODE_BATCH_SIZE = 32
+EMBED_CACHE_PATH = os.getenv("RAG_EMBED_CACHE", "artifacts/embedding_cache.sqlite")    # "" disables
+
+# Parallel streaming PDF parsing (process pool, bounded in-flight page ranges)
+PARSE_WORKERS = int(os.getenv("RAG_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PARSE_PAGES_PER_TASK = 16
+PARSE_MIN_PARALLEL_PAGES = 64   # smaller PDFs are parsed inline, faster than shipping work to the pool
+
+# Layout-aware extraction: headings / paragraphs / table rows, section-aware chunks, per-page cache
+PARSE_LAYOUT = os.getenv("RAG_PARSE_LAYOUT", "1") == "1"    # 0 -> plain page text (the old parser)
+PAGE_CACHE_DIR = os.getenv("RAG_PAGE_CACHE_DIR", "artifacts/page_cache")   # "" disables
+
+# Benchmark runner: questions per staged batch + resumable JSONL checkpoint
+EVAL_BATCH_SIZE = 16
+EVAL_CHECKPOINT_PATH = os.getenv("RAG_EVAL_CHECKPOINT", "artifacts/benchmark_checkpoint.jsonl")
+JUDGE_BATCH_SIZE = 8    # triad prompts per logit-judge forward pass
+
+# KV-cache prefix reuse (system prompt / retrieved context / auditor instructions)
+PREFIX_CACHE_ENABLED = os.getenv("RAG_PREFIX_CACHE", "1") == "1"
+PREFIX_CACHE_ENTRIES = int(os.getenv("RAG_PREFIX_CACHE_ENTRIES", "32"))
+
+# Decoding profiles (see core.decoding): new-token budgets per task; verdicts are always 1 token
+ANSWER_MAX_NEW_TOKENS = int(os.getenv("RAG_ANSWER_MAX_TOKENS", "250"))
+REASON_MAX_NEW_TOKENS = int(os.getenv("RAG_REASON_MAX_TOKENS", "128"))
+# Not-found shortcut: below this best query/chunk cosine similarity the LLM is skipped (0 = off)
+NOT_FOUND_MIN_SIMILARITY = float(os.getenv("RAG_NOT_FOUND_MIN_SIMILARITY", "0"))
+
+# Speculative decoding for single-question generation: off, prompt_lookup (drafts copied
+# from the retrieved context) or draft (small model, ideally sharing the Mistral tokenizer)
+SPECULATIVE_MODE = os.getenv("RAG_SPECULATIVE", "off")
+DRAFT_MODEL_NAME = os.getenv("RAG_DRAFT_MODEL", "")
+PROMPT_LOOKUP_TOKENS = int(os.getenv("RAG_PROMPT_LOOKUP_TOKENS", "10"))
+
+# Multi-process serving (see core.snapshot, core.model_server):
+# workers search a shared read-only, memory-mapped index snapshot (optionally sharded
+# by document, shards served locally or by shard servers) and send generation to model servers
+SNAPSHOT_DIR = os.getenv("RAG_SNAPSHOT_DIR", "")     # "" = mutable in-process corpus (default)
+SHARD_SERVERS = os.getenv("RAG_SHARD_SERVERS", "")   # "shard-0=host:port,shard-1=host:port"; others searched locally
+MODEL_SERVERS = [a for a in os.getenv("RAG_MODEL_SERVERS", "").split(",") if a]     # used by the "remote" LLM backend
+RPC_AUTHKEY = os.getenv("RAG_RPC_AUTHKEY", "").encode("utf-8")     # required by every RPC server / client, no default
+RPC_TIMEOUT_SEC = float(os.getenv("RAG_RPC_TIMEOUT_SEC", "300"))     # client wait for one reply (a whole generation batch)
+
+# Cross-encoder rerank stage (CPU): over-retrieve RERANK_CANDIDATES fused hits, keep the best RERANK_TOP_N
+RERANK_ENABLED = os.getenv("RAG_RERANK", "0") == "1"
+RERANK_MODEL_NAME = os.getenv("RAG_RERANK_MODEL", "ncbi/MedCPT-Cross-Encoder")
+RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "30"))
+RERANK_TOP_N = int(os.getenv("RAG_RERANK_TOP_N", "6"))     # same context size as the 3 + 3 fused hits
+RERANK_BATCH_SIZE = 16
+RERANK_LATENCY_BUDGET_MS = int(os.getenv("RAG_RERANK_BUDGET_MS", "300"))    # 0 = score every candidate
+RERANK_CACHE_ENTRIES = 4096
+
+# Context packing: merged/deduplicated evidence is cut to this many generator tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKENS", "1024"))    # 0 = no budget
+CONTEXT_DEDUP_THRESHOLD = 0.9   # token-set Jaccard at which a sentence counts as a repeat
@@ -0,0 +1,379 @@
+import math
+import logging
+
+import numpy as np
+
+from config.settings import (
+    DENSE_INDEX, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+    IVF_NLIST, IVF_NPROBE, PQ_M, IVF_REFINE, IVF_TRAIN_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores, best first (ties keep index order)."""
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def _exact_rows(vectors, rows, q, k):
+    """Exact top-k among `rows` for one query (negative squared L2)."""
+    if len(rows) == 0:
+        return rows
+    sub = np.asarray(vectors, dtype=np.float32)
+    scores = 2.0 * (sub @ q) - np.einsum("ij,ij->i", sub, sub)
+    return rows[top_k(scores, min(k, len(rows)))]
+
+# -----------------------------
+# Exact Flat Index
+# -----------------------------
+class FlatDenseIndex:
+    """Brute-force negative squared L2 (same ordering as Chroma's default l2 space)."""
+    kind = "flat"
+
+    def __init__(self):
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.sq_norms = np.zeros(0, dtype=np.float32)
+
+    def build(self, segment_vectors):
+        # Empty documents (0 rows, possibly saved as (0, 0)) add no rows and may not match the width
+        segment_vectors = [v for v in segment_vectors if len(v)]
+        self.vectors = np.vstack(segment_vectors).astype(np.float32, copy=False) if segment_vectors else np.zeros((0, 0), dtype=np.float32)
+        self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors) if len(self.vectors) else np.zeros(0, dtype=np.float32)
+
+    def extend(self, segment_vectors):
+        """Append the rows of new segments (after the built ones)."""
+        self.build([self.vectors] + list(segment_vectors))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def scores(self, Q):
+        """(n_chunks x n_queries) scores."""
+        return 2.0 * (self.vectors @ Q.T) - self.sq_norms[:, None]
+
+    def search(self, Q, k, mask=None):
+        scores = self.scores(Q)
+        if mask is not None:
+            scores = np.where(mask[:, None], scores, -np.inf)
+        k = min(k, len(self) if mask is None else int(mask.sum()))
+        return [top_k(scores[:, q], k) for q in range(len(Q))]
+
+    def memory_bytes(self):
+        return self.vectors.nbytes + self.sq_norms.nbytes
+
+    def params(self):
+        return {}
+
+# -----------------------------
+# HNSW (hnswlib)
+# -----------------------------
+class HNSWDenseIndex:
+    """
+    Graph index via hnswlib (optional dependency). M trades memory and
+    build time for recall; ef_search trades latency for recall per query.
+    """
+    kind = "hnsw"
+
+    def __init__(self, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH):
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._index = None
+        self._size = 0
+        self._dim = 0
+
+    def build(self, segment_vectors):
+        self._index = None
+        self._size = 0
+        self.extend(segment_vectors)
+
+    def extend(self, segment_vectors):
+        """Insert the rows of new segments into the graph (labels continue after the built rows)."""
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("The 'hnsw' dense index needs hnswlib (pip install hnswlib).") from e
+        segment_vectors = [v for v in segment_vectors if len(v)]
+        added = sum(len(v) for v in segment_vectors)
+        if added == 0:
+            return
+        if self._index is None:
+            self._dim = segment_vectors[0].shape[1]
+            self._index = hnswlib.Index(space="l2", dim=self._dim)
+            self._index.init_index(max_elements=added, M=self.m, ef_construction=self.ef_construction)
+        else:
+            self._index.resize_index(self._size + added)
+        offset = self._size
+        # Segment by segment, so the memory-mapped vectors are never stacked in RAM
+        for vectors in segment_vectors:
+            self._index.add_items(np.asarray(vectors, dtype=np.float32), np.arange(offset, offset + len(vectors)))
+            offset += len(vectors)
+        self._size = offset
+        self._index.set_ef(self.ef_search)
+
+    def __len__(self):
+        return self._size
+
+    def search(self, Q, k, mask=None):
+        if self._size == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in Q]
+        if mask is None:
+            k = min(k, self._size)
+            labels, _ = self._index.knn_query(Q, k=k)
+            return [labels[q].astype(np.int64) for q in range(len(Q))]
+
+        allowed = np.flatnonzero(mask)
+        if len(allowed) <= max(4 * k, self.ef_search):
+            # Tiny scope: exact search over the allowed rows is cheaper than the graph
+            vectors = self._index.get_items(allowed)
+            return [_exact_rows(vectors, allowed, q, k) for q in Q]
+        # Over-fetch in proportion to how much of the index is filtered out
+        fetch = min(self._size, int(math.ceil(k * self._size / len(allowed) * 2)))
+        self._index.set_ef(max(self.ef_search, fetch))
+        labels, _ = self._index.knn_query(Q, k=fetch)
+        self._index.set_ef(self.ef_search)
+        results = []
+        for q in range(len(Q)):
+            rows = labels[q][mask[labels[q]]][:k].astype(np.int64)
+            if len(rows) < min(k, len(allowed)):
+                rows = _exact_rows(self._index.get_items(allowed), allowed, Q[q], k)
+            results.append(rows)
+        return results
+
+    def memory_bytes(self):
+        # float32 vectors + ~2*M neighbour links (int32) on the base layer
+        return self._size * (self._dim * 4 + self.m * 2 * 4)
+
+    def params(self):
+        return {"M": self.m, "ef_construction": self.ef_construction, "ef_search": self.ef_search}
+
+# -----------------------------
+# IVF-PQ (NumPy)
+# -----------------------------
+def kmeans(x, k, iters=20, seed=0):
+    """Plain Lloyd's k-means (k-means++ would be nicer; random init is enough for codebooks)."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = assign_nearest(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters from random points
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+def assign_nearest(x, centroids, block=65536):
+    """Index of the nearest centroid for every row of x (blocked to bound memory)."""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), block):
+        part = x[start:start + block]
+        out[start:start + block] = np.argmin(c_sq[None, :] - 2.0 * (part @ centroids.T), axis=1)
+    return out
+
+
+class IVFPQDenseIndex:
+    """
+    Inverted file + product quantization. A coarse k-means splits the
+    vectors into nlist lists; each residual is stored as pq_m one-byte codes
+    (768-d float32 -> 16 bytes with pq_m=16). A query scans only its nprobe
+    nearest lists with per-subspace lookup tables (asymmetric distance).
+
+    With refine > 0 the best k * refine codes are re-ranked with exact
+    distances read from the segment vectors, which stay memory-mapped on
+    disk rather than resident.
+    """
+    kind = "ivfpq"
+
+    def __init__(self, nlist=IVF_NLIST, nprobe=IVF_NPROBE, pq_m=PQ_M, refine=IVF_REFINE, train_size=IVF_TRAIN_SIZE, nbits=8):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.refine = refine
+        self.train_size = train_size
+        self.ksub = 2 ** nbits
+        self.coarse = None       # (nlist, d)
+        self.codebooks = None    # (pq_m, ksub, d / pq_m)
+        self._trained_on = 0
+        self._size = 0
+        self.list_offsets = np.zeros(1, dtype=np.int64)
+        self.list_rows = np.zeros(0, dtype=np.int64)
+        self.codes = np.zeros((0, 0), dtype=np.uint8)
+        self._segment_vectors = []
+
+    def _train(self, segment_vectors, n):
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(n, size=min(n, self.train_size), replace=False))
+        sample = self._gather(segment_vectors, sample_rows)
+        nlist = self.nlist or max(1, int(4 * math.sqrt(n)))
+        self.coarse = kmeans(sample, min(nlist, len(sample)))
+        residuals = sample - self.coarse[assign_nearest(sample, self.coarse)]
+        d = sample.shape[1]
+        if d % self.pq_m:
+            raise ValueError(f"PQ_M={self.pq_m} must divide the embedding dimension {d}.")
+        dsub = d // self.pq_m
+        self.codebooks = np.stack([
+            kmeans(residuals[:, j * dsub:(j + 1) * dsub], self.ksub) for j in range(self.pq_m)
+        ])
+        self._trained_on = n
+
+    @staticmethod
+    def _gather(segment_vectors, rows):
+        """Vectors for global rows (in the given order) from the per-segment arrays."""
+        order = np.argsort(rows, kind="stable")
+        sorted_rows = rows[order]
+        out, offset = [], 0
+        for vectors in segment_vectors:
+            local = sorted_rows[(sorted_rows >= offset) & (sorted_rows < offset + len(vectors))] - offset
+            if len(local):
+                out.append(np.asarray(vectors[local], dtype=np.float32))
+            offset += len(vectors)
+        gathered = np.vstack(out)
+        result = np.empty_like(gathered)
+        result[order] = gathered
+        return result
+
+    def _encode(self, x, lists):
+        residuals = x - self.coarse[lists]
+        dsub = residuals.shape[1] // self.pq_m
+        codes = np.empty((len(x), self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            codes[:, j] = assign_nearest(residuals[:, j * dsub:(j + 1) * dsub], self.codebooks[j])
+        return codes
+
+    def build(self, segment_vectors):
+        segment_vectors = [v for v in segment_vectors if len(v)]
+        n = sum(len(v) for v in segment_vectors)
+        self._size = n
+        self._segment_vectors = list(segment_vectors)
+        if n == 0:
+            self.list_offsets = np.zeros(1, dtype=np.int64)
+            self.list_rows = np.zeros(0, dtype=np.int64)
+            self.codes = np.zeros((0, self.pq_m), dtype=np.uint8)
+            return
+        # Keep the trained quantizers while the corpus size stays in the same range
+        if self.coarse is None or not (self._trained_on / 2 <= n <= self._trained_on * 2):
+            self._train(segment_vectors, n)
+        lists, codes = [], []
+        for vectors in segment_vectors:
+            x = np.asarray(vectors, dtype=np.float32)
+            seg_lists = assign_nearest(x, self.coarse)
+            lists.append(seg_lists)
+            codes.append(self._encode(x, seg_lists))
+        self._set_lists(np.arange(n), np.concatenate(lists), np.concatenate(codes))
+
+    def _set_lists(self, rows, lists, codes):
+        # Grouped by list, rows ascending inside each list
+        order = np.lexsort((rows, lists))
+        self.list_rows = rows[order]
+        self.codes = codes[order]
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=len(self.coarse)))])
+
+    def extend(self, segment_vectors):
+        """
+        Encode only the rows of new segments with the trained quantizers;
+        retrains (full build) once the index outgrows twice its training size.
+        """
+        segment_vectors = [v for v in segment_vectors if len(v)]
+        added = sum(len(v) for v in segment_vectors)
+        if added == 0:
+            return
+        if self.coarse is None or self._size + added > 2 * self._trained_on:
+            self.build(self._segment_vectors + segment_vectors)
+            return
+        rows, lists, codes = [self.list_rows], [np.repeat(np.arange(len(self.coarse)), np.diff(self.list_offsets))], [self.codes]
+        offset = self._size
+        for vectors in segment_vectors:
+            x = np.asarray(vectors, dtype=np.float32)
+            seg_lists = assign_nearest(x, self.coarse)
+            rows.append(np.arange(offset, offset + len(x)))
+            lists.append(seg_lists)
+            codes.append(self._encode(x, seg_lists))
+            offset += len(x)
+        self._set_lists(np.concatenate(rows), np.concatenate(lists), np.concatenate(codes))
+        self._segment_vectors += segment_vectors
+        self._size = offset
+
+    def __len__(self):
+        return self._size
+
+    def _scan(self, q, probe, mask):
+        """ADC scores for the rows of the probed lists (optionally masked)."""
+        dsub = len(q) // self.pq_m
+        rows_all, scores_all = [], []
+        for c in probe:
+            lo, hi = self.list_offsets[c], self.list_offsets[c + 1]
+            if lo == hi:
+                continue
+            rows = self.list_rows[lo:hi]
+            codes = self.codes[lo:hi]
+            if mask is not None:
+                keep = mask[rows]
+                rows, codes = rows[keep], codes[keep]
+                if len(rows) == 0:
+                    continue
+            r = (q - self.coarse[c]).reshape(self.pq_m, 1, dsub)
+            lut = ((self.codebooks - r) ** 2).sum(axis=2)      # (pq_m, ksub)
+            dist = lut[np.arange(self.pq_m), codes].sum(axis=1)
+            rows_all.append(rows)
+            scores_all.append(-dist)
+        if not rows_all:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(rows_all), np.concatenate(scores_all)
+
+    def search(self, Q, k, mask=None):
+        if self._size == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in Q]
+        n_allowed = self._size if mask is None else int(mask.sum())
+        k = min(k, n_allowed)
+        c_sq = np.einsum("ij,ij->i", self.coarse, self.coarse)
+        coarse_scores = 2.0 * (Q @ self.coarse.T) - c_sq[None, :]
+        results = []
+        for q in range(len(Q)):
+            probe = top_k(coarse_scores[q], min(self.nprobe, len(self.coarse)))
+            rows, scores = self._scan(Q[q], probe, mask)
+            if len(rows) < k:
+                # Scope filtered out most of the probed lists: scan every list
+                rows, scores = self._scan(Q[q], np.arange(len(self.coarse)), mask)
+            if self.refine > 0:
+                candidates = rows[top_k(scores, k * self.refine)]
+                results.append(_exact_rows(self._gather(self._segment_vectors, candidates), candidates, Q[q], k))
+            else:
+                results.append(rows[top_k(scores, k)])
+        return results
+
+    def memory_bytes(self):
+        if self.coarse is None:
+            return 0
+        return self.codes.nbytes + self.list_rows.nbytes + self.coarse.nbytes + self.codebooks.nbytes
+
+    def params(self):
+        return {"nlist": len(self.coarse) if self.coarse is not None else self.nlist, "nprobe": self.nprobe, "pq_m": self.pq_m, "refine": self.refine}
+
+
+DENSE_INDEXES = {
+    "flat": FlatDenseIndex,
+    "hnsw": HNSWDenseIndex,
+    "ivfpq": IVFPQDenseIndex,
+}
+
+
+def make_dense_index(kind=DENSE_INDEX, **params):
+    if kind not in DENSE_INDEXES:
+        raise ValueError(f"Unknown dense index '{kind}'. Choose one of: {', '.join(DENSE_INDEXES)}")
+    return DENSE_INDEXES[kind](**params)
+
+__all__ = ["FlatDenseIndex", "HNSWDenseIndex", "IVFPQDenseIndex", "DENSE_INDEXES", "make_dense_index", "kmeans", "top_k"]
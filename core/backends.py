@@ -0,0 +1,260 @@
+import zlib
+import logging
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import Generation, LLMResult
+
+from core.rpc import ServerPool
+
+from config.settings import (
+    LLM_MODEL_NAME, device, compute_dtype, HF_CACHE_DIR, GEN_BATCH_SIZE,
+    GPU_MAX_MEMORY, CPU_MAX_MEMORY, CPU_THREADS, ONNX_MODEL_DIR, MODEL_SERVERS,
+)
+
+logger = logging.getLogger(__name__)
+
+# NOTE: torch / transformers / langchain-huggingface / bitsandbytes are imported inside the
+# loaders: they take seconds to import and the stub and remote backends never need them.
+
+# Decoding settings shared by every engine and the prefix-cached path
+GENERATION_KWARGS = {
+    "max_new_tokens": 250,
+    "temperature": 0.01, # Low temperature for medical precision
+    "repetition_penalty": 1.15,
+}
+
+# -----------------------------
+# Backend Handle
+# -----------------------------
+class Backend:
+    """
+    What the rest of the app needs from an inference engine: a LangChain
+    LLM for the chains, the tokenizer, and - when the engine is a real
+    model - the underlying model and pipeline for streaming, KV-prefix
+    reuse and the logit judge.
+    """
+
+    def __init__(self, name, llm, tokenizer, model=None, pipeline=None, supports_kv_cache=False, trims_logits=False):
+        self.name = name
+        self.llm = llm
+        self.tokenizer = tokenizer
+        self.model = model
+        self.pipeline = pipeline
+        self.supports_kv_cache = supports_kv_cache
+        self.trims_logits = trims_logits    # forward() accepts logits_to_keep
+
+    @property
+    def supports_logits(self):
+        return self.model is not None
+
+    def last_token_logits(self, inputs):
+        """Next-token logits at the last position of a (left-padded) batch."""
+        import torch
+        inputs = dict(inputs)
+        mask = inputs.get("attention_mask")
+        if mask is not None and "position_ids" not in inputs:
+            # Left padding: count positions from each row's first real token (as generate() does),
+            # otherwise a row's verdict would depend on how long the other rows of its batch are
+            inputs["position_ids"] = (mask.long().cumsum(-1) - 1).clamp(min=0)
+        with torch.no_grad():
+            if self.trims_logits:
+                return self.model(**inputs, logits_to_keep=1).logits[:, -1, :].float()
+            return self.model(**inputs).logits[:, -1, :].float()
+
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME, cache_dir=HF_CACHE_DIR)
+    tokenizer.pad_token = tokenizer.eos_token
+    # Left padding so batched prompts all end right where generation starts
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+
+def _wrap_model(name, model, tokenizer, supports_kv_cache=True, trims_logits=True):
+    from langchain_huggingface import HuggingFacePipeline
+    from transformers import pipeline
+    pipe = pipeline(
+        "text-generation",
+        model=model,
+        tokenizer=tokenizer,
+        return_full_text=False,
+        **GENERATION_KWARGS,
+        batch_size=GEN_BATCH_SIZE # padded batches for ask_questions / llm_chain.batch
+    )
+    llm = HuggingFacePipeline(pipeline=pipe, batch_size=GEN_BATCH_SIZE)
+    return Backend(name, llm, tokenizer, model=model, pipeline=pipe,
+                   supports_kv_cache=supports_kv_cache, trims_logits=trims_logits)
+
+# -----------------------------
+# Engines
+# -----------------------------
+def load_hf_bnb():
+    """GPU path: BioMistral in 4-bit NF4 via bitsandbytes (fits ~5.5GB VRAM)."""
+    from transformers import AutoModelForCausalLM, BitsAndBytesConfig
+    logger.info("Loading BioMistral 7B in 4-bit...... This may take 2-3 minutes.")
+    bnb_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_use_double_quant=True,
+        bnb_4bit_compute_dtype=compute_dtype(),
+        llm_int8_enable_fp32_cpu_offload=False
+    )
+    tokenizer = _load_tokenizer()
+    # Cap the model to leave room for Embeddings + OS
+    max_mem = {0: GPU_MAX_MEMORY, "cpu": CPU_MAX_MEMORY}
+    model = AutoModelForCausalLM.from_pretrained(
+        LLM_MODEL_NAME,
+        quantization_config=bnb_config,
+        device_map="auto",
+        max_memory=max_mem,
+        cache_dir=HF_CACHE_DIR,
+    )
+    return _wrap_model("hf_bnb", model, tokenizer)
+
+
+def load_hf():
+    """Unquantized HF model on device() in compute_dtype() (RAG_DEVICE / RAG_COMPUTE_DTYPE)."""
+    from transformers import AutoModelForCausalLM
+    logger.info(f"Loading {LLM_MODEL_NAME} on {device()} in {compute_dtype()}")
+    tokenizer = _load_tokenizer()
+    model = AutoModelForCausalLM.from_pretrained(
+        LLM_MODEL_NAME, torch_dtype=compute_dtype(), cache_dir=HF_CACHE_DIR, low_cpu_mem_usage=True
+    ).to(device())
+    model.eval()
+    return _wrap_model("hf", model, tokenizer)
+
+
+def load_cpu_int8():
+    """CPU path: fp32 weights with every nn.Linear dynamically quantized to int8."""
+    import torch
+    from transformers import AutoModelForCausalLM
+    if CPU_THREADS > 0:
+        torch.set_num_threads(CPU_THREADS)
+    tokenizer = _load_tokenizer()
+    model = AutoModelForCausalLM.from_pretrained(
+        LLM_MODEL_NAME, torch_dtype=torch.float32, cache_dir=HF_CACHE_DIR, low_cpu_mem_usage=True
+    )
+    model.eval()
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return _wrap_model("cpu_int8", model, tokenizer)
+
+
+def load_onnx():
+    """CPU path: ONNX Runtime through optimum (exports the model on first use unless ONNX_MODEL_DIR is set)."""
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError as e:
+        raise ImportError("The 'onnx' backend needs optimum[onnxruntime] (pip install 'optimum[onnxruntime]').") from e
+    tokenizer = _load_tokenizer()
+    model = ORTModelForCausalLM.from_pretrained(
+        ONNX_MODEL_DIR or LLM_MODEL_NAME,
+        export=ONNX_MODEL_DIR is None,
+        cache_dir=HF_CACHE_DIR,
+    )
+    # ORT keeps its own KV buffers, so no prefix reuse and no logits_to_keep
+    return _wrap_model("onnx", model, tokenizer, supports_kv_cache=False, trims_logits=False)
+
+# -----------------------------
+# Deterministic Stub (tests / smoke runs, no weights)
+# -----------------------------
+NOT_FOUND_ANSWER = "Information not found in protocol."
+
+
+def stub_completion(prompt):
+    """Fixed function of the prompt: '1' for binary audits, else the first sentence of the context."""
+    if "Output ONLY '1' or '0'" in prompt:
+        return "1"
+    if "Context:" not in prompt:
+        return "Stub auditor: no reasoning available."
+    context = prompt.split("Context:", 1)[1].split("\n\nQuestion:", 1)[0].strip()
+    if not context:
+        return NOT_FOUND_ANSWER
+    return context.split(". ")[0].strip().rstrip(".") + "."
+
+
+class StubLLM(LLM):
+    """LangChain LLM returning stub_completion(prompt)."""
+
+    @property
+    def _llm_type(self):
+        return "rag-stub"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return stub_completion(prompt)
+
+
+class StubTokenizer:
+    """Whitespace tokenizer covering the part of the HF tokenizer API used for token counting."""
+    pad_token_id = 0
+    eos_token_id = 0
+    unk_token_id = 0
+
+    def encode(self, text, add_special_tokens=True):
+        ids = [zlib.crc32(word.encode("utf-8")) for word in text.split()]
+        return [1] + ids if add_special_tokens else ids
+
+
+def load_stub():
+    return Backend("stub", StubLLM(), StubTokenizer())
+
+
+# -----------------------------
+# Remote Model Servers
+# -----------------------------
+_server_pools = {}
+
+
+def _server_pool(addresses):
+    key = tuple(addresses)
+    if key not in _server_pools:
+        _server_pools[key] = ServerPool(list(addresses))
+    return _server_pools[key]
+
+
+class RemoteLLM(LLM):
+    """
+    LangChain LLM completed by model servers (python -m core.model_server).
+    A .batch() of prompts goes to one server in one call, so the server
+    still generates it as one padded batch.
+    """
+    addresses: list = []
+
+    @property
+    def _llm_type(self):
+        return "rag-remote"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return self._generate([prompt]).generations[0][0].text
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        # The decoding profile (core.decoding) is applied on the server
+        texts = _server_pool(self.addresses).call("complete", list(prompts), kwargs.get("profile"))
+        return LLMResult(generations=[[Generation(text=t)] for t in texts])
+
+
+def load_remote():
+    """API workers without a model: generation goes to RAG_MODEL_SERVERS, tokens are counted locally."""
+    info = _server_pool(MODEL_SERVERS).call("ping")
+    logger.info(f"Model servers {', '.join(MODEL_SERVERS)} run backend '{info['backend']}'")
+    tokenizer = StubTokenizer() if info["backend"] == "stub" else _load_tokenizer()
+    return Backend("remote", RemoteLLM(addresses=MODEL_SERVERS), tokenizer)
+
+
+BACKENDS = {
+    "hf_bnb": load_hf_bnb,
+    "hf": load_hf,
+    "cpu_int8": load_cpu_int8,
+    "onnx": load_onnx,
+    "stub": load_stub,
+    "remote": load_remote,
+}
+
+
+def load_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    logger.info(f"Loading LLM backend '{name}'")
+    return BACKENDS[name]()
+
+__all__ = ["Backend", "BACKENDS", "GENERATION_KWARGS", "NOT_FOUND_ANSWER", "StubLLM", "StubTokenizer", "RemoteLLM", "load_backend", "stub_completion"]
@@ -0,0 +1,115 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from config.settings import CACHE_SIMILARITY_THRESHOLD, CACHE_MAX_ENTRIES, CACHE_TTL_SEC
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Semantic Answer Cache
+# -----------------------------
+class SemanticCache:
+    """
+    Answer cache in front of the LLM chain.
+
+    Entries are grouped by scope (the (doc_id, index key) pairs a question
+    was answered against) and matched by cosine similarity of the query
+    embedding, so near-paraphrases of a cached question reuse its answer.
+    Eviction is LRU on top of a TTL; re-indexing or removing a document
+    drops every entry whose scope includes it.
+    """
+
+    def __init__(self, threshold=CACHE_SIMILARITY_THRESHOLD, max_entries=CACHE_MAX_ENTRIES, ttl_sec=CACHE_TTL_SEC):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # entry_id -> entry, oldest use first
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector):
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm > 0 else v
+
+    def _expire(self, now):
+        if self.ttl_sec <= 0:
+            return
+        expired = [eid for eid, e in self._entries.items() if now - e["created"] > self.ttl_sec]
+        for eid in expired:
+            del self._entries[eid]
+        self.evictions += len(expired)
+
+    def lookup(self, scope, vector):
+        """Return the cached (answer, context) closest to vector within scope, or None."""
+        if self.max_entries <= 0:
+            return None
+        q = self._normalize(vector)
+        with self._lock:
+            self._expire(time.monotonic())
+            candidates = [(eid, e) for eid, e in self._entries.items() if e["scope"] == scope]
+            if candidates:
+                sims = np.stack([e["vector"] for _, e in candidates]) @ q
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    eid, entry = candidates[best]
+                    self._entries.move_to_end(eid)
+                    self.hits += 1
+                    return entry["answer"], entry["context"]
+            self.misses += 1
+            return None
+
+    def put(self, scope, vector, answer, context):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[self._next_id] = {
+                "scope": scope,
+                "vector": self._normalize(vector),
+                "answer": answer,
+                "context": context,
+                "created": time.monotonic(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, doc_id):
+        """Drop every entry answered against doc_id (call when it is re-indexed or removed)."""
+        with self._lock:
+            stale = [eid for eid, e in self._entries.items() if any(d == doc_id for d, _ in e["scope"])]
+            for eid in stale:
+                del self._entries[eid]
+        if stale:
+            logger.info(f"Answer cache: invalidated {len(stale)} entries for '{doc_id}'")
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Shared cache used by core.qa
+answer_cache = SemanticCache()
+
+__all__ = ["SemanticCache", "answer_cache"]
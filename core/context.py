@@ -0,0 +1,226 @@
+import re
+import threading
+import logging
+
+from config.settings import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD
+from core import models
+from core.telemetry import trace
+from core.tokenizer import clinical_tokenize
+
+logger = logging.getLogger(__name__)
+
+PASSAGE_SEPARATOR = "\n\n"
+MIN_OVERLAP_CHARS = 20      # shorter suffix/prefix matches are coincidence, not splitter overlap
+MIN_DEDUP_TOKENS = 4        # headings and "Yes." style fragments are never dropped as duplicates
+
+# Sentence boundary (kept as its own item so passages re-join with their original spacing)
+_SENTENCE_SPLIT = re.compile(r"((?<=[.!?;])\s+|\n+)")
+
+# -----------------------------
+# Chunk Merging
+# -----------------------------
+def overlap_length(left, right, min_chars=MIN_OVERLAP_CHARS):
+    """Length of the longest suffix of left that is also a prefix of right (0 if shorter than min_chars)."""
+    if len(left) < min_chars or len(right) < min_chars:
+        return 0
+    probe = right[:min_chars]
+    # Earliest occurrence in left = longest overlap
+    pos = left.find(probe, max(0, len(left) - len(right)))
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return len(left) - pos
+        pos = left.find(probe, pos + 1)
+    return 0
+
+
+def merge_texts(texts):
+    """Join consecutive chunks of one page, writing the splitter overlap once."""
+    merged = texts[0]
+    for text in texts[1:]:
+        k = overlap_length(merged, text)
+        merged = merged + text[k:] if k else merged + "\n" + text
+    return merged
+
+
+def group_passages(docs):
+    """
+    Rank-ordered passages: chunks of the same document page with consecutive
+    chunk numbers become one passage, ranked at its best-ranked chunk.
+    """
+    runs = {}   # (doc_id, page) -> [[(chunk, rank, text), ...], ...]
+    for rank, doc in enumerate(docs):
+        meta = doc.metadata
+        chunk = meta.get("chunk")
+        if chunk is None:
+            runs[("", rank)] = [[(0, rank, doc.page_content)]]
+            continue
+        runs.setdefault((meta.get("doc_id"), meta.get("page")), []).append([(chunk, rank, doc.page_content)])
+
+    passages = []
+    for page_runs in runs.values():
+        members = sorted(m for run in page_runs for m in run)
+        current = [members[0]]
+        for m in members[1:]:
+            if m[0] == current[-1][0]:
+                continue    # same chunk retrieved twice
+            if m[0] == current[-1][0] + 1:
+                current.append(m)
+            else:
+                passages.append(current)
+                current = [m]
+        passages.append(current)
+    passages.sort(key=lambda run: min(m[1] for m in run))
+    return [merge_texts([m[2] for m in run]) for run in passages]
+
+# -----------------------------
+# Near-Duplicate Sentences
+# -----------------------------
+def split_sentences(text):
+    """[(sentence, separator_after), ...] such that joining them gives back text."""
+    parts = _SENTENCE_SPLIT.split(text)
+    parts.append("")
+    return [(parts[i], parts[i + 1]) for i in range(0, len(parts) - 1, 2) if parts[i] or parts[i + 1]]
+
+
+def dedup_sentences(passages, threshold=CONTEXT_DEDUP_THRESHOLD):
+    """
+    Drop sentences whose token set has Jaccard similarity >= threshold with
+    a sentence kept earlier (higher-ranked evidence wins).
+    Returns (passages as sentence lists, number of sentences dropped).
+    """
+    seen = set()
+    kept_sets = []
+    dropped = 0
+    result = []
+    for passage in passages:
+        sentences = []
+        for sentence, sep in split_sentences(passage):
+            tokens = frozenset(clinical_tokenize(sentence))
+            if len(tokens) >= MIN_DEDUP_TOKENS:
+                if tokens in seen or any(
+                    len(tokens & other) / len(tokens | other) >= threshold for other in kept_sets
+                ):
+                    dropped += 1
+                    continue
+                seen.add(tokens)
+                kept_sets.append(tokens)
+            sentences.append((sentence, sep))
+        if any(s.strip() for s, _ in sentences):
+            result.append(sentences)
+    return result, dropped
+
+# -----------------------------
+# Token-Budget Packing
+# -----------------------------
+def _join(sentences):
+    return "".join(s + sep for s, sep in sentences).strip()
+
+
+class ContextPacker:
+    """
+    Turns the fused retrieval results into the prompt context: merges
+    overlapping/adjacent chunks of a page, drops near-duplicate sentences
+    and packs passages in rank order up to a token budget measured with the
+    generator's own tokenizer (the passage that crosses the budget is cut at
+    a sentence boundary). Tracks the tokens saved against the plain
+    "\\n\\n".join of the chunks.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+        self.budget = budget
+        self.dedup_threshold = dedup_threshold
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.raw_tokens = 0
+        self.packed_tokens = 0
+        self.sentences_dropped = 0
+        self.truncated = 0
+
+    @staticmethod
+    def count_tokens(text):
+        tokenizer = models.tokenizer
+        if tokenizer is None:
+            return len(clinical_tokenize(text))
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def pack(self, docs):
+        """
+        {"text", "raw_tokens", "tokens", "tokens_saved", "passages",
+        "sentences_dropped", "truncated"} for one query's retrieved docs.
+        """
+        with trace("context_pack"):
+            return self._pack(docs)
+
+    def _pack(self, docs):
+        raw_text = PASSAGE_SEPARATOR.join(d.page_content for d in docs)
+        if not docs:
+            return {"text": "", "raw_tokens": 0, "tokens": 0, "tokens_saved": 0,
+                    "passages": 0, "sentences_dropped": 0, "truncated": False}
+
+        passages, dropped = dedup_sentences(group_passages(docs), self.dedup_threshold)
+        sep_tokens = self.count_tokens(PASSAGE_SEPARATOR)
+        packed, used, truncated = [], 0, False
+        for sentences in passages:
+            text = _join(sentences)
+            cost = self.count_tokens(text) + (sep_tokens if packed else 0)
+            if self.budget <= 0 or used + cost <= self.budget:
+                packed.append(text)
+                used += cost
+                continue
+            # Cut the crossing passage at the last sentence that still fits
+            truncated = True
+            room = self.budget - used - (sep_tokens if packed else 0)
+            partial = []
+            for sentence, sep in sentences:
+                if self.count_tokens(_join(partial + [(sentence, sep)])) > room:
+                    break
+                partial.append((sentence, sep))
+            if partial:
+                packed.append(_join(partial))
+            break
+
+        text = PASSAGE_SEPARATOR.join(packed)
+        raw_tokens = self.count_tokens(raw_text)
+        tokens = self.count_tokens(text)
+        with self._lock:
+            self.queries += 1
+            self.raw_tokens += raw_tokens
+            self.packed_tokens += tokens
+            self.sentences_dropped += dropped
+            self.truncated += int(truncated)
+        logger.debug(f"Context packed: {raw_tokens} -> {tokens} tokens ({len(docs)} chunks -> {len(packed)} passages)")
+        return {
+            "text": text,
+            "raw_tokens": raw_tokens,
+            "tokens": tokens,
+            "tokens_saved": raw_tokens - tokens,
+            "passages": len(packed),
+            "sentences_dropped": dropped,
+            "truncated": truncated,
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "queries": self.queries,
+                "raw_tokens": self.raw_tokens,
+                "packed_tokens": self.packed_tokens,
+                "tokens_saved": self.raw_tokens - self.packed_tokens,
+                "avg_tokens_saved": round((self.raw_tokens - self.packed_tokens) / self.queries, 1) if self.queries else 0.0,
+                "sentences_dropped": self.sentences_dropped,
+                "truncated": self.truncated,
+            }
+
+
+# Shared packer for the API, Gradio app and benchmark
+context_packer = ContextPacker()
+
+
+def pack_context(docs):
+    return context_packer.pack(docs)
+
+__all__ = [
+    "ContextPacker", "context_packer", "pack_context", "group_passages", "merge_texts",
+    "overlap_length", "dedup_sentences", "split_sentences",
+]
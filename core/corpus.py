@@ -0,0 +1,242 @@
+import threading
+import logging
+
+from langchain_core.documents import Document
+
+from config.settings import INDEX_DIR, RERANK_ENABLED, RERANK_CANDIDATES
+from core import models
+from core.cache import answer_cache
+from core.hybrid import HybridIndex, weighted_rrf, BM25_WEIGHT, DENSE_WEIGHT, TOP_K
+from core.telemetry import trace
+from core.tokenizer import clinical_tokenize
+from core.index_store import load_index, save_corpus_manifest, load_corpus_manifest
+from core.snapshot import ShardedIndex, load_snapshot_chunks
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Multi-Document Corpus
+# -----------------------------
+class CorpusManager:
+    """
+    Holds every indexed protocol at once. Adding, replacing or dropping a
+    document only touches that document's segment in the hybrid index, so
+    indexing cost is proportional to the change, not to the corpus.
+
+    index_dir / cache default to the serving ones; a scratch corpus (see
+    evaluation.extraction_benchmark) passes its own so it never touches them.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, cache=answer_cache):
+        self.index_dir = index_dir
+        self.cache = cache
+        self._lock = threading.RLock()
+        self.documents = {}     # doc_id -> {"key", "num_chunks"}
+        self.chunks = {}        # doc_id -> [Document, ...]
+        self.index = HybridIndex()
+        self.snapshot_dir = None    # set once a read-only snapshot is attached
+
+    # -------- Mutations --------
+    def _check_writable(self):
+        if self.snapshot_dir is not None:
+            raise RuntimeError(f"Corpus is a read-only snapshot ({self.snapshot_dir}); rebuild the snapshot to change it.")
+
+    def add_document(self, doc_id, key, persist=True, build=True):
+        """
+        Add (or replace) a document from a saved index. Returns False if
+        already current. build=False leaves the dense index to a later
+        build_dense() (bulk loads).
+        """
+        self._check_writable()
+        current = self.documents.get(doc_id)
+        if current is not None and current["key"] == key:
+            return False
+
+        # Load outside the lock: queries keep using the old version meanwhile
+        index = load_index(key, self.index_dir)
+        # chunk = position in the document, so context packing can find neighbours
+        chunks = [
+            Document(page_content=text, metadata=dict(meta, doc_id=doc_id, chunk=i))
+            for i, (text, meta) in enumerate(zip(index["texts"], index["metadatas"]))
+        ]
+        with self._lock:
+            # Atomic swap of the old segment for the new one
+            self.index.add_segment(doc_id, index["bm25"], index["vectors"])
+            self.chunks[doc_id] = chunks
+            self.documents[doc_id] = {"key": key, "num_chunks": len(chunks)}
+            self.cache.invalidate(doc_id)
+            if persist:
+                self._save_manifest()
+            logger.info(f"Corpus: added '{doc_id}' ({len(chunks)} chunks)")
+        if build:
+            self.build_dense()
+        return True
+
+    def remove_document(self, doc_id):
+        self._check_writable()
+        with self._lock:
+            if doc_id not in self.documents:
+                return False
+            self.index.remove_segment(doc_id)
+            self.cache.invalidate(doc_id)
+            del self.documents[doc_id]
+            del self.chunks[doc_id]
+            self._save_manifest()
+            logger.info(f"Corpus: removed '{doc_id}'")
+        self.build_dense()
+        return True
+
+    def build_dense(self):
+        """Rebuild / extend the dense index outside the lock; queries use exact search until it is swapped in."""
+        index = self.index
+        if not isinstance(index, HybridIndex):
+            return
+        try:
+            index.build_dense(self._lock)
+        except Exception:
+            # Queries stay correct (exact search); the next change retries the build
+            logger.exception(f"Dense index ({index.dense_index.kind}) build failed; serving exact dense search")
+
+    def _save_manifest(self):
+        save_corpus_manifest({doc_id: d["key"] for doc_id, d in self.documents.items()}, self.index_dir)
+
+    def restore(self):
+        """Re-attach every document listed in the on-disk corpus manifest."""
+        manifest = load_corpus_manifest(self.index_dir)
+        for doc_id, key in manifest.items():
+            self.add_document(doc_id, key, persist=False, build=False)
+        self.build_dense()
+        return len(manifest)
+
+    def attach_snapshot(self, snapshot_dir, shard_servers=None):
+        """
+        Serve a read-only snapshot (core.snapshot) instead of the mutable
+        index: arrays are memory-mapped and shared by every worker process,
+        shards listed in shard_servers are searched over RPC.
+        """
+        index = ShardedIndex(snapshot_dir, shard_servers)
+        chunks = {
+            doc_id: [
+                Document(page_content=text, metadata=dict(meta, doc_id=doc_id, chunk=i))
+                for i, (text, meta) in enumerate(zip(texts, metadatas))
+            ]
+            for doc_id, (texts, metadatas) in load_snapshot_chunks(snapshot_dir).items()
+        }
+        with self._lock:
+            self.index = index
+            self.chunks = chunks
+            self.documents = {d: dict(info) for d, info in index.manifest["documents"].items()}
+            self.snapshot_dir = snapshot_dir
+            self.cache.clear()
+        logger.info(f"Corpus: attached snapshot {snapshot_dir} ({len(self.documents)} documents, {len(index.shards)} shard(s))")
+        return len(self.documents)
+
+    def warm_up(self):
+        """Build the search arrays (or reach the shard servers) before the first query."""
+        if self.is_empty():
+            return
+        if self.snapshot_dir is not None:
+            self.index.warm_up()
+            return
+        self.build_dense()
+        with self._lock:
+            self.index.merged()
+
+    def list_documents(self):
+        with self._lock:
+            return [
+                {"doc_id": doc_id, "key": d["key"], "num_chunks": d["num_chunks"]}
+                for doc_id, d in self.documents.items()
+            ]
+
+    def is_empty(self):
+        return len(self.index) == 0
+
+    def scope_key(self, doc_ids=None):
+        """Identity of the documents a query runs against (changes whenever one is re-indexed)."""
+        with self._lock:
+            selected = doc_ids if doc_ids else self.documents.keys()
+            return tuple(sorted((d, self.documents[d]["key"]) for d in selected if d in self.documents))
+
+    def chunk_vectors(self, docs):
+        """
+        Indexed vectors of retrieved chunks, looked up by (doc_id, chunk) -
+        nothing is re-embedded. Chunks whose document was replaced since
+        retrieval are skipped.
+        """
+        with self._lock:
+            refs = []
+            for d in docs:
+                doc_id, row = d.metadata.get("doc_id"), d.metadata.get("chunk")
+                current = self.chunks.get(doc_id, [])
+                if row is not None and row < len(current) and current[row] is d:
+                    refs.append((doc_id, row))
+            return self.index.chunk_vectors(refs)
+
+    # -------- Hybrid --------
+    def retrieve_batch(self, queries, doc_ids=None, k=TOP_K, query_vectors=None, dense_index=None,
+                       rerank=None, candidates=RERANK_CANDIDATES, top_n=None):
+        """
+        Hybrid retrieval for many queries at once: one encoder pass for all
+        query embeddings and one vectorized scoring call per retrieval side.
+        dense_index overrides the dense side (see evaluation.ann_benchmark).
+
+        With rerank (default RERANK_ENABLED) each side over-retrieves
+        candidates hits and the cross-encoder keeps the best top_n of the
+        fused list (see core.rerank).
+        """
+        if self.is_empty() or not queries:
+            return [[] for _ in queries]
+        reranker = self._reranker(rerank)
+        fetch_k = max(k, candidates) if reranker is not None else k
+        if query_vectors is None:
+            query_vectors = models.embedding_model.embed_queries(list(queries))
+        with self._lock:
+            refs = self.index.search_batch([clinical_tokenize(q) for q in queries], query_vectors, k=fetch_k, seg_ids=doc_ids, dense_index=dense_index)
+            ranked = [
+                [
+                    (BM25_WEIGHT, [self.chunks[d][r] for d, r in bm25_refs]),
+                    (DENSE_WEIGHT, [self.chunks[d][r] for d, r in dense_refs]),
+                ]
+                for bm25_refs, dense_refs in refs
+            ]
+        # Weighted reciprocal rank fusion of BM25 + dense, as EnsembleRetriever does
+        with trace("fusion"):
+            fused = [weighted_rrf(lists, key=lambda doc: doc.page_content) for lists in ranked]
+        if reranker is None:
+            return fused
+        with trace("rerank"):
+            return [reranker.rerank(q, docs[:candidates], top_n=top_n) for q, docs in zip(queries, fused)]
+
+    def retrieve(self, query, doc_ids=None, k=TOP_K, query_vector=None, rerank=None):
+        if self.is_empty():
+            return []
+        query_vectors = None if query_vector is None else [query_vector]
+        return self.retrieve_batch([query], doc_ids=doc_ids, k=k, query_vectors=query_vectors, rerank=rerank)[0]
+
+    @staticmethod
+    def _reranker(rerank):
+        if rerank is None:
+            rerank = RERANK_ENABLED
+        return models.load_reranker() if rerank else None
+
+    def as_retriever(self, doc_ids=None, k=TOP_K):
+        return CorpusRetriever(self, doc_ids, k)
+
+
+class CorpusRetriever:
+    """Minimal retriever facade so callers can keep using `.invoke(query)`."""
+
+    def __init__(self, corpus, doc_ids=None, k=TOP_K):
+        self.corpus = corpus
+        self.doc_ids = doc_ids
+        self.k = k
+
+    def invoke(self, query):
+        return self.corpus.retrieve(query, doc_ids=self.doc_ids, k=self.k)
+
+
+# Shared corpus for the API, Gradio app and benchmark
+corpus = CorpusManager()
+
+__all__ = ["CorpusManager", "CorpusRetriever", "corpus"]
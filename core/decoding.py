@@ -0,0 +1,164 @@
+import logging
+
+import numpy as np
+
+from config.settings import ANSWER_MAX_NEW_TOKENS, REASON_MAX_NEW_TOKENS
+from core.backends import GENERATION_KWARGS, NOT_FOUND_ANSWER
+from core.telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Generation Profiles
+# -----------------------------
+# stop: generation ends once the text ends with one of these and they are cut off
+# stop_after: same, but the stop string is kept (the not-found sentence is a whole answer)
+# allowed: the only strings the first token may start (constrained verdicts)
+PROFILES = {
+    "answer": {
+        "max_new_tokens": ANSWER_MAX_NEW_TOKENS,
+        "repetition_penalty": GENERATION_KWARGS["repetition_penalty"],
+        "stop": ["[INST]", "\nQuestion:", "\nQ:", "\nContext:"],
+        "stop_after": [NOT_FOUND_ANSWER],
+    },
+    "reasoning": {
+        "max_new_tokens": REASON_MAX_NEW_TOKENS,
+        "repetition_penalty": GENERATION_KWARGS["repetition_penalty"],
+        "stop": ["[INST]", "\nInput A:"],
+    },
+    "verdict": {
+        "max_new_tokens": 1,
+        "repetition_penalty": 1.0,
+        "allowed": ["0", "1"],
+    },
+}
+
+SHORTCUTS = registry.counter(
+    "rag_not_found_shortcuts_total", "Answers returned as not-found without an LLM call (low retrieval similarity)."
+)
+
+
+def label_token_ids(tokenizer, label):
+    """Token ids the model may use to start `label` (bare and SentencePiece '▁'-prefixed forms)."""
+    ids = {tokenizer.encode(label, add_special_tokens=False)[-1]}
+    spiece = tokenizer.convert_tokens_to_ids("▁" + label)
+    if spiece is not None and spiece != tokenizer.unk_token_id:
+        ids.add(spiece)
+    return sorted(ids)
+
+
+class AllowedTokens:
+    """Logits processor masking every token but token_ids, so a 1-token verdict is always '0' or '1'."""
+
+    def __init__(self, token_ids):
+        import torch
+        self.token_ids = torch.tensor(sorted(token_ids), dtype=torch.long)
+
+    def __call__(self, input_ids, scores):
+        import torch
+        mask = torch.full_like(scores, float("-inf"))
+        mask[:, self.token_ids.to(scores.device)] = 0.0
+        return scores + mask
+
+# -----------------------------
+# Profile -> generate() kwargs
+# -----------------------------
+_hooks = {}     # (id(tokenizer), profile) -> (logits processors, stopping criteria)
+
+
+def _profile_hooks(name, tokenizer):
+    """Built once per tokenizer: StopStringCriteria precomputes token/stop-string overlaps for the vocabulary."""
+    key = (id(tokenizer), name)
+    if key not in _hooks:
+        from transformers import StopStringCriteria
+        profile = PROFILES[name]
+        processors, criteria = [], []
+        if profile.get("allowed"):
+            processors.append(AllowedTokens([i for label in profile["allowed"] for i in label_token_ids(tokenizer, label)]))
+        stops = profile.get("stop", []) + profile.get("stop_after", [])
+        if stops:
+            criteria.append(StopStringCriteria(tokenizer, stops))
+        _hooks[key] = (processors, criteria)
+    return _hooks[key]
+
+
+def generate_kwargs(name, tokenizer, logits_processor=(), stopping_criteria=()):
+    """generate() / text-generation pipeline kwargs for one profile, per-call hooks appended."""
+    from transformers import LogitsProcessorList, StoppingCriteriaList
+    profile = PROFILES[name]
+    processors, criteria = _profile_hooks(name, tokenizer)
+    return dict(
+        GENERATION_KWARGS,
+        max_new_tokens=profile["max_new_tokens"],
+        repetition_penalty=profile["repetition_penalty"],
+        logits_processor=LogitsProcessorList(processors + list(logits_processor)),
+        stopping_criteria=StoppingCriteriaList(criteria + list(stopping_criteria)),
+    )
+
+
+def profile_llm(backend, name):
+    """
+    backend.llm bound to a profile. HF pipelines take the generate kwargs
+    per call; remote model servers get the profile name and apply it there;
+    the stub ignores both.
+    """
+    if name is None:
+        return backend.llm
+    if backend.pipeline is not None:
+        return backend.llm.bind(pipeline_kwargs=generate_kwargs(name, backend.tokenizer))
+    return backend.llm.bind(profile=name)
+
+# -----------------------------
+# Output Trimming
+# -----------------------------
+def trim(name, text):
+    """Cut the generated text at the first stop string of the profile (stop_after strings are kept)."""
+    profile = PROFILES[name]
+    cut = len(text)
+    for stop in profile.get("stop", []):
+        i = text.find(stop)
+        if i != -1:
+            cut = min(cut, i)
+    for stop in profile.get("stop_after", []):
+        i = text.find(stop)
+        if i != -1:
+            cut = min(cut, i + len(stop))
+    return text[:cut].rstrip() if cut < len(text) else text
+
+
+def trim_stream(name, pieces):
+    """trim() for streamed pieces: holds back enough characters that a stop string is never half-emitted."""
+    profile = PROFILES[name]
+    stops = profile.get("stop", []) + profile.get("stop_after", [])
+    hold = max((len(s) for s in stops), default=0)
+    text, emitted = "", 0
+    for piece in pieces:
+        text += piece
+        trimmed = trim(name, text)
+        if len(trimmed) < len(text):
+            if len(trimmed) > emitted:
+                yield trimmed[emitted:]
+            return
+        safe = len(text) - hold
+        if safe > emitted:
+            yield text[emitted:safe]
+            emitted = safe
+    if len(text) > emitted:
+        yield text[emitted:]
+
+# -----------------------------
+# Not-Found Shortcut
+# -----------------------------
+def retrieval_confidence(query_vector, chunk_vectors):
+    """Best cosine similarity between the query and the retrieved chunks (-1.0 when nothing was retrieved)."""
+    V = np.asarray(chunk_vectors, dtype=np.float32)
+    if V.size == 0:
+        return -1.0
+    q = np.asarray(query_vector, dtype=np.float32)
+    sims = V @ q / (np.linalg.norm(V, axis=1) * np.linalg.norm(q) + 1e-12)
+    return float(sims.max())
+
+__all__ = [
+    "PROFILES", "AllowedTokens", "label_token_ids", "generate_kwargs", "profile_llm", "trim", "trim_stream",
+    "retrieval_confidence", "SHORTCUTS",
+]
@@ -0,0 +1,191 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config.settings import (
+    EMBEDDING_MODEL_NAME, EMBEDDING_ENGINE, device, HF_CACHE_DIR,
+    EMBED_ENCODE_BATCH_SIZE, EMBED_CACHE_PATH,
+)
+from core.telemetry import trace
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# On-Disk Vector Cache
+# -----------------------------
+class VectorCache:
+    """
+    Persistent text -> vector store (SQLite), keyed by sha256 of the model
+    tag and the text, so boilerplate repeated across protocols and
+    amendments is encoded once.
+    """
+
+    def __init__(self, path, model_tag):
+        self.path = path
+        self.model_tag = model_tag
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_tag}\x00{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys, chunk=500):
+        """{key: float32 vector} for the keys that are cached."""
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for start in range(0, len(keys), chunk):
+                part = keys[start:start + chunk]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM vectors WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+# -----------------------------
+# Encoders
+# -----------------------------
+def load_encoder(engine=EMBEDDING_ENGINE):
+    """sentence_transformers (RAG_DEVICE), onnx (ONNX Runtime, CPU) or int8 (dynamic int8 Linear layers, CPU)."""
+    # Imported on first load, not at app import (pulls in torch and transformers)
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if engine == "sentence_transformers":
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, device=device(), cache_folder=HF_CACHE_DIR)
+    if engine == "onnx":
+        # Needs optimum[onnxruntime]; exported once and cached by sentence-transformers
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu", backend="onnx", cache_folder=HF_CACHE_DIR)
+    if engine == "int8":
+        encoder = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu", cache_folder=HF_CACHE_DIR)
+        encoder.eval()
+        return torch.ao.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    raise ValueError(f"Unknown embedding engine '{engine}'. Choose one of: sentence_transformers, onnx, int8")
+
+# -----------------------------
+# Embedding Service
+# -----------------------------
+class EmbeddingService(Embeddings):
+    """
+    Drop-in replacement for HuggingFaceEmbeddings (same vectors for the
+    default engine).
+
+    Document embeddings go through the disk cache and duplicates within a
+    call are encoded once. Cache misses are sorted by token length and
+    encoded in fixed-size batches, so each batch pads to a similar length.
+    Query embeddings skip the cache.
+    """
+
+    def __init__(self, engine=EMBEDDING_ENGINE, batch_size=EMBED_ENCODE_BATCH_SIZE, cache_path=EMBED_CACHE_PATH):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.encoder = load_encoder(engine)
+        self.cache = VectorCache(cache_path, f"{EMBEDDING_MODEL_NAME}|{engine}") if cache_path else None
+        self._stats_lock = threading.Lock()
+        self.encoded = 0
+        self.cache_hits = 0
+        self.encode_sec = 0.0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    @property
+    def dimension(self):
+        return self.encoder.get_sentence_embedding_dimension()
+
+    def _token_lengths(self, texts):
+        ids = self.encoder.tokenizer(
+            texts, truncation=True, max_length=self.encoder.max_seq_length
+        )["input_ids"]
+        return np.array([len(i) for i in ids])
+
+    def _encode(self, texts):
+        """Length-bucketed encode of texts -> float32 array in input order."""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        start = time.time()
+        lengths = self._token_lengths(texts)
+        order = np.argsort(lengths, kind="stable")
+        out = None
+        padded = 0
+        for b in range(0, len(order), self.batch_size):
+            idx = order[b:b + self.batch_size]
+            vectors = self.encoder.encode(
+                [texts[i] for i in idx], batch_size=len(idx), convert_to_numpy=True, show_progress_bar=False
+            )
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[idx] = vectors
+            padded += int(lengths[idx].max()) * len(idx)
+        with self._stats_lock:
+            self.encoded += len(texts)
+            self.encode_sec += time.time() - start
+            self.real_tokens += int(lengths.sum())
+            self.padded_tokens += padded
+        return out
+
+    def embed_array(self, texts):
+        """Document vectors as one float32 array, served from the disk cache where possible."""
+        texts = list(texts)
+        if self.cache is None or not texts:
+            return self._encode(texts)
+        keys = [self.cache.key(t) for t in texts]
+        cached = self.cache.get_many(set(keys))
+        # Each distinct missing text is encoded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self._encode(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh.items())
+            cached.update(fresh)
+        with self._stats_lock:
+            self.cache_hits += len(texts) - len(missing)
+        return np.stack([cached[k] for k in keys])
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_queries(self, texts):
+        """Query vectors (no disk cache: queries rarely repeat verbatim and the answer cache covers that)."""
+        with trace("embed_query"):
+            return self._encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "engine": self.engine,
+                "encoded": self.encoded,
+                "cache_hits": self.cache_hits,
+                "encode_sec": round(self.encode_sec, 3),
+                "chunks_per_sec": round(self.encoded / self.encode_sec, 2) if self.encode_sec > 0 else 0.0,
+                "padding_efficiency": round(self.real_tokens / self.padded_tokens, 4) if self.padded_tokens else 1.0,
+            }
+
+__all__ = ["EmbeddingService", "VectorCache", "load_encoder"]
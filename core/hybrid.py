@@ -0,0 +1,199 @@
+import logging
+import threading
+import contextlib
+
+import numpy as np
+
+from core.ann import FlatDenseIndex, make_dense_index, top_k
+from core.sparse import BM25Index, BM25_K1, BM25_B, BM25_EPSILON
+from core.telemetry import trace
+
+logger = logging.getLogger(__name__)
+
+# Same fusion settings as the original EnsembleRetriever([bm25, chroma], [0.4, 0.6])
+BM25_WEIGHT = 0.4
+DENSE_WEIGHT = 0.6
+RRF_C = 60
+TOP_K = 3
+
+# -----------------------------
+# Vectorized Hybrid Index
+# -----------------------------
+class HybridIndex:
+    """
+    BM25 + dense retrieval over NumPy/SciPy arrays instead of per-document
+    Python loops.
+
+    Each document is stored as a segment: compact BM25 postings in the
+    sparse engine (core.sparse) plus its float32 vectors. Adding or removing
+    a segment only updates the global document frequencies; the contiguous
+    search arrays are re-merged lazily on the next query.
+
+    The dense side is a pluggable index (core.ann: flat, hnsw, ivfpq),
+    brought up to date by build_dense() - outside the owner's lock, so
+    queries never wait for an ANN build. Until it is swapped in, queries
+    use an exact flat index over the current segments.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON, dense_index=None):
+        self.sparse = BM25Index(k1, b, epsilon)
+        self.dense_index = dense_index if dense_index is not None else make_dense_index()
+        self.vectors = {}                        # seg_id -> (n_chunks x dim) float32
+        self._version = 0                        # bumped by every change to the segments
+        self._dense_version = -1                 # version the dense index answers for
+        self._dense_contents = (None, [])        # (dense index, [(seg_id, vectors)] in its row order)
+        self._build_lock = threading.Lock()      # one dense build at a time
+        self._exact = (-1, None)                 # (version, exact FlatDenseIndex)
+
+    # -------- Mutations --------
+    def add_segment(self, seg_id, postings, vectors):
+        """postings: compact arrays from core.sparse.build_postings."""
+        self.sparse.add_segment(seg_id, postings)
+        self.vectors[seg_id] = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._version += 1
+
+    def remove_segment(self, seg_id):
+        self.vectors.pop(seg_id, None)
+        self._version += 1
+        return self.sparse.remove_segment(seg_id)
+
+    def set_dense_index(self, dense_index):
+        """Swap the dense index implementation; it serves queries once build_dense() has run."""
+        self.dense_index = dense_index
+        self._version += 1
+
+    def __len__(self):
+        return len(self.sparse)
+
+    @property
+    def segments(self):
+        return self.sparse.segments
+
+    # -------- Compaction --------
+    def merged(self):
+        """Sparse arrays (seg_ids, owner, local_row, bm25 ...); dense rows follow the same order."""
+        return self.sparse.merged()
+
+    @property
+    def dense_ready(self):
+        return self._dense_version == self._version
+
+    def build_dense(self, lock=None):
+        """
+        Bring the dense index up to date; returns False if it already was.
+        `lock` (the owner's) is held only to read the segment list and to
+        swap the result in. Segments appended after the ones already built
+        are added with the index's extend(); any other change rebuilds it.
+        """
+        lock = lock if lock is not None else contextlib.nullcontext()
+        with self._build_lock:
+            with lock:
+                if self.dense_ready:
+                    return False
+                version, index = self._version, self.dense_index
+                contents = [(s, self.vectors[s]) for s in self.merged()["seg_ids"]]
+            built_index, built = self._dense_contents
+            appended = (
+                built_index is index and built and len(built) <= len(contents)
+                and all(a[0] == b[0] and a[1] is b[1] for a, b in zip(built, contents))
+            )
+            if appended:
+                index.extend([v for _, v in contents[len(built):]])
+            else:
+                index.build([v for _, v in contents])
+            self._dense_contents = (index, contents)
+            with lock:
+                # A newer change is picked up by the build_dense() call that follows it
+                if self._version == version:
+                    self._dense_version = version
+                    self._exact = (-1, None)
+            logger.info(
+                f"Hybrid index: {index.kind} dense index {'extended' if appended else 'built'} over {len(index)} chunks"
+            )
+            return True
+
+    def exact_index(self):
+        """Exact flat index over the current segments, cached until they change (call under the owner's lock)."""
+        if isinstance(self.dense_index, FlatDenseIndex) and self.dense_ready:
+            return self.dense_index
+        version, exact = self._exact
+        if version != self._version:
+            exact = FlatDenseIndex()
+            exact.build(self.segment_vectors())
+            self._exact = (self._version, exact)
+        return exact
+
+    def segment_vectors(self, seg_ids=None):
+        """Per-segment vector arrays in merged row order (memory-mapped, not copied)."""
+        return [self.vectors[s] for s in (seg_ids if seg_ids is not None else self.sparse.merged()["seg_ids"])]
+
+    def chunk_vectors(self, refs):
+        """Stored vectors of [(seg_id, local_row), ...], in order."""
+        if not refs:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([self.vectors[s][r] for s, r in refs])
+
+    # -------- Scoring --------
+    def bm25_scores_batch(self, queries_terms):
+        """(n_chunks x n_queries) BM25 scores, touching only the postings of the query terms."""
+        return self.sparse.scores_batch(queries_terms)
+
+    def bm25_scores(self, query_terms):
+        return self.bm25_scores_batch([query_terms])[:, 0]
+
+    def dense_scores_batch(self, query_vectors):
+        """Exact (n_chunks x n_queries) negative squared L2 distance, whatever the dense index is."""
+        Q = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        return self.exact_index().scores(Q)
+
+    def dense_scores(self, query_vector):
+        return self.dense_scores_batch([query_vector])[:, 0]
+
+    def row_mask(self, seg_ids):
+        m = self.merged()
+        wanted = [i for i, s in enumerate(m["seg_ids"]) if s in set(seg_ids)]
+        return np.isin(m["owner"], wanted)
+
+    def search_batch(self, queries_terms, query_vectors, k=TOP_K, seg_ids=None, dense_index=None):
+        """
+        Top-k (seg_id, local_row) refs per query from each side. BM25 goes to
+        the pruned sparse engine; the dense side to the dense index (or to
+        dense_index, an already built alternative, for benchmarks), or to the
+        exact index while build_dense() has not caught up with the segments.
+        """
+        m = self.merged()
+        if m["bm25"].shape[0] == 0:
+            return [([], []) for _ in queries_terms]
+        mask = self.row_mask(seg_ids) if seg_ids else None
+        with trace("bm25"):
+            bm25_rows = self.sparse.search_batch(queries_terms, k, mask)
+        Q = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        with trace("dense"):
+            if dense_index is None:
+                dense_index = self.dense_index if self.dense_ready else self.exact_index()
+            dense_rows = dense_index.search(Q, k, mask)
+        return [
+            (self._to_refs(bm25_rows[q]), self._to_refs(dense_rows[q]))
+            for q in range(len(queries_terms))
+        ]
+
+    def search(self, query_terms, query_vector, k=TOP_K, seg_ids=None):
+        """Top-k refs from each side: ([(seg_id, local_row)...] bm25, [...] dense)."""
+        return self.search_batch([query_terms], [query_vector], k=k, seg_ids=seg_ids)[0]
+
+    def _to_refs(self, rows):
+        m = self.merged()
+        return [(m["seg_ids"][m["owner"][r]], int(m["local_row"][r])) for r in rows]
+
+
+def weighted_rrf(ranked_lists, key=lambda item: item, c=RRF_C):
+    """Weighted reciprocal rank fusion, deduplicated on key (EnsembleRetriever semantics)."""
+    scores, items = {}, {}
+    for weight, ranked in ranked_lists:
+        for rank, item in enumerate(ranked, start=1):
+            item_key = key(item)
+            scores[item_key] = scores.get(item_key, 0.0) + weight / (rank + c)
+            items.setdefault(item_key, item)
+    return [items[item_key] for item_key in sorted(scores, key=scores.get, reverse=True)]
+
+__all__ = ["HybridIndex", "top_k", "weighted_rrf"]
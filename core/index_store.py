@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import logging
+
+import numpy as np
+
+from config.settings import INDEX_DIR
+from core.sparse import save_postings, load_postings
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout changes so stale indexes are never reused
+INDEX_FORMAT_VERSION = 2
+CORPUS_FILE = "corpus.json"
+
+# -----------------------------
+# Cache Key
+# -----------------------------
+def compute_index_key(pdf_path, config):
+    """Hash of the PDF bytes + splitter/embedding config (content-addressed key)."""
+    h = hashlib.sha256()
+    # Hash in blocks so large protocols are never read into memory at once
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    h.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    h.update(f"format={INDEX_FORMAT_VERSION}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def index_path(key, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, key)
+
+
+def has_index(key, index_dir=INDEX_DIR):
+    return os.path.exists(os.path.join(index_path(key, index_dir), "manifest.json"))
+
+# -----------------------------
+# Save / Load
+# -----------------------------
+def save_index(key, texts, metadatas, vectors, postings, config, index_dir=INDEX_DIR):
+    """
+    Persist one protocol index:
+    - vectors.npy   : dense embeddings (float32, memory-mappable)
+    - chunks.json   : chunk texts + page metadata
+    - bm25.npz      : compact BM25 postings (core.sparse.build_postings)
+    - manifest.json : written last, marks the index as complete
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    final_dir = index_path(key, index_dir)
+    if has_index(key, index_dir):
+        return final_dir
+
+    # Write into a temp dir and rename, so a crash never leaves a half index
+    tmp_dir = tempfile.mkdtemp(prefix=f".{key[:12]}-", dir=index_dir)
+    try:
+        np.save(os.path.join(tmp_dir, "vectors.npy"), np.ascontiguousarray(vectors, dtype=np.float32))
+        with open(os.path.join(tmp_dir, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"texts": texts, "metadatas": metadatas}, f)
+        save_postings(os.path.join(tmp_dir, "bm25.npz"), postings)
+        manifest = {
+            "key": key,
+            "format": INDEX_FORMAT_VERSION,
+            "num_chunks": len(texts),
+            "dim": int(vectors.shape[1]) if len(texts) else 0,
+            "config": config,
+        }
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        if os.path.exists(final_dir):
+            shutil.rmtree(final_dir)
+        os.replace(tmp_dir, final_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    logger.info(f"Saved index {key[:12]} ({len(texts)} chunks) to {final_dir}")
+    return final_dir
+
+
+def load_index(key, index_dir=INDEX_DIR):
+    """Load a saved index. Vectors are memory-mapped, not read into RAM."""
+    path = index_path(key, index_dir)
+    with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(os.path.join(path, "chunks.json"), encoding="utf-8") as f:
+        chunks = json.load(f)
+    postings = load_postings(os.path.join(path, "bm25.npz"))
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+    logger.info(f"Loaded index {key[:12]} ({manifest['num_chunks']} chunks) from {path}")
+    return {
+        "key": key,
+        "manifest": manifest,
+        "texts": chunks["texts"],
+        "metadatas": chunks["metadatas"],
+        "vectors": vectors,
+        "bm25": postings,
+    }
+
+# -----------------------------
+# Corpus Manifest (doc_id -> index key, for cold starts)
+# -----------------------------
+def save_corpus_manifest(documents, index_dir=INDEX_DIR):
+    os.makedirs(index_dir, exist_ok=True)
+    tmp = os.path.join(index_dir, f".{CORPUS_FILE}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(documents, f, indent=2)
+    os.replace(tmp, os.path.join(index_dir, CORPUS_FILE))
+
+
+def load_corpus_manifest(index_dir=INDEX_DIR):
+    path = os.path.join(index_dir, CORPUS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        documents = json.load(f)
+    # Drop entries whose index was deleted from disk
+    return {doc_id: key for doc_id, key in documents.items() if has_index(key, index_dir)}
+
+__all__ = [
+    "compute_index_key", "index_path", "has_index",
+    "save_index", "load_index", "save_corpus_manifest", "load_corpus_manifest",
+]
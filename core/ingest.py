@@ -0,0 +1,106 @@
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from core.layout import extract_page_range, SectionChunker
+
+# NOTE: keep this module light (no torch / models imports) - it is imported
+# by every parser process.
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# -----------------------------
+# Page-Range Parsing (runs in worker processes)
+# -----------------------------
+def parse_page_range(pdf_path, start, end, chunk_size, chunk_overlap, separators):
+    """Extract + split pages [start, end). Returns (texts, metadatas) for that range."""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=separators)
+    texts, metadatas = [], []
+    page_offset = 1
+    with fitz.open(pdf_path) as doc:
+        for i in range(start, end):
+            page_text = doc[i].get_text("text")
+            # Split text but keep the page number in metadata
+            for chunk in text_splitter.split_text(page_text):
+                texts.append(chunk)
+                metadatas.append({"page": i - page_offset + 1})
+    return texts, metadatas
+
+
+def count_pages(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        return len(doc)
+
+
+def get_parser_pool(workers):
+    """Long-lived parser pool, so process start-up is paid once and not per document."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn: never fork a process that may hold CUDA / tokenizer threads
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+# -----------------------------
+# Streaming Parse Pipeline
+# -----------------------------
+def iter_page_batches(pdf_path, chunk_size, chunk_overlap, separators,
+                      workers=1, pages_per_task=16, min_parallel_pages=32, layout=False, page_cache_dir=""):
+    """
+    Yield (texts, metadatas, pages_done) per page range, in page order.
+
+    Large documents are parsed across a process pool (PyMuPDF holds the GIL,
+    so threads would not help). At most 2 * workers ranges are in flight, so
+    the pool does not run far ahead of the caller, which embeds one batch
+    while the pool parses the next ones.
+
+    layout=True: workers return page elements (see core.layout, cached per
+    page under page_cache_dir) and chunking happens here, in page order, so
+    the current section carries over from one range to the next.
+    """
+    num_pages = count_pages(pdf_path)
+    ranges = [(s, min(s + pages_per_task, num_pages)) for s in range(0, num_pages, pages_per_task)]
+    if layout:
+        chunker = SectionChunker(chunk_size, chunk_overlap, separators)
+        task, args, finish = extract_page_range, (page_cache_dir,), chunker.chunk_pages
+    else:
+        chunker = None
+        task, args, finish = parse_page_range, (chunk_size, chunk_overlap, separators), lambda result: result
+
+    if workers <= 1 or num_pages < min_parallel_pages:
+        for start, end in ranges:
+            texts, metadatas = finish(task(pdf_path, start, end, *args))
+            yield texts, metadatas, end
+    else:
+        pool = get_parser_pool(workers)
+        max_in_flight = 2 * workers
+        pending = []
+        next_range = 0
+        try:
+            while pending or next_range < len(ranges):
+                while next_range < len(ranges) and len(pending) < max_in_flight:
+                    start, end = ranges[next_range]
+                    pending.append((end, pool.submit(task, pdf_path, start, end, *args)))
+                    next_range += 1
+                end, future = pending.pop(0)
+                texts, metadatas = finish(future.result())
+                yield texts, metadatas, end
+        finally:
+            # Caller stopped early (error / cancelled job): drop ranges not started yet
+            for _, future in pending:
+                future.cancel()
+    if chunker is not None:
+        logger.info(f"Layout extraction: {chunker.pages} pages, {chunker.cache_hits} from the page cache")
+
+__all__ = ["parse_page_range", "count_pages", "get_parser_pool", "iter_page_batches"]
@@ -0,0 +1,97 @@
+import os
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import INDEXING_WORKERS, JOB_HISTORY_SIZE
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Background Ingestion Jobs
+# -----------------------------
+class IngestionJobs:
+    """
+    Runs process_pdf in the background and tracks progress per job.
+
+    Uploads return a job id immediately; parsing, splitting and embedding
+    happen on the indexing pool and report progress through a callback.
+    The corpus keeps serving the previous version of a document until the
+    finished index is swapped in.
+    """
+
+    def __init__(self, workers=INDEXING_WORKERS, history_size=JOB_HISTORY_SIZE):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="indexing")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()    # job_id -> job dict, oldest first
+        self.history_size = history_size
+
+    def submit(self, fn, pdf_path, doc_id, cleanup=True):
+        """Queue fn(pdf_path, doc_id=..., progress=...) and return the job id."""
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "doc_id": doc_id,
+            "status": "queued",
+            "progress": {"pages_total": 0, "pages_parsed": 0, "chunks_total": 0, "chunks_embedded": 0},
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._trim()
+        self._pool.submit(self._run, job_id, fn, pdf_path, doc_id, cleanup)
+        return job_id
+
+    def _run(self, job_id, fn, pdf_path, doc_id, cleanup):
+        self._update(job_id, status="running")
+
+        def progress(**fields):
+            with self._lock:
+                self._jobs[job_id]["progress"].update(fields)
+
+        try:
+            result = fn(pdf_path, doc_id=doc_id, progress=progress)
+            self._update(job_id, status="succeeded", result=result, finished_at=time.time())
+        except Exception as e:
+            logger.exception(f"Ingestion job {job_id} ('{doc_id}') failed")
+            self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+        finally:
+            if cleanup and os.path.exists(pdf_path):
+                os.remove(pdf_path)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _trim(self):
+        # Forget the oldest finished jobs once the history is full
+        finished = [jid for jid, j in self._jobs.items() if j["status"] in ("succeeded", "failed")]
+        while len(self._jobs) > self.history_size and finished:
+            del self._jobs[finished.pop(0)]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job, progress=dict(job["progress"]))
+
+    def list(self):
+        with self._lock:
+            return [dict(j, progress=dict(j["progress"])) for j in self._jobs.values()]
+
+    def stats(self):
+        with self._lock:
+            statuses = [j["status"] for j in self._jobs.values()]
+        return {s: statuses.count(s) for s in ("queued", "running", "succeeded", "failed")}
+
+
+# Shared job registry for the API process
+ingestion_jobs = IngestionJobs()
+
+__all__ = ["IngestionJobs", "ingestion_jobs"]
@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import hashlib
+import tempfile
+
+import fitz
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# NOTE: imported by every parser process, like core.ingest - no torch / models imports.
+
+# Bump when extraction output changes: part of the page cache key and of the index key
+LAYOUT_VERSION = "layout-v1"
+
+# Running headers / footers live in these page-height fractions
+HEADER_BAND = 0.07
+FOOTER_BAND = 0.9
+MAX_MARGIN_TEXT = 120
+MAX_HEADING_CHARS = 120
+BOLD = 16
+SUPERSCRIPT = 1
+
+_NUMBERED = re.compile(r"^(\d+(?:\.\d+)*)\.?\s+\S")
+_CAPTION = re.compile(r"^(figure|table|fig\.)\s*\d", re.IGNORECASE)
+_MARKER = re.compile(r"^[\d,\-–\s]+$")
+_LEADER = re.compile(r"\s*(?:\.\s?){4,}\s*")     # table-of-contents dot leaders
+
+# -----------------------------
+# Page -> Elements (headings, paragraphs, table rows)
+# -----------------------------
+def page_hash(doc, page):
+    """Content hash of one page: its content streams, form XObjects and size (not the file it sits in)."""
+    h = hashlib.sha256(LAYOUT_VERSION.encode("utf-8"))
+    h.update(page.read_contents())
+    for xref, *_ in page.get_xobjects():
+        h.update(doc.xref_stream(xref) or b"")
+    h.update(repr(tuple(page.rect)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _emphasized(spans, body_size):
+    """Every word of the line is bold or clearly larger than body text."""
+    words = [s for s in spans if s["text"].strip()]
+    return bool(words) and (all(s["flags"] & BOLD for s in words) or min(s["size"] for s in words) >= body_size + 1.5)
+
+
+def _heading_level(text, spans, body_size):
+    """Numbering depth for a heading line ("3.2.5. Results" -> 3, unnumbered -> 1), else None."""
+    if len(text) > MAX_HEADING_CHARS or _CAPTION.match(text) or not re.search(r"[A-Za-z]", text):
+        return None
+    if "..." in text or not _emphasized(spans, body_size):     # table-of-contents entries are not headings
+        return None
+    numbered = _NUMBERED.match(text)
+    if numbered:
+        return numbered.group(1).count(".") + 1
+    # Unnumbered: only short, title-like lines ("Study Design", "ABSTRACT")
+    title_like = text[:1].isupper() and len(text.split()) <= 12 and not text.endswith((".", ",", ";"))
+    return 1 if title_like else None
+
+
+def _reading_order(blocks, width):
+    """Multi-column order: full-width blocks split the page into bands, each band reads left column then right."""
+    mid = width / 2
+    bands, band = [], []
+    for b in sorted(blocks, key=lambda b: (b["bbox"][1], b["bbox"][0])):
+        x0, _, x1, _ = b["bbox"]
+        if x0 < mid - 10 and x1 > mid + 10:
+            if band:
+                bands.append(band)
+                band = []
+            bands.append([b])
+        else:
+            band.append(b)
+    if band:
+        bands.append(band)
+    ordered = []
+    for band in bands:
+        ordered += sorted(band, key=lambda b: (b["bbox"][0] >= mid - 10, b["bbox"][1]))
+    return ordered
+
+
+def _baseline_lines(lines):
+    """Spans per visual line: list labels ("1.1.") come as separate lines on the heading's baseline."""
+    merged = []
+    for line in lines:
+        x0, y0, x1, y1 = line["bbox"]
+        if merged and abs(y1 - merged[-1]["bbox"][3]) < 3 and x0 >= merged[-1]["bbox"][2] - 1:
+            prev = merged[-1]
+            prev["spans"] += line["spans"]
+            prev["bbox"] = (prev["bbox"][0], min(prev["bbox"][1], y0), x1, max(prev["bbox"][3], y1))
+        else:
+            merged.append({"bbox": tuple(line["bbox"]), "spans": list(line["spans"])})
+    return merged
+
+
+def _join_lines(lines):
+    """Lines of one paragraph -> one string, re-joining words hyphenated across lines."""
+    text = ""
+    for line in lines:
+        if text.endswith("-") and line[:1].islower():
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}" if text else line
+    return text
+
+
+def _table_rows(table):
+    """Header-labelled rows ("Visit: Month 6; HbA1c: yes"), so each row reads on its own."""
+    rows = [[re.sub(r"\s+", " ", c or "").strip() for c in row] for row in table.extract()]
+    rows = [r for r in rows if any(r)]
+    if len(rows) < 2:
+        return [" | ".join(c for c in r if c) for r in rows]
+    header = [h or f"col{j + 1}" for j, h in enumerate(rows[0])]
+    out = []
+    for row in rows[1:]:
+        cells = [f"{h}: {c}" for h, c in zip(header, row) if c]
+        if cells:
+            out.append("; ".join(cells))
+    return out
+
+
+def extract_page(page):
+    """
+    Structured elements of one page, in reading order:
+    {"kind": "heading", "text", "level"}, {"kind": "text", "text"} (one per
+    paragraph) and {"kind": "table", "rows"}. Running headers / footers,
+    page numbers and superscript citation markers are dropped.
+    """
+    height, width = page.rect.height, page.rect.width
+    # Table detection (the slow part) only where there are ruling lines to detect tables from
+    drawings = page.get_drawings()
+    tables = page.find_tables().tables if drawings else []
+    table_boxes = [fitz.Rect(t.bbox) for t in tables]
+    # Vector figures: their bold axis labels / legends are not section headings
+    figure_boxes = [r for r in page.cluster_drawings(drawings=drawings) if r.width > 50 and r.height > 50] if drawings else []
+    blocks = [b for b in page.get_text("dict")["blocks"] if b["type"] == 0]
+
+    def in_margin(b):
+        x0, y0, x1, y1 = b["bbox"]
+        text_len = sum(len(s["text"]) for l in b["lines"] for s in l["spans"])
+        return text_len <= MAX_MARGIN_TEXT and (y1 <= HEADER_BAND * height or y0 >= FOOTER_BAND * height)
+
+    def inside(bbox, boxes):
+        r = fitz.Rect(bbox)
+        center = fitz.Point((r.x0 + r.x1) / 2, (r.y0 + r.y1) / 2)
+        return any(center in box for box in boxes)
+
+    blocks = [b for b in blocks if not in_margin(b) and not inside(b["bbox"], table_boxes)]
+    # Body size: the font size carrying the most characters (figure labels are many short spans)
+    chars = {}
+    for b in blocks:
+        for l in b["lines"]:
+            for s in l["spans"]:
+                chars[round(s["size"])] = chars.get(round(s["size"]), 0) + len(s["text"].strip())
+    body_size = max(chars, key=chars.get) if chars else 10
+
+    # Tables are placed where their top edge falls in the reading order
+    items = [{"bbox": t.bbox, "table": t} for t in tables] + blocks
+    elements = []
+    for item in _reading_order(items, width):
+        if "table" in item:
+            rows = _table_rows(item["table"])
+            if rows:
+                elements.append({"kind": "table", "rows": rows})
+            continue
+        paragraph, heading = [], None
+        for line in _baseline_lines(item["lines"]):
+            spans = [s for s in line["spans"] if not (s["flags"] & SUPERSCRIPT and _MARKER.match(s["text"]))]
+            text = _LEADER.sub(" ... ", re.sub(r"\s+", " ", "".join(s["text"] for s in spans))).strip()
+            if not text:
+                continue
+            if inside(line["bbox"], figure_boxes):
+                level = None
+            elif heading is not None and not _NUMBERED.match(text) and _emphasized(spans, body_size):
+                # Multi-line headings: consecutive emphasized lines of one block are one heading
+                heading["text"] += " " + text
+                continue
+            else:
+                level = _heading_level(text, spans, body_size)
+            if level is not None:
+                if paragraph:
+                    elements.append({"kind": "text", "text": _join_lines(paragraph)})
+                    paragraph = []
+                heading = {"kind": "heading", "text": text, "level": level}
+                elements.append(heading)
+            else:
+                paragraph.append(text)
+                heading = None
+        if paragraph:
+            elements.append({"kind": "text", "text": _join_lines(paragraph)})
+    return elements
+
+# -----------------------------
+# Per-Page Cache (one JSON file per page hash, shared by all parser processes)
+# -----------------------------
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+
+def load_page(cache_dir, key):
+    try:
+        with open(_cache_path(cache_dir, key), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_page(cache_dir, key, elements):
+    path = _cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Atomic: concurrent parser processes may write the same page
+    fd, tmp = tempfile.mkstemp(prefix=".page-", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(elements, f)
+        os.replace(tmp, path)
+    finally:
+        # Failed dump / replace: do not leave the temp file behind
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def extract_page_range(pdf_path, start, end, cache_dir=""):
+    """[(page_index, elements, cache_hit)] for pages [start, end); runs in the parser pool."""
+    pages = []
+    with fitz.open(pdf_path) as doc:
+        for i in range(start, end):
+            page = doc[i]
+            key = page_hash(doc, page) if cache_dir else None
+            elements = load_page(cache_dir, key) if key else None
+            hit = elements is not None
+            if not hit:
+                elements = extract_page(page)
+                if key:
+                    save_page(cache_dir, key, elements)
+            pages.append((i, elements, hit))
+    return pages
+
+# -----------------------------
+# Section-Aware Chunking (runs in the parent, in page order)
+# -----------------------------
+class SectionChunker:
+    """
+    Turns page elements into chunks that never cross a section, a page or
+    a table boundary. Paragraphs of one section on one page are split with
+    the usual recursive splitter; table rows are packed whole, each table
+    chunk led by its section title. The current section carries over to
+    the next page, so pages must be fed in order.
+    """
+
+    def __init__(self, chunk_size, chunk_overlap, separators):
+        self.chunk_size = chunk_size
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=separators)
+        self.sections = []      # heading stack: [(level, text), ...]
+        self._open = []         # paragraphs of the current section not chunked yet
+        self._lone_heading = False
+        self.pages = 0
+        self.cache_hits = 0
+
+    @property
+    def section(self):
+        return self.sections[-1][1] if self.sections else ""
+
+    def _emit(self, texts, metadatas, chunks, page, kind):
+        for chunk in chunks:
+            texts.append(chunk)
+            metadatas.append({"page": page, "section": self.section, "kind": kind})
+
+    def _flush(self, texts, metadatas, page):
+        # A heading with no text after it yet is kept for the next text (next page included)
+        if self._open and not self._lone_heading:
+            self._emit(texts, metadatas, self.splitter.split_text("\n\n".join(self._open)), page, "text")
+            self._open = []
+
+    def chunk_pages(self, pages):
+        """[(page_index, elements, cache_hit)] -> (texts, metadatas)."""
+        texts, metadatas = [], []
+        for page_index, elements, hit in pages:
+            self.pages += 1
+            self.cache_hits += int(hit)
+            # Same numbering as the plain-text parser (part of the gold dataset's page labels)
+            page = page_index
+            for element in elements:
+                if element["kind"] == "heading":
+                    self._flush(texts, metadatas, page)
+                    level = element["level"]
+                    self.sections = [s for s in self.sections if s[0] < level] + [(level, element["text"])]
+                    self._open, self._lone_heading = [element["text"]], True
+                elif element["kind"] == "text":
+                    self._open.append(element["text"])
+                    self._lone_heading = False
+                else:
+                    # Table chunks carry the section title themselves
+                    self._flush(texts, metadatas, page)
+                    self._open = []
+                    self._emit(texts, metadatas, self._table_chunks(element["rows"]), page, "table")
+            self._flush(texts, metadatas, page)
+        return texts, metadatas
+
+    def _table_chunks(self, rows):
+        title = f"{self.section}\n" if self.section else ""
+        chunks, current = [], title
+        for row in rows:
+            # A row longer than a chunk is split like text
+            pieces = self.splitter.split_text(row) if len(row) > self.chunk_size else [row]
+            for piece in pieces:
+                if current != title and len(current) + len(piece) + 1 > self.chunk_size:
+                    chunks.append(current.rstrip())
+                    current = title
+                current += piece + "\n"
+        if current != title:
+            chunks.append(current.rstrip())
+        return chunks
+
+__all__ = ["LAYOUT_VERSION", "extract_page", "extract_page_range", "page_hash", "load_page", "save_page", "SectionChunker"]
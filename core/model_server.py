@@ -0,0 +1,57 @@
+import argparse
+import threading
+import logging
+
+from config.settings import llm_backend, LLM_MODEL_NAME
+from core.backends import load_backend
+from core.decoding import profile_llm
+from core.rpc import RPCServer
+from core.telemetry import trace
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Model Server
+# -----------------------------
+class ModelServer:
+    """
+    Holds the one copy of the LLM for many API workers (RAG_LLM_BACKEND=remote
+    on their side). Batches are generated one at a time: the model is the
+    bottleneck and the API workers already coalesce concurrent queries.
+    """
+
+    def __init__(self, backend_name=None):
+        backend_name = backend_name or llm_backend()
+        if backend_name == "remote":
+            raise ValueError("A model server needs a local backend (set RAG_LLM_BACKEND to hf_bnb, hf, cpu_int8, onnx or stub).")
+        self.backend = load_backend(backend_name)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.prompts = 0
+
+    def ping(self):
+        return {"backend": self.backend.name, "model": LLM_MODEL_NAME, "batches": self.batches, "prompts": self.prompts}
+
+    def complete(self, prompts, profile=None):
+        """Raw completions decoded with the caller's profile (trimming happens in the caller's chain)."""
+        llm = profile_llm(self.backend, profile)
+        with self._lock, trace("generate"):
+            answers = llm.batch(list(prompts))
+            self.batches += 1
+            self.prompts += len(prompts)
+        return answers
+
+    def handlers(self):
+        return {"ping": self.ping, "complete": self.complete}
+
+
+if __name__ == "__main__":
+    # python -m core.model_server --address 0.0.0.0:7001
+    parser = argparse.ArgumentParser(description="Serve the LLM to API workers over RPC")
+    parser.add_argument("--address", default="127.0.0.1:7001")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    RPCServer(args.address, ModelServer().handlers()).serve_forever()
+
+__all__ = ["ModelServer"]
@@ -1,90 +1,342 @@
-import torch
-from langchain_huggingface import HuggingFaceEmbeddings, HuggingFacePipeline
+import time
+import queue
+import threading
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline, BitsAndBytesConfig
+from langchain_core.runnables import RunnableLambda
+from config.settings import llm_backend, PREFIX_CACHE_ENABLED, RERANK_ENABLED, SPECULATIVE_MODE, STREAM_TOKEN_TIMEOUT_SEC
+from core import decoding
+from core.backends import GENERATION_KWARGS, load_backend
+from core.embeddings import EmbeddingService
+from core.prefix_cache import PrefixKVCache
+from core.rerank import CrossEncoderReranker
+from core.speculative import SpeculativeDecoder, SpeculationTracker
+from core.telemetry import trace, GenerationTimer
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Optimal for your RTX 3060
-DEVICE = "cuda"
-COMPUTE_DTYPE = torch.bfloat16 
-EMBEDDING_MODEL_NAME = "NeuML/pubmedbert-base-embeddings" # Clinical standard
-LLM_MODEL_NAME = "BioMistral/BioMistral-7B-DARE"
+# NOTE: transformers, sentence-transformers, bitsandbytes and langchain-huggingface are
+# imported inside the loaders, so importing the app (and /health/live) stays fast.
+
+ANSWER_TEMPLATE = (
+    "<s>[INST] <<SYS>>\nYou are a clinical assistant. Use ONLY the context provided to answer. "
+    "If the answer is not in context, say 'Information not found in protocol.' "
+    "Example: Q: When is metformin stopped? A: Permanently discontinued if eGFR < 30 mL/min/1.73 m2.\n<</SYS>>\n\n"
+    "Context: {context}\n\nQuestion: {question} [/INST]"
+)
+AUDITOR_TEMPLATE = "<s>[INST] You are a Medical Auditor. Verify the following:\n{query} [/INST]"
 
 # shared globals 
 embedding_model = None
 llm_chain = None
 auditor_chain = None
 tokenizer = None
-# Model Loading (Optimized for 6GB VRAM)
+generation_pipeline = None
+answer_prompt = None
+auditor_prompt = None
+prefix_cache = None
+backend = None
+reranker = None
+speculative = None
+
+# Loader state: idle -> loading -> warming -> ready (or failed), plus seconds per step.
+# One lock per model: embeddings and the reranker never wait behind the LLM load.
+_embedding_lock = threading.Lock()
+_reranker_lock = threading.Lock()
+_llm_lock = threading.Lock()
+_loader_lock = threading.Lock()
+_loader_thread = None
+load_state = {"phase": "idle", "error": None, "started_at": None, "ready_at": None, "timings": {}}
+
+
+def _timed(step, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    load_state["timings"][step] = round(time.perf_counter() - start, 3)
+    return result
+
+# -----------------------------
+# Model Loading (engine chosen by RAG_LLM_BACKEND, see core.backends)
+# -----------------------------
+def load_embedding_model():
+    """Embeddings only (retrieval benchmarks and indexing tools do not need the LLM)."""
+    global embedding_model
+    with _embedding_lock:
+        if embedding_model is None:
+            logger.info("Loading Medical Embeddings...")
+            embedding_model = _timed("embedding", EmbeddingService)
+    return embedding_model
+
+
+def load_reranker():
+    """Cross-encoder for the optional rerank stage (see core.rerank)."""
+    global reranker
+    with _reranker_lock:
+        if reranker is None:
+            logger.info("Loading Cross-Encoder Reranker...")
+            reranker = _timed("reranker", CrossEncoderReranker)
+    return reranker
+
+
 def load_models():
-    global embedding_model, llm_chain, auditor_chain, tokenizer
-    
-    if embedding_model is None:
-        logger.info("Loading Medical Embeddings...")
-        embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-
-    if llm_chain is None:
-        logger.info("Loading BioMistral 7B in 4-bit...... This may take 2-3 minutes.")
-        
-        # 4-bit config to fit into ~5.5GB VRAM
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_use_double_quant=True,
-            bnb_4bit_compute_dtype=COMPUTE_DTYPE,
-            llm_int8_enable_fp32_cpu_offload=False 
-        )
-        
+    """Load everything once; safe to call from several threads (later callers wait, then return)."""
+    global llm_chain, auditor_chain, tokenizer, generation_pipeline, answer_prompt, auditor_prompt, prefix_cache, backend, speculative
+
+    load_embedding_model()
+    if RERANK_ENABLED:
+        load_reranker()
+    with _llm_lock:
+        if llm_chain is not None:
+            return
         try:
-            tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME)
-            # Add these fixes:
-            tokenizer.pad_token = tokenizer.eos_token
-            tokenizer.padding_side = "right" # Standard for Mistral/Llama
-            CACHE_DIR = "E:/huggingface_cache"
-            # Cap the model at 4.8GB to leave room for Embeddings + Windows OS
-            max_mem = {0: "4.8GiB", "cpu": "16GiB"}
-            # Adding a strict memory map to prevent any crash during loading
-            model = AutoModelForCausalLM.from_pretrained(
-                LLM_MODEL_NAME,
-                quantization_config=bnb_config,
-                device_map="auto",
-                max_memory=max_mem,
-                cache_dir=CACHE_DIR  # Forces download to E: drive
-            )
-            logger.info("Model object created successfully")
+            backend = _timed("llm", load_backend, llm_backend())
         except Exception as e:
             logger.error(f"FATAL ERROR DURING LOADING: {e}")
-        logger.info("Creating pipeline...")
-        pipe = pipeline(
-            "text-generation",
-            model=model,
-            tokenizer=tokenizer,
-            max_new_tokens=250,
-            temperature=0.01, # Low temperature for medical precision
-            repetition_penalty=1.15,
-            return_full_text=False
-        )
-        
-        llm = HuggingFacePipeline(pipeline=pipe)
-        
+            raise
+        tokenizer = backend.tokenizer
+        # Kept for the token-streaming path, which bypasses LangChain (None for the stub)
+        generation_pipeline = backend.pipeline
+
         # Proper LCEL Chain
-        prompt = ChatPromptTemplate.from_template(
-            "<s>[INST] <<SYS>>\nYou are a clinical assistant. Use ONLY the context provided to answer. "
-            "If the answer is not in context, say 'Information not found in protocol.' "
-            "Example: Q: When is metformin stopped? A: Permanently discontinued if eGFR < 30 mL/min/1.73 m2.\n<</SYS>>\n\n"
-            "Context: {context}\n\nQuestion: {question} [/INST]"
-        )
-        
-        llm_chain = prompt | llm | StrOutputParser()
-
-   
-        auditor_prompt = ChatPromptTemplate.from_template(
-            "<s>[INST] You are a Medical Auditor. Verify the following:\n{query} [/INST]"
-        )
-        auditor_chain = auditor_prompt | llm | StrOutputParser()
+        answer_prompt = ChatPromptTemplate.from_template(ANSWER_TEMPLATE)
+        auditor_prompt = ChatPromptTemplate.from_template(AUDITOR_TEMPLATE)
+        if backend.supports_kv_cache:
+            prefix_cache = PrefixKVCache(backend.model, tokenizer)
+        if SPECULATIVE_MODE != "off":
+            # Assisted decoding crops the KV cache on rejected drafts: HF torch engines only
+            if backend.supports_kv_cache:
+                speculative = _timed("draft", SpeculativeDecoder, SPECULATIVE_MODE, backend)
+            else:
+                logger.warning(f"Speculative decoding is not supported by the '{backend.name}' backend; disabled.")
+        # Each chain decodes with its task's profile (budget, stop strings)
+        auditor_chain = _profile_chain(auditor_prompt, "reasoning")
+        # Assigned last: qa._check_ready treats a non-None llm_chain as "loaded"
+        llm_chain = _profile_chain(answer_prompt, "answer")
         logger.info("--- MODEL FULLY LOADED AND READY ---")
+
+def _profile_chain(prompt, profile):
+    trim = RunnableLambda(lambda text: decoding.trim(profile, text))
+    return prompt | decoding.profile_llm(backend, profile) | StrOutputParser() | trim
+
+# -----------------------------
+# Warm-Up + Readiness
+# -----------------------------
+def warm_up():
+    """
+    One dummy embed, rerank and prefill, plus the hybrid index merge, so the
+    first real request does not pay for kernel selection, allocator growth
+    or a lazy dense-index build. With the prefix cache the prefill caches
+    the shared system block for real requests (a word-led dummy context, so
+    the block ends on the same token boundary as a real one).
+    """
+    _timed("warmup_embed", embedding_model.embed_queries, ["warm-up"])
+    if reranker is not None:
+        _timed("warmup_rerank", reranker.model.predict, [("warm-up", "warm-up")])
+    if prefix_cache is not None:
+        _timed("warmup_prefill", prefix_cache.prepare, answer_segments("warm-up", "warm-up"))
+    elif backend is not None and backend.supports_logits:
+        inputs = tokenizer(["warm-up"], return_tensors="pt").to(backend.model.device)
+        _timed("warmup_prefill", backend.last_token_logits, inputs)
+    # Imported here: core.corpus imports this module
+    from core.corpus import corpus
+    if not corpus.is_empty():
+        _timed("warmup_index", corpus.warm_up)
+
+
+def _load_and_warm():
+    try:
+        load_models()
+        load_state["phase"] = "warming"
+        warm_up()
+        load_state.update(phase="ready", ready_at=time.time())
+        logger.info(f"Models warm and ready in {load_state['ready_at'] - load_state['started_at']:.1f}s")
+    except Exception as e:
+        logger.exception("Background model loading failed")
+        load_state.update(phase="failed", error=str(e))
+
+
+def start_background_load():
+    """Load + warm up on a daemon thread (idempotent; retries after a failure). Poll is_ready()."""
+    global _loader_thread
+    # Runs on every page load / request: no lock once a load is running or done
+    if _loader_thread is not None and load_state["phase"] != "failed":
+        return
+    with _loader_lock:
+        if _loader_thread is None or load_state["phase"] == "failed":
+            # Phase set before the thread starts, so a concurrent caller never sees "failed" twice
+            load_state.update(phase="loading", error=None, started_at=time.time(), ready_at=None)
+            _loader_thread = threading.Thread(target=_load_and_warm, name="model-loader", daemon=True)
+            _loader_thread.start()
+
+
+def wait_until_ready(timeout=None):
+    """Block until the background load finishes; True if the models are ready."""
+    start_background_load()
+    _loader_thread.join(timeout)
+    return is_ready()
+
+
+def is_ready():
+    return load_state["phase"] == "ready"
+
+
+def readiness():
+    state = dict(load_state, timings=dict(load_state["timings"]))
+    if state["started_at"] is not None:
+        end = state["ready_at"] or time.time()
+        state["seconds_since_start"] = round(end - state["started_at"], 2)
+    return state
+
+# -----------------------------
+# Prompt Segments (for KV prefix reuse)
+# -----------------------------
+_SENTINEL_A = "\x00SEG_A\x00"
+_SENTINEL_B = "\x00SEG_B\x00"
+
+def _split_template(prompt, first_var, second_var):
+    """Rendered template text around its two variables: (head, middle, tail)."""
+    text = prompt.invoke({first_var: _SENTINEL_A, second_var: _SENTINEL_B}).to_string()
+    head, rest = text.split(_SENTINEL_A)
+    middle, tail = rest.split(_SENTINEL_B)
+    return head, middle, tail
+
+
+def answer_segments(context, question):
+    """[system block, context, question + tail] - the same string the LCEL chain sends, split for caching."""
+    head, middle, tail = _split_template(answer_prompt, "context", "question")
+    return [head, context, middle + question + tail]
+
+
+def auditor_segments(query_head, query_rest):
+    """[auditor preamble + query_head, query_rest] - the shared head is the metric instruction."""
+    head, tail = auditor_prompt.invoke({"query": _SENTINEL_A}).to_string().split(_SENTINEL_A)
+    return [head + query_head, query_rest + tail]
+
+# -----------------------------
+# Answer Generation
+# -----------------------------
+def _generation_hooks(timer):
+    """
+    Per-call generate() kwargs: the answer profile, the stage timer, plus
+    assisted decoding and its tracker when speculative is on.
+    """
+    if speculative is None:
+        return decoding.generate_kwargs("answer", tokenizer, logits_processor=[timer]), None
+    tracker = SpeculationTracker()
+    kwargs = decoding.generate_kwargs(
+        "answer", tokenizer,
+        logits_processor=[timer, tracker.logits_processor],
+        stopping_criteria=[tracker.stopping_criterion],
+    )
+    kwargs.update(speculative.generate_kwargs())
+    return kwargs, tracker
+
+
+def _stop_when_set(event):
+    """Stopping criterion that ends generate() at the next step once event is set."""
+    import torch
+
+    def criterion(input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), event.is_set(), dtype=torch.bool, device=input_ids.device)
+    return criterion
+
+
+def _finish_generation(timer, tracker):
+    if tracker is None:
+        timer.finish()
+        return
+    elapsed = time.perf_counter() - timer.start
+    timer.finish(tokens=tracker.new_tokens)
+    speculative.record(tracker, elapsed)
+
+
+def generate_answer(context, question):
+    """
+    Single-question generation. With PREFIX_CACHE_ENABLED the system block
+    and each context block are prefilled once and reused from the KV cache;
+    with speculative decoding on, drafts are verified by the model in bulk.
+    """
+    if PREFIX_CACHE_ENABLED and prefix_cache is not None:
+        return generate_answer_with_stats(context, question)[0]
+    if speculative is not None:
+        # Same prompt string and pipeline as the LCEL chain, plus the assisted-decoding kwargs
+        with trace("prompt_build"):
+            prompt = answer_prompt.invoke({"context": context, "question": question}).to_string()
+        timer = GenerationTimer()
+        kwargs, tracker = _generation_hooks(timer)
+        answer = generation_pipeline(prompt, **kwargs)[0]["generated_text"]
+        _finish_generation(timer, tracker)
+        return decoding.trim("answer", answer)
+    with trace("generate"):
+        return llm_chain.invoke({"context": context, "question": question})
+
+def generate_answer_with_stats(context, question):
+    """
+    generate_answer() through the prefix cache, plus the time to first token
+    and the prompt / cached-prefix token counts it was measured against.
+    """
+    with trace("prompt_build"):
+        segments = answer_segments(context, question)
+    # Prefill (cached prefix reuse included) and decode are timed separately
+    timer = GenerationTimer()
+    kwargs, tracker = _generation_hooks(timer)
+    answer, stats = prefix_cache.generate_with_stats(segments, **kwargs)
+    stats["ttft_sec"] = (timer.first or time.perf_counter()) - timer.start
+    _finish_generation(timer, tracker)
+    return decoding.trim("answer", answer), stats
+
+# -----------------------------
+# Token Streaming
+# -----------------------------
+def stream_answer(context, question):
+    """Yield answer text pieces as soon as the pipeline decodes them."""
+    if generation_pipeline is None:
+        # Model-free backend: emit the finished answer word by word
+        with trace("generate"):
+            answer = llm_chain.invoke({"context": context, "question": question})
+        for i, word in enumerate(answer.split(" ")):
+            yield word if i == 0 else " " + word
+        return
+    from transformers import TextIteratorStreamer
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TOKEN_TIMEOUT_SEC)
+    with trace("prompt_build"):
+        if PREFIX_CACHE_ENABLED and prefix_cache is not None:
+            target = prefix_cache.generate
+            args = (answer_segments(context, question),)
+        else:
+            # Same prompt string the LCEL chain sends to HuggingFacePipeline
+            target = generation_pipeline
+            args = (answer_prompt.invoke({"context": context, "question": question}).to_string(),)
+    timer = GenerationTimer()
+    kwargs, tracker = _generation_hooks(timer)
+    kwargs["streamer"] = streamer
+    stop = threading.Event()
+    kwargs["stopping_criteria"].append(_stop_when_set(stop))
+    failure = []
+
+    def run():
+        try:
+            target(*args, **kwargs)
+        except BaseException as e:
+            # Keep the error for the caller and unblock it: without end() it waits for the next piece
+            failure.append(e)
+            streamer.end()
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        # A stop string may arrive split over pieces: trim_stream holds back its length
+        yield from decoding.trim_stream("answer", (piece for piece in streamer if piece))
+    except queue.Empty:
+        raise TimeoutError(f"No answer piece within {STREAM_TOKEN_TIMEOUT_SEC}s") from None
+    finally:
+        # Stop string seen, timed out or the consumer closed the stream: stop decoding
+        stop.set()
+    worker.join()
+    if failure:
+        raise failure[0]
+    _finish_generation(timer, tracker)
+
 # Explicit public API
-__all__ = ["load_models", "embedding_model", "llm_chain", "auditor_chain", "tokenizer"]
+__all__ = ["load_models", "load_embedding_model", "load_reranker", "reranker", "warm_up", "start_background_load", "wait_until_ready", "is_ready", "readiness", "load_state", "speculative", "generate_answer", "generate_answer_with_stats", "GENERATION_KWARGS", "ANSWER_TEMPLATE", "AUDITOR_TEMPLATE", "backend", "stream_answer", "answer_segments", "auditor_segments", "embedding_model", "llm_chain", "auditor_chain", "tokenizer"]
@@ -0,0 +1,179 @@
+import copy
+import threading
+import logging
+from collections import OrderedDict
+
+from config.settings import PREFIX_CACHE_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# KV-Cache Prefix Reuse
+# -----------------------------
+def _shared(kv):
+    """
+    Private DynamicCache over the same key / value tensors, instead of a
+    deepcopy: update() appends with torch.cat and crop() / batch_repeat_interleave()
+    rebind the tensors, so the cached ones are never written in place.
+    """
+    shared = copy.copy(kv)
+    shared.layers = [copy.copy(layer) for layer in kv.layers]
+    return shared
+
+class PrefixKVCache:
+    """
+    Caches past-key-values for prompt prefixes so shared leading text is
+    prefilled once and reused afterwards.
+
+    A prompt is passed as a list of segments, e.g.
+    [system block, context block, question + tail]. Every cumulative
+    prefix except the last segment is cacheable: the system block is
+    shared by every call and system + context by every call on the same
+    retrieved context. The joined prompt is tokenized once, exactly as the
+    pipeline would, and its ids are cut at the segment boundaries with the
+    offset mapping (a token crossing a boundary goes to the later part).
+    Entries are keyed by prefix ids, so a cached prefix is always a prefix
+    of the full prompt's tokens.
+    """
+
+    def __init__(self, model, tokenizer, max_entries=PREFIX_CACHE_ENTRIES):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # tuple(prefix ids) -> past_key_values
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+
+    def _tokenize(self, segments):
+        """Prompt ids plus the number of ids before the end of each segment but the last."""
+        enc = self.tokenizer("".join(segments), return_offsets_mapping=True)
+        ids, ends = enc["input_ids"], [end for _, end in enc["offset_mapping"]]
+        cuts, boundary = [], 0
+        for segment in segments[:-1]:
+            boundary += len(segment)
+            cuts.append(next((j for j, end in enumerate(ends) if end > boundary), len(ids)))
+        return ids, cuts
+
+    def _prefill(self, ids, cuts):
+        """Cached KV for ids[:cuts[-1]] (cuts strictly increasing), extending the cached parent ids[:cuts[-2]]."""
+        import torch
+        key = tuple(ids[:cuts[-1]])
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        parent_len = cuts[-2] if len(cuts) > 1 else 0
+        parent_kv = self._prefill(ids, cuts[:-1]) if parent_len else None
+        new_ids = torch.tensor([ids[parent_len:cuts[-1]]], device=self.model.device)
+        with torch.no_grad():
+            out = self.model(
+                input_ids=new_ids,
+                attention_mask=torch.ones((1, cuts[-1]), dtype=torch.long, device=self.model.device),
+                past_key_values=_shared(parent_kv) if parent_kv is not None else None,
+                use_cache=True,
+            )
+        with self._lock:
+            self.prefilled_tokens += new_ids.shape[1]
+            self._entries[key] = out.past_key_values
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return out.past_key_values
+
+    def _prepare_ids(self, ids, cuts, batch_size=1):
+        # Empty segments give repeated cut points: each cached prefix must be strictly longer than its parent
+        cuts = sorted({c for c in cuts if c > 0})
+        if not cuts:
+            raise ValueError("The cacheable segments produced no tokens.")
+        prefix_len = cuts[-1]
+        kv = _shared(self._prefill(ids, cuts))
+        if batch_size > 1:
+            kv.batch_repeat_interleave(batch_size)
+        with self._lock:
+            self.reused_tokens += prefix_len * batch_size
+        return prefix_len, kv
+
+    def prepare(self, segments, batch_size=1):
+        """
+        Full prompt ids, the cached prefix length and a private view of the
+        cached KV for all segments but the last. batch_size > 1 repeats the
+        cache along the batch dimension for prompts that share the prefix.
+        """
+        if len(segments) < 2:
+            raise ValueError("Need at least one cacheable prefix segment and a tail segment.")
+        ids, cuts = self._tokenize(segments)
+        # The tail must keep at least one token to run the model on
+        cuts = [min(c, len(ids) - 1) for c in cuts]
+        prefix_len, kv = self._prepare_ids(ids, cuts, batch_size)
+        return ids, prefix_len, kv
+
+    def generate(self, segments, **generate_kwargs):
+        """generate() for one prompt, prefilling only the uncached tail. Returns the decoded answer."""
+        return self.generate_with_stats(segments, **generate_kwargs)[0]
+
+    def generate_with_stats(self, segments, **generate_kwargs):
+        """generate() plus {prompt_tokens, prefix_tokens}: the prompt length and the part served from the cache."""
+        import torch
+        ids, prefix_len, kv = self.prepare(segments)
+        input_ids = torch.tensor([ids], device=self.model.device)
+        with torch.no_grad():
+            output = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=kv,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **generate_kwargs,
+            )
+        answer = self.tokenizer.decode(output[0, len(ids):], skip_special_tokens=True)
+        return answer, {"prompt_tokens": len(ids), "prefix_tokens": prefix_len}
+
+    def last_token_logits(self, prefix_segments, suffixes):
+        """
+        Next-token logits for prefix + each suffix, in one forward pass over
+        the suffixes only. Each row is tokenized whole and the shared prefix
+        is the longest run of ids all rows agree on before the prefix text
+        ends. Suffixes are right-padded (causal attention means padding after
+        a row's last token never affects it) and logits are taken at each
+        row's last real position.
+        """
+        import torch
+        rows = [self._tokenize(list(prefix_segments) + [s]) for s in suffixes]
+        prefix_len = min(min(cuts[-1], len(ids) - 1) for ids, cuts in rows)
+        first = rows[0][0]
+        for ids, _ in rows[1:]:
+            prefix_len = next((j for j in range(prefix_len) if ids[j] != first[j]), prefix_len)
+        # Inner cut points only where they fall inside the shared prefix
+        cuts = [c for c in rows[0][1][:-1] if c < prefix_len] + [prefix_len]
+        prefix_len, kv = self._prepare_ids(first, cuts, batch_size=len(suffixes))
+        suffix_ids = [ids[prefix_len:] for ids, _ in rows]
+        width = max(len(s) for s in suffix_ids)
+        pad = self.tokenizer.pad_token_id
+        input_ids = torch.tensor([s + [pad] * (width - len(s)) for s in suffix_ids], device=self.model.device)
+        suffix_mask = torch.tensor([[1] * len(s) + [0] * (width - len(s)) for s in suffix_ids], device=self.model.device)
+        attention_mask = torch.cat(
+            [torch.ones((len(suffixes), prefix_len), dtype=torch.long, device=self.model.device), suffix_mask], dim=1
+        )
+        last = torch.tensor([len(s) - 1 for s in suffix_ids], device=self.model.device)
+        rows = torch.arange(len(suffixes), device=self.model.device)
+        with torch.no_grad():
+            hidden = self.model.model(
+                input_ids=input_ids, attention_mask=attention_mask, past_key_values=kv, use_cache=True
+            ).last_hidden_state
+            return self.model.lm_head(hidden[rows, last]).float()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefilled_tokens": self.prefilled_tokens,
+                "reused_tokens": self.reused_tokens,
+            }
+
+__all__ = ["PrefixKVCache"]
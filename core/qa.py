@@ -1,22 +1,191 @@
-from core.models import llm_chain
-from core.retriever import ensemble_retriever, vectorstore
+from config.settings import MAX_BATCH_QUESTIONS, NOT_FOUND_MIN_SIMILARITY
+from core import models
+from core.backends import NOT_FOUND_ANSWER
+from core.cache import answer_cache
+from core.context import pack_context, context_packer
+from core.corpus import corpus
+from core.decoding import retrieval_confidence, SHORTCUTS
+from core.telemetry import record_tokens, trace
+
+def _format_context(context_docs):
+    # Merged, deduplicated and cut to the token budget (see core.context)
+    return pack_context(context_docs)["text"]
+
+
+def _record_answer(context_text, question, answer):
+    # Same accounting as the evaluator: context + question in, answer out
+    record_tokens("query", context_packer.count_tokens(context_text + question), context_packer.count_tokens(answer))
+
+
+def _not_found(query_vector, context_docs):
+    """Not-found shortcut: no retrieved chunk is similar enough to the question to hold its answer."""
+    if NOT_FOUND_MIN_SIMILARITY <= 0:
+        return False
+    # The chunks' vectors as indexed (by row), not re-embedded
+    if retrieval_confidence(query_vector, corpus.chunk_vectors(context_docs)) >= NOT_FOUND_MIN_SIMILARITY:
+        return False
+    SHORTCUTS.inc()
+    return True
+
+
+def _display_context(context_text):
+    # Clean up the context for the UI display
+    return context_text.replace("\n\n", " [PARAGRAPH] ").replace("\n", " ").replace(" [PARAGRAPH] ", "\n\n")
+
+
+def _check_ready(doc_ids):
+    """Return an error message if we cannot answer yet, else None."""
+    # Read through the module so we see the chain once load_models() has run
+    if models.llm_chain is None:
+        return "System is still loading the 7B model. Please wait 1 minute and try again."
+    if corpus.is_empty():
+        return "Please upload and process a PDF first."
+    if not corpus.scope_key(doc_ids):
+        return "None of the requested documents are indexed."
+    return None
 
 # -----------------------------
 # Query Logic 
 # -----------------------------
-def ask_question(question):
-    if llm_chain is None:
-        return "System is still loading the 7B model. Please wait 1 minute and try again."
-    if vectorstore is None:
-        return "Please upload and process a PDF first."
+def ask_question(question, doc_ids=None):
+    error = _check_ready(doc_ids)
+    if error:
+        return error
+
+    # Near-paraphrases of a question already answered on the same documents skip the LLM
+    scope = corpus.scope_key(doc_ids)
+    query_vector = models.embedding_model.embed_query(question)
+    cached = answer_cache.lookup(scope, query_vector)
+    if cached is not None:
+        return cached
     
-    # Retrieve top 3 medical context chunks
-    context_docs = ensemble_retriever.invoke(question)
-    context_text = "\n\n".join([d.page_content for d in context_docs])
+    # Retrieve top medical context chunks (optionally restricted to some protocols)
+    context_docs = corpus.retrieve(question, doc_ids=doc_ids, query_vector=query_vector)
+    context_text = _format_context(context_docs)
     
-    # Run the optimized LCEL chain
-    response = llm_chain.invoke({"context": context_text, "question": question})
-    # Clean up the context for the UI display
-    display_context = context_text.replace("\n\n", " [PARAGRAPH] ").replace("\n", " ").replace(" [PARAGRAPH] ", "\n\n")
+    # Run the optimized LCEL chain (skipped when retrieval found nothing relevant)
+    if _not_found(query_vector, context_docs):
+        response = NOT_FOUND_ANSWER
+    else:
+        response = models.generate_answer(context_text, question)
+        _record_answer(context_text, question, response)
+    display_context = _display_context(context_text)
+    answer_cache.put(scope, query_vector, response, display_context)
     # Return both so the evaluator can use the context
-    return response, display_context
\ No newline at end of file
+    return response, display_context
+
+# -----------------------------
+# Streaming Query Logic
+# -----------------------------
+def ask_question_stream(question, doc_ids=None):
+    """
+    Generator version of ask_question. Yields events in order:
+    {"type": "context", ...} once retrieval is done, then one
+    {"type": "token", ...} per decoded piece, then {"type": "done"}.
+    Failures before generation yield a single {"type": "error", ...}.
+    """
+    error = _check_ready(doc_ids)
+    if error:
+        yield {"type": "error", "data": error}
+        return
+
+    scope = corpus.scope_key(doc_ids)
+    query_vector = models.embedding_model.embed_query(question)
+    cached = answer_cache.lookup(scope, query_vector)
+    if cached is not None:
+        answer, display_context = cached
+        yield {"type": "context", "data": display_context}
+        yield {"type": "token", "data": answer}
+        yield {"type": "done"}
+        return
+
+    context_docs = corpus.retrieve(question, doc_ids=doc_ids, query_vector=query_vector)
+    context_text = _format_context(context_docs)
+    display_context = _display_context(context_text)
+    # Evidence goes out first, before any prefill
+    yield {"type": "context", "data": display_context}
+
+    if _not_found(query_vector, context_docs):
+        answer = NOT_FOUND_ANSWER
+        yield {"type": "token", "data": answer}
+    else:
+        pieces = []
+        for piece in models.stream_answer(context_text, question):
+            pieces.append(piece)
+            yield {"type": "token", "data": piece}
+        answer = "".join(pieces)
+        _record_answer(context_text, question, answer)
+    answer_cache.put(scope, query_vector, answer, display_context)
+    yield {"type": "done"}
+
+# -----------------------------
+# Batched Query Logic (checklists of questions, micro-batched requests)
+# -----------------------------
+def answer_requests(requests):
+    """
+    Answer independent (question, doc_ids) requests together: one embedding
+    forward pass for all questions, one vectorized retrieval call per distinct
+    document filter, and generation of every cache miss in padded batches of
+    GEN_BATCH_SIZE prompts. Returns one (answer, context) tuple or error
+    string per request, in order.
+    """
+    results = [_check_ready(doc_ids) for _, doc_ids in requests]
+    live = [i for i, r in enumerate(results) if r is None]
+    if not live:
+        return results
+
+    query_vectors = models.embedding_model.embed_queries([requests[i][0] for i in live])
+    vector_of = dict(zip(live, query_vectors))
+    scope_of = {i: corpus.scope_key(requests[i][1]) for i in live}
+    for i in live:
+        results[i] = answer_cache.lookup(scope_of[i], vector_of[i])
+    misses = [i for i in live if results[i] is None]
+    if not misses:
+        return results
+
+    # Retrieval is vectorized per document filter
+    context_text_of = {}
+    response_of = {}
+    groups = {}
+    for i in misses:
+        groups.setdefault(tuple(requests[i][1] or ()), []).append(i)
+    for doc_ids, members in groups.items():
+        all_context_docs = corpus.retrieve_batch(
+            [requests[i][0] for i in members], doc_ids=list(doc_ids) or None,
+            query_vectors=[vector_of[i] for i in members]
+        )
+        for i, docs in zip(members, all_context_docs):
+            context_text_of[i] = _format_context(docs)
+            if _not_found(vector_of[i], docs):
+                response_of[i] = NOT_FOUND_ANSWER
+
+    # LCEL .batch -> HuggingFacePipeline sends the prompts through the pipeline in
+    # left-padded batches; each sequence stops at its own EOS or stop string inside generate()
+    to_generate = [i for i in misses if i not in response_of]
+    if to_generate:
+        with trace("generate"):
+            responses = models.llm_chain.batch(
+                [{"context": context_text_of[i], "question": requests[i][0]} for i in to_generate]
+            )
+        for i, response in zip(to_generate, responses):
+            _record_answer(context_text_of[i], requests[i][0], response)
+            response_of[i] = response
+    for i in misses:
+        response = response_of[i]
+        display_context = _display_context(context_text_of[i])
+        answer_cache.put(scope_of[i], vector_of[i], response, display_context)
+        results[i] = (response, display_context)
+    return results
+
+
+def ask_questions(questions, doc_ids=None):
+    """
+    Answer a list of questions against the same documents in one pass.
+    Returns a list of (answer, context) tuples, or an error string.
+    """
+    error = _check_ready(doc_ids)
+    if error:
+        return error
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return f"At most {MAX_BATCH_QUESTIONS} questions per batch."
+    return answer_requests([(q, doc_ids) for q in questions])
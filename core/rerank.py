@@ -0,0 +1,122 @@
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from config.settings import (
+    RERANK_MODEL_NAME, RERANK_TOP_N, RERANK_BATCH_SIZE, RERANK_LATENCY_BUDGET_MS,
+    RERANK_CACHE_ENTRIES, HF_CACHE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Cross-Encoder Reranker
+# -----------------------------
+class CrossEncoderReranker:
+    """
+    Re-scores the fused hybrid candidates with a biomedical cross-encoder
+    (query and chunk read together) on CPU and keeps the best top_n.
+
+    Candidates are scored in fused-rank order, batch_size pairs at a time.
+    Once the next batch would push the query past latency_budget_ms, the
+    remaining candidates keep their fused order behind the scored ones
+    (0 = no budget). Scores are cached per (query, chunk text) pair in an LRU.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL_NAME, top_n=RERANK_TOP_N, batch_size=RERANK_BATCH_SIZE,
+                 latency_budget_ms=RERANK_LATENCY_BUDGET_MS, cache_entries=RERANK_CACHE_ENTRIES):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.latency_budget_ms = latency_budget_ms
+        self.cache_entries = cache_entries
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu", cache_folder=HF_CACHE_DIR)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()     # sha256(query, text) -> score, oldest use first
+        self.queries = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+        self.budget_cutoffs = 0
+        self.rerank_sec = 0.0
+
+    @staticmethod
+    def _key(query, text):
+        return hashlib.sha256(f"{query}\x00{text}".encode("utf-8")).digest()
+
+    def _cached(self, keys):
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+            return found
+
+    def _store(self, items):
+        with self._lock:
+            for key, score in items:
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query, docs, top_n=None, latency_budget_ms=None):
+        """Best top_n of docs (fused order in, reranked order out)."""
+        top_n = top_n or self.top_n
+        budget = self.latency_budget_ms if latency_budget_ms is None else latency_budget_ms
+        if len(docs) <= 1:
+            return list(docs[:top_n])
+        start = time.time()
+        keys = [self._key(query, d.page_content) for d in docs]
+        scores = self._cached(keys)
+        hits = len(scores)
+        pending = [i for i, key in enumerate(keys) if key not in scores]
+
+        cut_off = False
+        batch_sec = 0.0
+        for b in range(0, len(pending), self.batch_size):
+            elapsed_ms = (time.time() - start) * 1000
+            # Predict the next batch from the last one; the first batch always runs
+            if budget > 0 and b > 0 and elapsed_ms + batch_sec * 1000 > budget:
+                cut_off = True
+                break
+            batch_start = time.time()
+            idx = pending[b:b + self.batch_size]
+            batch_scores = self.model.predict(
+                [(query, docs[i].page_content) for i in idx], batch_size=len(idx), show_progress_bar=False
+            )
+            fresh = [(keys[i], float(s)) for i, s in zip(idx, batch_scores)]
+            self._store(fresh)
+            scores.update(fresh)
+            batch_sec = time.time() - batch_start
+
+        scored = sorted((i for i, key in enumerate(keys) if key in scores), key=lambda i: scores[keys[i]], reverse=True)
+        unscored = [i for i, key in enumerate(keys) if key not in scores]
+        with self._lock:
+            self.queries += 1
+            self.pairs_scored += len(scores) - hits
+            self.cache_hits += hits
+            self.budget_cutoffs += int(cut_off)
+            self.rerank_sec += time.time() - start
+        return [docs[i] for i in (scored + unscored)[:top_n]]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "queries": self.queries,
+                "pairs_scored": self.pairs_scored,
+                "cache_hits": self.cache_hits,
+                "cache_entries": len(self._cache),
+                "budget_cutoffs": self.budget_cutoffs,
+                "avg_rerank_ms": round(self.rerank_sec * 1000 / self.queries, 2) if self.queries else 0.0,
+            }
+
+__all__ = ["CrossEncoderReranker"]
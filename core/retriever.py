@@ -1,50 +1,140 @@
-import fitz 
-from langchain_classic.retrievers import EnsembleRetriever
-from langchain_community.retrievers import BM25Retriever
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
-from langchain_chroma import Chroma
+import os
+import time
+import logging
+import numpy as np
 
+from config.settings import (
+    EMBEDDING_MODEL_NAME, EMBEDDING_ENGINE, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SEPARATORS, EMBED_BATCH_SIZE,
+    PARSE_WORKERS, PARSE_PAGES_PER_TASK, PARSE_MIN_PARALLEL_PAGES, PARSE_LAYOUT, PAGE_CACHE_DIR, SNAPSHOT_DIR,
+)
+from core import models
+from core.corpus import corpus
+from core.index_store import compute_index_key, has_index, save_index
+from core.ingest import iter_page_batches, count_pages
+from core.layout import LAYOUT_VERSION
+from core.sparse import build_postings
+from core.tokenizer import TOKENIZER_VERSION
 
-from core.models import embedding_model
+logger = logging.getLogger(__name__)
+
+def index_config(layout=PARSE_LAYOUT):
+    """Everything that changes the chunks or vectors must be part of the cache key."""
+    return {
+        "extractor": LAYOUT_VERSION if layout else "text",
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "separators": CHUNK_SEPARATORS,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_engine": EMBEDDING_ENGINE,
+        "bm25_tokenizer": TOKENIZER_VERSION,
+    }
 
-vectorstore = None
-ensemble_retriever = None
 # -----------------------------
-# PDF Processing 
+# PDF Parsing + Chunking
 # -----------------------------
-def process_pdf(pdf_file):
-    global vectorstore, ensemble_retriever
-    doc = fitz.open(pdf_file)
-    docs_with_metadata = []
-    
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=100,separators=["\n\n", "\n", ". ", " "])
-    page_offset = 1  
-    for i, page in enumerate(doc):
-        page_text = page.get_text("text")
-        # Split text but keep the page number in metadata
-        chunks = text_splitter.split_text(page_text)
-        # Attach page number to each chunk
-        for chunk in chunks:
-            docs_with_metadata.append(Document(page_content=chunk, metadata={"page": i - page_offset + 1})) 
-    
-    doc.close()
-
-    #  Create Vector Store (Dense Search)
-    vectorstore = Chroma.from_documents(docs_with_metadata, embedding_model)
-    chroma_retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-    
-    #  Create BM25 (Sparse Keyword Search)
-    bm25_retriever = BM25Retriever.from_documents(docs_with_metadata)
-    bm25_retriever.k = 3
-    
-    # Ensemble both using weights
-    ensemble_retriever = EnsembleRetriever(
-        retrievers=[bm25_retriever, chroma_retriever], 
-        weights=[0.4, 0.6] 
-    )
-    
-    return "PDF Hybrid Indexing Successful!"
-
-__all__ = ["process_pdf", "vectorstore", "ensemble_retriever"]
+def _no_progress(**fields):
+    pass
+
+
+def iter_pdf_chunks(pdf_path, progress=_no_progress, layout=PARSE_LAYOUT):
+    """Yield (texts, metadatas) page batches as the parser pool produces them."""
+    progress(pages_total=count_pages(pdf_path))
+    for texts, metadatas, pages_done in iter_page_batches(
+        pdf_path, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SEPARATORS,
+        workers=PARSE_WORKERS, pages_per_task=PARSE_PAGES_PER_TASK,
+        min_parallel_pages=PARSE_MIN_PARALLEL_PAGES, layout=layout, page_cache_dir=PAGE_CACHE_DIR,
+    ):
+        progress(pages_parsed=pages_done)
+        yield texts, metadatas
+
+
+def parse_pdf(pdf_path, progress=_no_progress, layout=PARSE_LAYOUT):
+    texts, metadatas = [], []
+    for batch_texts, batch_metadatas in iter_pdf_chunks(pdf_path, progress, layout):
+        texts.extend(batch_texts)
+        metadatas.extend(batch_metadatas)
+    return texts, metadatas
+
+
+def parse_and_embed(pdf_path, progress=_no_progress, layout=PARSE_LAYOUT):
+    """
+    Streaming ingestion: chunk batches go to the embedder as soon as they are
+    parsed, so parsing (in the process pool), chunking and embedding overlap.
+    This saves time, not memory: all texts and vectors of the document are
+    held until they are written as one index.
+    """
+    texts, metadatas, vectors = [], [], []
+    pending = []
+    start = time.time()
+    for batch_texts, batch_metadatas in iter_pdf_chunks(pdf_path, progress, layout):
+        texts.extend(batch_texts)
+        metadatas.extend(batch_metadatas)
+        pending.extend(batch_texts)
+        progress(chunks_total=len(texts))
+        # Embed full batches now; keep the remainder for the next page range
+        while len(pending) >= EMBED_BATCH_SIZE:
+            vectors.append(_embed(pending[:EMBED_BATCH_SIZE]))
+            pending = pending[EMBED_BATCH_SIZE:]
+            progress(chunks_embedded=len(texts) - len(pending))
+    if pending:
+        vectors.append(_embed(pending))
+        progress(chunks_embedded=len(texts))
+    # No chunks: keep the real width, a (0, 0) array cannot be stacked with other documents
+    vectors = np.vstack(vectors) if vectors else np.zeros((0, models.embedding_model.dimension), dtype=np.float32)
+    elapsed = time.time() - start
+    if texts and elapsed > 0:
+        logger.info(f"Ingested {len(texts)} chunks in {elapsed:.1f}s ({len(texts) / elapsed:.1f} chunks/sec)")
+    return texts, metadatas, vectors
+
+
+def _embed(texts):
+    return models.embedding_model.embed_array(texts)
+
+# -----------------------------
+# PDF Processing
+# -----------------------------
+def process_pdf(pdf_file, doc_id=None, progress=_no_progress):
+    """
+    Index a protocol and add it to the corpus (replacing any older version of doc_id).
+    progress(**fields) receives pages/chunks counters for background jobs.
+    """
+    # Gradio may hand us a tempfile wrapper instead of a path
+    pdf_path = getattr(pdf_file, "name", pdf_file)
+    if doc_id is None:
+        doc_id = os.path.splitext(os.path.basename(pdf_path))[0]
+
+    config = index_config()
+    key = compute_index_key(pdf_path, config)
+
+    if has_index(key):
+        status = f"'{doc_id}': Hybrid Index loaded from cache!"
+    else:
+        texts, metadatas, vectors = parse_and_embed(pdf_path, progress)
+        if not texts:
+            # Scanned / image-only PDF: never let an empty document into the corpus manifest
+            raise ValueError(f"'{doc_id}': no extractable text (scanned or image-only PDF?). Run OCR first.")
+        save_index(key, texts, metadatas, vectors, build_postings(texts), config)
+        status = f"'{doc_id}': PDF Hybrid Indexing Successful!"
+
+    if not corpus.add_document(doc_id, key):
+        status = f"'{doc_id}': already indexed, nothing to do."
+    return status
+
+
+def remove_pdf(doc_id):
+    if not corpus.remove_document(doc_id):
+        return f"'{doc_id}' is not in the corpus."
+    return f"'{doc_id}' removed from the corpus."
+
+
+def restore_index():
+    """Cold start: memory-map every previously indexed protocol (or the serving snapshot) back in."""
+    if SNAPSHOT_DIR:
+        num_docs = corpus.attach_snapshot(SNAPSHOT_DIR)
+        return f"Attached read-only snapshot {SNAPSHOT_DIR} ({num_docs} protocol(s))."
+    num_docs = corpus.restore()
+    if num_docs == 0:
+        return "No cached index found. Please upload a PDF."
+    return f"Restored {num_docs} cached protocol index(es)."
 
+__all__ = ["process_pdf", "remove_pdf", "restore_index", "parse_pdf", "parse_and_embed", "index_config"]
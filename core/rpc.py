@@ -0,0 +1,215 @@
+import json
+import itertools
+import threading
+import logging
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+
+from config.settings import RPC_AUTHKEY, RPC_TIMEOUT_SEC
+
+logger = logging.getLogger(__name__)
+
+# NOTE: messages are JSON plus raw ndarray buffers, never pickles, so a peer
+# can only call the registered handlers. The authkey handshake (HMAC) is
+# still required: without RAG_RPC_AUTHKEY neither servers nor clients start.
+
+
+class RemoteError(RuntimeError):
+    """Raised on the client when the handler failed on the server."""
+
+
+def parse_address(address):
+    """'host:port' -> (host, port)."""
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _require_authkey(authkey):
+    if not authkey:
+        raise RuntimeError(
+            "RPC needs a shared secret: set RAG_RPC_AUTHKEY to the same value on model / shard servers and API workers."
+        )
+    return authkey
+
+# -----------------------------
+# Wire Format: JSON header + raw ndarray buffers
+# -----------------------------
+_NDARRAY = "__ndarray__"
+
+
+def encode_message(obj):
+    """obj -> (JSON bytes, [array buffers]). Tuples arrive as lists, numpy scalars as Python numbers."""
+    buffers = []
+
+    def walk(o):
+        if isinstance(o, np.ndarray):
+            if o.dtype.hasobject:
+                raise TypeError("Object arrays cannot be sent over RPC.")
+            a = np.ascontiguousarray(o)
+            buffers.append(a.reshape(-1).view(np.uint8) if a.size else b"")
+            return {_NDARRAY: len(buffers) - 1, "dtype": a.dtype.str, "shape": list(a.shape)}
+        if isinstance(o, np.generic):
+            return o.item()
+        if isinstance(o, dict):
+            return {k: walk(v) for k, v in o.items()}
+        if isinstance(o, (list, tuple)):
+            return [walk(v) for v in o]
+        return o
+
+    body = walk(obj)
+    return json.dumps({"body": body, "buffers": len(buffers)}).encode("utf-8"), buffers
+
+
+def decode_message(header, buffers):
+    envelope = json.loads(header)
+
+    def walk(o):
+        if isinstance(o, dict):
+            if _NDARRAY in o:
+                dtype = np.dtype(o["dtype"])
+                if dtype.hasobject:
+                    raise TypeError("Object arrays cannot be received over RPC.")
+                return np.frombuffer(buffers[o[_NDARRAY]], dtype=dtype).reshape(o["shape"]).copy()
+            return {k: walk(v) for k, v in o.items()}
+        if isinstance(o, list):
+            return [walk(v) for v in o]
+        return o
+
+    return walk(envelope["body"])
+
+
+def send_message(conn, obj):
+    header, buffers = encode_message(obj)
+    conn.send_bytes(header)
+    for buf in buffers:
+        conn.send_bytes(buf)
+
+
+def recv_message(conn, timeout=None):
+    """Next message on conn; TimeoutError if any frame takes longer than timeout seconds (None = wait)."""
+    def frame():
+        if timeout is not None and not conn.poll(timeout):
+            raise TimeoutError(f"No RPC reply within {timeout}s")
+        return conn.recv_bytes()
+
+    header = frame()
+    count = json.loads(header)["buffers"]
+    return decode_message(header, [frame() for _ in range(count)])
+
+# -----------------------------
+# Server
+# -----------------------------
+class RPCServer:
+    """
+    Minimal request/response server: one thread per client connection,
+    each message is {"method", "args", "kwargs"} and the reply is
+    {"status": "ok", "value"} or {"status": "error", "value": message}.
+    """
+
+    def __init__(self, address, handlers, authkey=RPC_AUTHKEY):
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.handlers = dict(handlers)
+        self.authkey = _require_authkey(authkey)
+        self._listener = None
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = recv_message(conn)
+                except (EOFError, OSError):
+                    return
+                except (ValueError, TypeError, KeyError) as e:
+                    # Malformed frame: the stream cannot be resynchronized
+                    logger.warning(f"Dropping RPC connection after a malformed message: {e}")
+                    return
+                method = request.get("method") if isinstance(request, dict) else None
+                try:
+                    if method not in self.handlers:
+                        raise KeyError(f"unknown method {method!r}")
+                    reply = {"status": "ok", "value": self.handlers[method](*request.get("args", []), **request.get("kwargs", {}))}
+                except Exception as e:
+                    logger.exception(f"RPC '{method}' failed")
+                    reply = {"status": "error", "value": f"{type(e).__name__}: {e}"}
+                try:
+                    send_message(conn, reply)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self):
+        self._listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"RPC server listening on {self.address[0]}:{self.address[1]} ({', '.join(self.handlers)})")
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                break
+            except Exception as e:
+                # Failed handshake (wrong authkey, port scanner): keep serving
+                logger.warning(f"Rejected RPC connection: {e}")
+                continue
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+
+# -----------------------------
+# Clients
+# -----------------------------
+class RPCClient:
+    """
+    One connection per calling thread, opened on first use and reopened
+    after a failure. A reply slower than timeout seconds raises TimeoutError
+    and drops the connection (its late reply must not answer the next call).
+    """
+
+    def __init__(self, address, authkey=RPC_AUTHKEY, timeout=RPC_TIMEOUT_SEC):
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.authkey = _require_authkey(authkey)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, authkey=self.authkey)
+        return conn
+
+    def _drop_connection(self):
+        conn, self._local.conn = getattr(self._local, "conn", None), None
+        if conn is not None:
+            conn.close()
+
+    def call(self, method, *args, **kwargs):
+        conn = self._connection()
+        try:
+            send_message(conn, {"method": method, "args": list(args), "kwargs": kwargs})
+            reply = recv_message(conn, timeout=self.timeout)
+        except (EOFError, OSError, TimeoutError):
+            # Server restarted or hung: drop the connection, the next call reconnects
+            self._drop_connection()
+            raise
+        if reply["status"] != "ok":
+            raise RemoteError(f"{self.address[0]}:{self.address[1]} {method}: {reply['value']}")
+        return reply["value"]
+
+
+class ServerPool:
+    """Round-robin over several servers offering the same methods."""
+
+    def __init__(self, addresses, authkey=RPC_AUTHKEY, timeout=RPC_TIMEOUT_SEC):
+        if not addresses:
+            raise ValueError("ServerPool needs at least one 'host:port' address.")
+        self.clients = [RPCClient(a, authkey, timeout) for a in addresses]
+        self._next = itertools.count()
+
+    def call(self, method, *args, **kwargs):
+        client = self.clients[next(self._next) % len(self.clients)]
+        return client.call(method, *args, **kwargs)
+
+__all__ = [
+    "RPCServer", "RPCClient", "ServerPool", "RemoteError", "parse_address",
+    "encode_message", "decode_message", "send_message", "recv_message",
+]
@@ -0,0 +1,263 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import (
+    QUEUE_MAX_SIZE, INFERENCE_WORKERS, REQUEST_TIMEOUT_SEC,
+    MICRO_BATCH_MAX_SIZE, MICRO_BATCH_WINDOW_MS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the inference queue is at capacity (the API maps it to 429)."""
+
+# -----------------------------
+# Inference Scheduler
+# -----------------------------
+class InferenceScheduler:
+    """
+    Keeps the event loop free while the model works.
+
+    Requests are put on a bounded asyncio queue and drained by
+    INFERENCE_WORKERS coroutines, each of which runs the job on a dedicated
+    model-owning thread pool. Indexing runs elsewhere (core.jobs) so a
+    large upload never blocks queries.
+    """
+
+    def __init__(self, max_queue=QUEUE_MAX_SIZE, workers=INFERENCE_WORKERS, timeout_sec=REQUEST_TIMEOUT_SEC):
+        self.max_queue = max_queue
+        self.workers = workers
+        self.timeout_sec = timeout_sec
+        self._inference_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._queue = None
+        self._tasks = []
+        self.in_flight = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Inference scheduler started ({self.workers} worker(s), queue size {self.max_queue})")
+
+    @property
+    def running(self):
+        return self._queue is not None
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+
+    async def _worker(self, worker_id):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, future = await self._queue.get()
+            try:
+                # The caller gave up (timeout / disconnect) before we got to it
+                if future.cancelled():
+                    continue
+                self.in_flight += 1
+                try:
+                    result = await loop.run_in_executor(self._inference_pool, job)
+                    if not future.cancelled():
+                        future.set_result(result)
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                finally:
+                    self.in_flight -= 1
+            finally:
+                self._queue.task_done()
+
+    def _enqueue(self, job):
+        if self._queue is None:
+            raise RuntimeError("Inference scheduler is not started.")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((job, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Inference queue is full ({self.max_queue} pending requests).")
+        return future
+
+    async def submit(self, fn, *args, timeout=None, **kwargs):
+        """Run fn(*args, **kwargs) on the inference worker. Raises QueueFullError / asyncio.TimeoutError."""
+        future = self._enqueue(functools.partial(fn, *args, **kwargs))
+        timeout = self.timeout_sec if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(future, timeout=timeout if timeout > 0 else None)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+
+    async def submit_stream(self, gen_fn, *args, timeout=None, **kwargs):
+        """
+        Run a generator function on the inference worker and re-yield its
+        items on the event loop as they are produced. The whole stream has
+        timeout seconds (asyncio.TimeoutError after that; 0 = no limit). When
+        the consumer stops early - timeout, client disconnect, aclose() - the
+        generator is closed at its next item, or skipped if still queued.
+        """
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def drain():
+            gen = gen_fn(*args, **kwargs)
+            try:
+                for item in gen:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(items.put_nowait, item)
+            finally:
+                # GeneratorExit inside gen_fn: its cleanup (e.g. stopping generation) runs here
+                gen.close()
+                loop.call_soon_threadsafe(items.put_nowait, done)
+
+        future = self._enqueue(drain)
+        timeout = self.timeout_sec if timeout is None else timeout
+        deadline = loop.time() + timeout if timeout > 0 else None
+        try:
+            while True:
+                remaining = None if deadline is None else max(0.0, deadline - loop.time())
+                try:
+                    item = await asyncio.wait_for(items.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    self.timed_out += 1
+                    raise
+                if item is done:
+                    break
+                yield item
+            # Propagate any exception raised inside the generator
+            await future
+        finally:
+            stop.set()
+            future.cancel()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_queue,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+# -----------------------------
+# Dynamic Micro-Batching
+# -----------------------------
+class MicroBatcher:
+    """
+    Collects concurrent requests for up to window_ms (or until max_batch
+    arrive) and runs them as one call to batch_fn(items) -> results on the
+    scheduler's model worker. The next batch is collected while the
+    previous one is generating, so throughput grows with concurrency
+    instead of staying at one answer per generation time.
+    """
+
+    def __init__(self, scheduler, batch_fn, max_batch=MICRO_BATCH_MAX_SIZE, window_ms=MICRO_BATCH_WINDOW_MS):
+        self.scheduler = scheduler
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.window_sec = window_ms / 1000.0
+        self._pending = None
+        self._collector = None
+        self._tasks = set()     # running _dispatch tasks: the loop only keeps weak references
+        self.batches = 0
+        self.batched_items = 0
+
+    async def start(self):
+        if self._pending is not None:
+            return
+        self._pending = asyncio.Queue()
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        self._collector = None
+        self._pending = None
+
+    async def submit(self, item, timeout=None):
+        if self._pending is None:
+            raise RuntimeError("Micro-batcher is not started.")
+        # Share the scheduler's capacity so backpressure still applies
+        if self._pending.qsize() >= self.scheduler.max_queue:
+            self.scheduler.rejected += 1
+            raise QueueFullError(f"Inference queue is full ({self.scheduler.max_queue} pending requests).")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.put_nowait((item, future))
+        timeout = self.scheduler.timeout_sec if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(future, timeout=timeout if timeout > 0 else None)
+        except asyncio.TimeoutError:
+            self.scheduler.timed_out += 1
+            raise
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending.get()]
+            deadline = loop.time() + self.window_sec
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                # asyncio.wait (not wait_for) so shutdown cancellation is never swallowed
+                getter = asyncio.ensure_future(self._pending.get())
+                done, _ = await asyncio.wait({getter}, timeout=remaining)
+                if not done and getter.cancel():
+                    break
+                batch.append(getter.result())
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if batch:
+                task = asyncio.create_task(self._dispatch(batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch):
+        self.batches += 1
+        self.batched_items += len(batch)
+        try:
+            results = await self.scheduler.submit(self.batch_fn, [item for item, _ in batch], timeout=0)
+        except asyncio.CancelledError:
+            # Batcher stopped: callers must not wait for answers that will never come
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        # Route each answer back to the caller that asked for it
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "window_ms": self.window_sec * 1000.0,
+            "dispatching": len(self._tasks),
+        }
+
+
+# Shared scheduler for the API process
+scheduler = InferenceScheduler()
+
+__all__ = ["InferenceScheduler", "MicroBatcher", "QueueFullError", "scheduler"]
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+from config.settings import INDEX_DIR, SHARD_SERVERS
+from core.ann import top_k
+from core.hybrid import TOP_K
+from core.rpc import RPCClient, RPCServer
+from core.telemetry import trace
+
+logger = logging.getLogger(__name__)
+
+# Bump when the snapshot layout changes
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_FILE = "snapshot.json"
+SHARD_ARRAYS = ["vectors", "sq_norms", "bm25_data", "bm25_indices", "bm25_indptr", "owner", "local_row", "global_row"]
+
+# -----------------------------
+# Building (from a loaded corpus)
+# -----------------------------
+def partition_documents(num_chunks, num_shards):
+    """Greedy largest-first split of {doc_id: num_chunks} into num_shards lists of similar total size."""
+    shards = [[] for _ in range(max(1, num_shards))]
+    sizes = [0] * len(shards)
+    for doc_id in sorted(num_chunks, key=lambda d: (-num_chunks[d], d)):
+        i = sizes.index(min(sizes))
+        shards[i].append(doc_id)
+        sizes[i] += num_chunks[doc_id]
+    return [s for s in shards if s] or [[]]
+
+
+def build_snapshot(corpus, out_dir, num_shards=1):
+    """
+    Write a read-only serving snapshot of the corpus:
+    - snapshot.json : documents, shard list, dimensions
+    - vocab.json / idf.npy : BM25 vocabulary and corpus-wide idf
+    - shard-<i>/    : that shard's chunk texts plus uncompressed .npy arrays
+                      (vectors, squared norms, BM25 weights as CSC, row owner)
+
+    Every shard keeps the corpus-wide idf, so BM25 scores from different
+    shards are comparable and scatter-gather top-k equals the unsharded top-k.
+    The arrays are loaded with mmap_mode="r": worker processes on one host
+    share them through the page cache instead of holding a copy each.
+    """
+    with corpus._lock:
+        m = corpus.index.merged()
+        vocab = sorted(corpus.index.sparse.vocab, key=corpus.index.sparse.vocab.get)
+        seg_ids = list(m["seg_ids"])
+        documents = {d: dict(corpus.documents[d]) for d in seg_ids}
+        chunks = {d: corpus.chunks[d] for d in seg_ids}
+        vectors = {d: corpus.index.vectors[d] for d in seg_ids}
+        W = m["bm25"].tocsr()
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_dir)) or ".", exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".snapshot-", dir=os.path.dirname(os.path.abspath(out_dir)))
+    try:
+        shards = []
+        for i, shard_docs in enumerate(partition_documents({d: documents[d]["num_chunks"] for d in seg_ids}, num_shards)):
+            name = f"shard-{i}"
+            shard_dir = os.path.join(tmp_dir, name)
+            os.makedirs(shard_dir)
+            # Shard rows in merged order, documents kept contiguous
+            seg_index = {d: seg_ids.index(d) for d in shard_docs}
+            shard_docs = sorted(shard_docs, key=seg_index.get)
+            rows = np.flatnonzero(np.isin(m["owner"], [seg_index[d] for d in shard_docs]))
+            local_owner = {seg_index[d]: j for j, d in enumerate(shard_docs)}
+            shard_vectors = (
+                np.vstack([np.asarray(vectors[d], dtype=np.float32) for d in shard_docs])
+                if shard_docs else np.zeros((0, 0), dtype=np.float32)
+            )
+            weights = W[rows].tocsc()
+            weights.sort_indices()
+            arrays = {
+                "vectors": shard_vectors,
+                "sq_norms": np.einsum("ij,ij->i", shard_vectors, shard_vectors).astype(np.float32),
+                "bm25_data": weights.data.astype(np.float32),
+                "bm25_indices": weights.indices.astype(np.int32),
+                "bm25_indptr": weights.indptr.astype(np.int64),
+                "owner": np.array([local_owner[o] for o in m["owner"][rows]], dtype=np.int32),
+                "local_row": m["local_row"][rows].astype(np.int64),
+                "global_row": rows.astype(np.int64),     # tie-break: same order as the unsharded index
+            }
+            for array_name, array in arrays.items():
+                np.save(os.path.join(shard_dir, f"{array_name}.npy"), np.ascontiguousarray(array))
+            with open(os.path.join(shard_dir, "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    d: {
+                        "texts": [c.page_content for c in chunks[d]],
+                        "metadatas": [{k: v for k, v in c.metadata.items() if k not in ("doc_id", "chunk")} for c in chunks[d]],
+                    }
+                    for d in shard_docs
+                }, f)
+            shards.append({"name": name, "doc_ids": shard_docs, "num_chunks": int(len(rows))})
+
+        with open(os.path.join(tmp_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(vocab, f)
+        np.save(os.path.join(tmp_dir, "idf.npy"), np.asarray(m["idf"], dtype=np.float32))
+        manifest = {
+            "format": SNAPSHOT_FORMAT_VERSION,
+            "documents": documents,
+            "shards": shards,
+            "num_chunks": int(sum(s["num_chunks"] for s in shards)),
+            "num_terms": len(vocab),
+        }
+        # Written last: marks the snapshot as complete
+        with open(os.path.join(tmp_dir, SNAPSHOT_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        if os.path.exists(out_dir):
+            shutil.rmtree(out_dir)
+        os.replace(tmp_dir, out_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logger.info(f"Snapshot written to {out_dir}: {manifest['num_chunks']} chunks in {len(shards)} shard(s)")
+    return manifest
+
+# -----------------------------
+# Shards
+# -----------------------------
+def load_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, SNAPSHOT_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Snapshot {snapshot_dir} has format {manifest.get('format')}, expected {SNAPSHOT_FORMAT_VERSION}")
+    return manifest
+
+
+class LocalShard:
+    """One shard searched in this process over memory-mapped arrays (zero-copy, read-only)."""
+
+    def __init__(self, snapshot_dir, name, vocab=None, idf=None):
+        manifest = load_manifest(snapshot_dir)
+        self.name = name
+        self.doc_ids = next(s["doc_ids"] for s in manifest["shards"] if s["name"] == name)
+        shard_dir = os.path.join(snapshot_dir, name)
+        a = {n: np.load(os.path.join(shard_dir, f"{n}.npy"), mmap_mode="r") for n in SHARD_ARRAYS}
+        if vocab is None:
+            with open(os.path.join(snapshot_dir, "vocab.json"), "r", encoding="utf-8") as f:
+                vocab = {t: i for i, t in enumerate(json.load(f))}
+        self.vocab = vocab
+        self.idf = np.load(os.path.join(snapshot_dir, "idf.npy"), mmap_mode="r") if idf is None else idf
+        self.vectors = a["vectors"]
+        self.sq_norms = a["sq_norms"]
+        self.owner = a["owner"]
+        self.local_row = a["local_row"]
+        self.global_row = a["global_row"]
+        self.bm25 = sp.csc_matrix(
+            (a["bm25_data"], a["bm25_indices"], a["bm25_indptr"]), shape=(len(self.owner), len(vocab)), copy=False
+        )
+        # Documents are contiguous in owner order: row of (doc, local_row) = first row of doc + local_row
+        self.doc_start = {d: int(np.searchsorted(self.owner, j)) for j, d in enumerate(self.doc_ids)}
+
+    def __len__(self):
+        return len(self.owner)
+
+    def _mask(self, doc_ids):
+        if not doc_ids:
+            return None
+        doc_ids = set(doc_ids)
+        wanted = [i for i, d in enumerate(self.doc_ids) if d in doc_ids]
+        return np.isin(self.owner, wanted)
+
+    def _bm25_scores(self, queries_terms):
+        rows, cols, data = [], [], []
+        for q, terms in enumerate(queries_terms):
+            for term_id, count in Counter(self.vocab[t] for t in terms if t in self.vocab).items():
+                rows.append(term_id)
+                cols.append(q)
+                data.append(self.idf[term_id] * count)
+        if not rows:
+            return np.zeros((len(self), len(queries_terms)), dtype=np.float32)
+        weights = sp.csr_matrix(
+            (np.asarray(data, dtype=np.float32), (np.asarray(rows), np.asarray(cols))),
+            shape=(len(self.vocab), len(queries_terms)),
+        )
+        term_ids = np.unique(rows)
+        return np.asarray((self.bm25[:, term_ids] @ weights[term_ids]).todense(), dtype=np.float32)
+
+    def search(self, queries_terms, query_vectors, k=TOP_K, doc_ids=None):
+        """Per query ([(score, global_row, doc_id, local_row)...] bm25, [...] dense), best first."""
+        if len(self) == 0:
+            return [([], []) for _ in queries_terms]
+        mask = self._mask(doc_ids)
+        Q = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        sides = [self._bm25_scores(queries_terms), 2.0 * (self.vectors @ Q.T) - self.sq_norms[:, None]]
+        results = []
+        for q in range(len(queries_terms)):
+            hits = []
+            for scores in sides:
+                s = scores[:, q] if mask is None else np.where(mask, scores[:, q], -np.inf)
+                rows = top_k(s, min(k, len(self) if mask is None else int(mask.sum())))
+                hits.append([
+                    (float(s[r]), int(self.global_row[r]), self.doc_ids[self.owner[r]], int(self.local_row[r]))
+                    for r in rows
+                ])
+            results.append(tuple(hits))
+        return results
+
+    def chunk_vectors(self, refs):
+        """Stored vectors of [(doc_id, local_row), ...], in order."""
+        rows = [self.doc_start[d] + r for d, r in refs]
+        return np.asarray(self.vectors[rows], dtype=np.float32)
+
+    def ping(self):
+        return {"shard": self.name, "num_chunks": len(self)}
+
+
+class RemoteShard:
+    """A shard served by `python -m core.snapshot serve` on another process or host."""
+
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address
+        self.client = RPCClient(address)
+
+    def search(self, queries_terms, query_vectors, k=TOP_K, doc_ids=None):
+        return self.client.call("search", queries_terms, np.asarray(query_vectors, dtype=np.float32), k, doc_ids)
+
+    def chunk_vectors(self, refs):
+        return self.client.call("chunk_vectors", [list(ref) for ref in refs])
+
+    def ping(self):
+        return self.client.call("ping")
+
+
+def parse_shard_servers(spec=SHARD_SERVERS):
+    """'shard-0=host:port,shard-1=host:port' -> {name: address}."""
+    servers = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, address = item.partition("=")
+        servers[name] = address
+    return servers
+
+# -----------------------------
+# Scatter-Gather Index
+# -----------------------------
+def merge_shard_hits(partials, num_queries, k=TOP_K):
+    """
+    Per-shard LocalShard.search results -> per query ([(doc_id, row)...] bm25, [...] dense),
+    best score first; ties go to the lower global row, as in the single HybridIndex.
+    """
+    results = []
+    for q in range(num_queries):
+        sides = []
+        for side in range(2):
+            hits = [hit for partial in partials for hit in partial[q][side]]
+            hits.sort(key=lambda h: (-h[0], h[1]))
+            sides.append([(doc_id, row) for _, _, doc_id, row in hits[:k]])
+        results.append(tuple(sides))
+    return results
+
+
+class ShardedIndex:
+    """
+    Read-only stand-in for HybridIndex over a snapshot: every query batch is
+    sent to all shards in parallel (local numpy scoring releases the GIL)
+    and each side's hits are merged by score into the global top-k.
+    """
+
+    def __init__(self, snapshot_dir, shard_servers=None):
+        self.snapshot_dir = snapshot_dir
+        self.manifest = load_manifest(snapshot_dir)
+        shard_servers = parse_shard_servers() if shard_servers is None else shard_servers
+        with open(os.path.join(snapshot_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            vocab = {t: i for i, t in enumerate(json.load(f))}
+        idf = np.load(os.path.join(snapshot_dir, "idf.npy"), mmap_mode="r")
+        self.shards = [
+            RemoteShard(s["name"], shard_servers[s["name"]]) if s["name"] in shard_servers
+            else LocalShard(snapshot_dir, s["name"], vocab, idf)
+            for s in self.manifest["shards"]
+        ]
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(self.shards)), thread_name_prefix="shard")
+        self.segments = {d: None for d in self.manifest["documents"]}
+
+    def __len__(self):
+        return self.manifest["num_chunks"]
+
+    def warm_up(self):
+        for shard in self.shards:
+            shard.ping()
+
+    def search_batch(self, queries_terms, query_vectors, k=TOP_K, seg_ids=None, dense_index=None):
+        """Same contract as HybridIndex.search_batch: per query ([(doc_id, row)...] bm25, [...] dense)."""
+        if dense_index is not None:
+            raise ValueError("A snapshot always searches its own exact dense vectors.")
+        with trace("shard_search"):
+            futures = [
+                self._pool.submit(shard.search, queries_terms, query_vectors, k, seg_ids)
+                for shard in self.shards if not seg_ids or set(seg_ids) & set(self._shard_docs(shard))
+            ]
+            partials = [f.result() for f in futures]
+        return merge_shard_hits(partials, len(queries_terms), k)
+
+    def chunk_vectors(self, refs):
+        """Stored vectors of [(doc_id, local_row), ...], in order, one call per shard holding some of them."""
+        if not refs:
+            return np.zeros((0, 0), dtype=np.float32)
+        by_shard = {}
+        for i, (doc_id, row) in enumerate(refs):
+            shard = next(s for s in self.shards if doc_id in self._shard_docs(s))
+            by_shard.setdefault(shard.name, (shard, []))[1].append((i, (doc_id, row)))
+        out = [None] * len(refs)
+        for shard, items in by_shard.values():
+            for (i, _), vector in zip(items, shard.chunk_vectors([ref for _, ref in items])):
+                out[i] = vector
+        return np.stack(out)
+
+    def _shard_docs(self, shard):
+        return next(s["doc_ids"] for s in self.manifest["shards"] if s["name"] == shard.name)
+
+
+def load_snapshot_chunks(snapshot_dir):
+    """{doc_id: (texts, metadatas)} for every document in the snapshot."""
+    manifest = load_manifest(snapshot_dir)
+    chunks = {}
+    for shard in manifest["shards"]:
+        with open(os.path.join(snapshot_dir, shard["name"], "chunks.json"), "r", encoding="utf-8") as f:
+            for doc_id, c in json.load(f).items():
+                chunks[doc_id] = (c["texts"], c["metadatas"])
+    return chunks
+
+# -----------------------------
+# CLI: build a snapshot / serve one shard
+# -----------------------------
+def serve_shard(snapshot_dir, name, address):
+    shard = LocalShard(snapshot_dir, name)
+    RPCServer(address, {"search": shard.search, "chunk_vectors": shard.chunk_vectors, "ping": shard.ping}).serve_forever()
+
+
+if __name__ == "__main__":
+    # python -m core.snapshot build artifacts/snapshot --shards 4
+    # python -m core.snapshot serve artifacts/snapshot --shard shard-1 --address 0.0.0.0:7101
+    parser = argparse.ArgumentParser(description="Serving snapshots of the indexed corpus")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="snapshot the corpus restored from INDEX_DIR")
+    build.add_argument("out_dir", nargs="?", default=os.path.join(os.path.dirname(INDEX_DIR) or ".", "snapshot"))
+    build.add_argument("--shards", type=int, default=1)
+    serve = sub.add_parser("serve", help="serve one shard over RPC")
+    serve.add_argument("snapshot_dir")
+    serve.add_argument("--shard", required=True)
+    serve.add_argument("--address", default="127.0.0.1:7101")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "build":
+        from core.corpus import corpus
+        if corpus.restore() == 0:
+            sys.exit("No indexed documents to snapshot.")
+        build_snapshot(corpus, args.out_dir, args.shards)
+    else:
+        serve_shard(args.snapshot_dir, args.shard, args.address)
+
+__all__ = [
+    "build_snapshot", "partition_documents", "load_manifest", "load_snapshot_chunks", "parse_shard_servers",
+    "LocalShard", "RemoteShard", "ShardedIndex", "merge_shard_hits", "serve_shard",
+]
@@ -0,0 +1,295 @@
+import logging
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+
+from config.settings import BM25_PRUNING
+from core.ann import top_k
+from core.tokenizer import clinical_tokenize
+
+logger = logging.getLogger(__name__)
+
+# BM25Okapi defaults (rank_bm25)
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+# -----------------------------
+# Compact Postings (per document, serializable)
+# -----------------------------
+def build_postings(texts, tokenize=clinical_tokenize):
+    """
+    Postings for one document's chunks as flat arrays:
+    - vocab    : the document's terms, '\\n'-joined UTF-8 (tokens never contain whitespace)
+    - indptr   : chunk i owns entries indptr[i]:indptr[i + 1]
+    - term_ids : local term id per entry (int32)
+    - tf       : term frequency per entry (uint16)
+    - doc_len  : tokens per chunk (int32)
+    """
+    vocab = {}
+    indptr, term_ids, tfs, doc_len = [0], [], [], []
+    for text in texts:
+        tokens = tokenize(text)
+        doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            tfs.append(tf)
+        indptr.append(len(term_ids))
+    return {
+        "vocab": np.frombuffer("\n".join(vocab).encode("utf-8"), dtype=np.uint8),
+        "indptr": np.asarray(indptr, dtype=np.int64),
+        "term_ids": np.asarray(term_ids, dtype=np.int32),
+        "tf": np.minimum(np.asarray(tfs, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16),
+        "doc_len": np.asarray(doc_len, dtype=np.int32),
+    }
+
+
+def postings_vocab(postings):
+    blob = bytes(postings["vocab"])
+    return blob.decode("utf-8").split("\n") if blob else []
+
+
+def save_postings(path, postings):
+    np.savez_compressed(path, **postings)
+
+
+def load_postings(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+# -----------------------------
+# Segmented BM25 Index
+# -----------------------------
+class BM25Index:
+    """
+    BM25Okapi over array-backed postings.
+
+    Each document is a segment (CSR term-frequency matrix over global term
+    ids plus chunk lengths). Adding or removing a segment only updates the
+    global document frequencies. The column-major weight matrix, IDF and
+    per-term max weights are re-merged lazily on the next query.
+
+    Queries use MaxScore-style top-k pruning. Terms are visited in order of
+    their score upper bound. Once the bound of the remaining terms falls
+    below the current k-th best score, documents not yet seen cannot
+    qualify. The remaining terms are then looked up only for the surviving
+    candidates, so the long postings of common words are never scanned.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON, pruning=BM25_PRUNING):
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.pruning = pruning
+        self.vocab = {}                          # term -> column id
+        self.df = np.zeros(0, dtype=np.int64)    # document frequency per term id
+        self.segments = {}                       # seg_id -> segment dict
+        self._merged = None
+
+    # -------- Mutations --------
+    def add_segment(self, seg_id, postings):
+        if seg_id in self.segments:
+            self.remove_segment(seg_id)
+
+        terms = postings_vocab(postings)
+        local_to_global = np.empty(len(terms), dtype=np.int64)
+        for i, term in enumerate(terms):
+            col = self.vocab.get(term)
+            if col is None:
+                col = self.vocab[term] = len(self.vocab)
+            local_to_global[i] = col
+        if len(self.vocab) > len(self.df):
+            self.df = np.concatenate([self.df, np.zeros(len(self.vocab) - len(self.df), dtype=np.int64)])
+
+        cols = local_to_global[postings["term_ids"]]
+        n_chunks = len(postings["doc_len"])
+        tf = sp.csr_matrix(
+            (postings["tf"].astype(np.float32), cols, postings["indptr"]),
+            shape=(n_chunks, len(self.vocab)),
+        )
+        seg_df = np.bincount(cols, minlength=len(self.vocab))
+        self.df += seg_df
+
+        self.segments[seg_id] = {
+            "tf": tf,
+            "df": seg_df,
+            "doc_len": postings["doc_len"].astype(np.float32),
+        }
+        self._merged = None
+
+    def remove_segment(self, seg_id):
+        segment = self.segments.pop(seg_id, None)
+        if segment is None:
+            return False
+        self.df[:len(segment["df"])] -= segment["df"]
+        self._merged = None
+        return True
+
+    def __len__(self):
+        return sum(seg["tf"].shape[0] for seg in self.segments.values())
+
+    # -------- Compaction --------
+    def _merge(self):
+        """Stack all segments into contiguous arrays (done once per change, not per query)."""
+        seg_ids = list(self.segments)
+        n_terms = len(self.vocab)
+        tfs, doc_lens, owners, local_rows = [], [], [], []
+        for i, seg_id in enumerate(seg_ids):
+            seg = self.segments[seg_id]
+            tf = seg["tf"]
+            if tf.shape[1] < n_terms:
+                tf = sp.csr_matrix((tf.data, tf.indices, tf.indptr), shape=(tf.shape[0], n_terms))
+            tfs.append(tf)
+            doc_lens.append(seg["doc_len"])
+            owners.append(np.full(tf.shape[0], i, dtype=np.int32))
+            local_rows.append(np.arange(tf.shape[0], dtype=np.int64))
+
+        n_rows = sum(t.shape[0] for t in tfs)
+        doc_len = np.concatenate(doc_lens) if tfs else np.zeros(0, dtype=np.float32)
+        avgdl = float(doc_len.sum() / n_rows) if n_rows else 0.0
+
+        # idf exactly as BM25Okapi: log((N - n + .5) / (n + .5)), negatives floored at eps * mean idf
+        present = self.df > 0
+        idf = np.zeros(n_terms, dtype=np.float32)
+        raw = np.log(n_rows - self.df[present] + 0.5) - np.log(self.df[present] + 0.5)
+        if raw.size:
+            raw = np.where(raw < 0, self.epsilon * raw.mean(), raw)
+        idf[present] = raw
+
+        # Column-major so a query only touches the postings of its own terms
+        tf_all = sp.vstack(tfs, format="csc") if tfs else sp.csc_matrix((0, n_terms), dtype=np.float32)
+        tf_all.sort_indices()
+
+        # BM25 document-side weights precomputed per posting: tf * (k1 + 1) / (tf + k1 * norm(len))
+        max_weight = np.zeros(n_terms, dtype=np.float32)
+        if n_rows:
+            length_norm = (self.k1 * (1 - self.b + self.b * doc_len / avgdl)).astype(np.float32)
+            rows = tf_all.indices
+            tf_all.data = tf_all.data * (self.k1 + 1) / (tf_all.data + length_norm[rows])
+            # Per-term upper bound for pruning
+            nonempty = np.diff(tf_all.indptr) > 0
+            if tf_all.nnz:
+                max_weight[nonempty] = np.maximum.reduceat(tf_all.data, tf_all.indptr[:-1][nonempty])
+
+        self._merged = {
+            "seg_ids": seg_ids,
+            "bm25": tf_all,
+            "idf": idf,
+            "max_weight": max_weight,
+            "owner": np.concatenate(owners) if owners else np.zeros(0, dtype=np.int32),
+            "local_row": np.concatenate(local_rows) if local_rows else np.zeros(0, dtype=np.int64),
+        }
+        logger.info(f"BM25 index merged: {n_rows} chunks, {n_terms} terms, {len(seg_ids)} documents")
+
+    def merged(self):
+        if self._merged is None:
+            self._merge()
+        return self._merged
+
+    # -------- Scoring --------
+    def _query_weights(self, queries_terms):
+        """Sparse (n_terms x n_queries) idf * count weights; repeated terms count repeatedly like BM25Okapi."""
+        m = self.merged()
+        rows, cols, data = [], [], []
+        for q, terms in enumerate(queries_terms):
+            counts = Counter(self.vocab[t] for t in terms if t in self.vocab)
+            for term_id, count in counts.items():
+                rows.append(term_id)
+                cols.append(q)
+                data.append(m["idf"][term_id] * count)
+        return sp.csr_matrix(
+            (np.asarray(data, dtype=np.float32), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+            shape=(len(self.vocab), len(queries_terms)),
+        )
+
+    def scores_batch(self, queries_terms):
+        """Exhaustive (n_chunks x n_queries) BM25 scores, touching only the postings of the query terms."""
+        m = self.merged()
+        weights = self._query_weights(queries_terms)
+        term_ids = np.unique(weights.tocoo().row)
+        if term_ids.size == 0:
+            return np.zeros((m["bm25"].shape[0], len(queries_terms)), dtype=np.float32)
+        postings = m["bm25"][:, term_ids]
+        return np.asarray((postings @ weights[term_ids]).todense(), dtype=np.float32)
+
+    def _exhaustive_top_k(self, query_terms, k, mask=None):
+        scores = self.scores_batch([query_terms])[:, 0]
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        return top_k(scores, k)
+
+    def top_k(self, query_terms, k, mask=None):
+        """Row ids of the k best chunks for one query, best first (same result as the exhaustive scorer)."""
+        m = self.merged()
+        n_rows = m["bm25"].shape[0]
+        k = min(k, n_rows if mask is None else int(mask.sum()))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        counts = Counter(self.vocab[t] for t in query_terms if t in self.vocab)
+        terms = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        weights = m["idf"][terms] * np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        # Bounds only hold for positive weights; zero-score fill-ins need the exhaustive order too
+        if not self.pruning or terms.size == 0 or (weights <= 0).any():
+            return self._exhaustive_top_k(query_terms, k, mask)
+
+        order = np.argsort(-(weights * m["max_weight"][terms]), kind="stable")
+        terms, weights = terms[order], weights[order]
+        upper = weights * m["max_weight"][terms]
+        remaining = np.concatenate([np.cumsum(upper[::-1])[::-1], [0.0]])   # bound of terms i..end
+
+        W = m["bm25"]
+        # All weights are positive, so acc > 0 marks the chunks seen so far
+        acc = np.zeros(n_rows, dtype=np.float32)
+        threshold = -np.inf
+        i = 0
+        # Essential terms: full postings, until unseen chunks can no longer reach the top k
+        while i < len(terms) and remaining[i] >= threshold:
+            lo, hi = W.indptr[terms[i]], W.indptr[terms[i] + 1]
+            rows = W.indices[lo:hi]
+            values = W.data[lo:hi] * weights[i]
+            if mask is not None:
+                keep = mask[rows]
+                rows, values = rows[keep], values[keep]
+            acc[rows] += values
+            i += 1
+            candidates = np.flatnonzero(acc)
+            if len(candidates) >= k:
+                # Partial scores are lower bounds of the final scores
+                threshold = np.partition(acc[candidates], len(candidates) - k)[len(candidates) - k]
+
+        candidates = np.flatnonzero(acc)
+        if len(candidates) < k:
+            return self._exhaustive_top_k(query_terms, k, mask)
+        # Non-essential terms: only candidates that can still make it are scored
+        if i < len(terms):
+            candidates = candidates[acc[candidates] + remaining[i] >= threshold]
+            is_candidate = np.zeros(n_rows, dtype=bool)
+            is_candidate[candidates] = True
+            for j in range(i, len(terms)):
+                lo, hi = W.indptr[terms[j]], W.indptr[terms[j] + 1]
+                rows = W.indices[lo:hi]
+                if rows.size == 0:
+                    continue
+                if len(candidates) * 16 < rows.size:
+                    # Few candidates: binary-search them in the postings instead of scanning the list
+                    pos = np.minimum(np.searchsorted(rows, candidates), rows.size - 1)
+                    hit = rows[pos] == candidates
+                    acc[candidates[hit]] += W.data[lo + pos[hit]] * weights[j]
+                else:
+                    hit = is_candidate[rows]
+                    acc[rows[hit]] += W.data[lo:hi][hit] * weights[j]
+        return candidates[top_k(acc[candidates], k)]
+
+    def search_batch(self, queries_terms, k, mask=None):
+        """Top-k row ids per query."""
+        if not self.pruning:
+            scores = self.scores_batch(queries_terms)
+            if mask is not None:
+                scores = np.where(mask[:, None], scores, -np.inf)
+            k = min(k, scores.shape[0] if mask is None else int(mask.sum()))
+            return [top_k(scores[:, q], k) for q in range(len(queries_terms))]
+        return [self.top_k(terms, k, mask) for terms in queries_terms]
+
+__all__ = [
+    "BM25Index", "build_postings", "postings_vocab", "save_postings", "load_postings",
+    "BM25_K1", "BM25_B", "BM25_EPSILON",
+]
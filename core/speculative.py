@@ -0,0 +1,155 @@
+import threading
+import logging
+
+from config.settings import SPECULATIVE_MODE, DRAFT_MODEL_NAME, PROMPT_LOOKUP_TOKENS, HF_CACHE_DIR
+from core.telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_MODES = ("off", "prompt_lookup", "draft")
+
+_DRAFT_TOKENS = registry.counter(
+    "rag_speculative_tokens_total", "Speculative decoding: drafted and accepted tokens.", ("mode", "kind")
+)
+
+# -----------------------------
+# Per-Call Acceptance Tracking
+# -----------------------------
+class SpeculationTracker:
+    """
+    Counts one generate() call's verification rounds and drafted / accepted
+    tokens, from hooks generate() already calls:
+    - the logits processor runs once per verified position, i.e. drafted + 1
+      times per round (once per token with plain decoding)
+    - the stopping criterion runs once per round, after the accepted tokens
+      were appended
+    Each round (one forward pass of the 7B model) yields accepted + 1 tokens.
+    """
+
+    def __init__(self):
+        self.prompt_len = None
+        self.length = None
+        self.rounds = 0
+        self.drafted = 0
+        self._positions = 0
+
+    def logits_processor(self, input_ids, scores):
+        if self.prompt_len is None:
+            self.prompt_len = input_ids.shape[1]
+        self._positions += 1
+        return scores
+
+    def stopping_criterion(self, input_ids, scores, **kwargs):
+        import torch
+        self.rounds += 1
+        self.drafted += max(0, self._positions - 1)
+        self._positions = 0
+        self.length = input_ids.shape[1]
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    @property
+    def new_tokens(self):
+        return 0 if self.length is None else self.length - self.prompt_len
+
+    @property
+    def accepted(self):
+        return max(0, self.new_tokens - self.rounds)
+
+# -----------------------------
+# Speculative Decoder
+# -----------------------------
+class SpeculativeDecoder:
+    """
+    Extra generate() kwargs for assisted decoding on single-prompt paths
+    (generate_answer, stream_answer):
+    - prompt_lookup: draft tokens are n-grams copied from the prompt, which
+      suits extractive answers quoting the retrieved context (no extra model)
+    - draft: a small causal LM proposes tokens (DRAFT_MODEL_NAME); with a
+      different tokenizer transformers' universal assisted decoding is used
+
+    The 7B model verifies every drafted token, so under greedy decoding the
+    output is the same as plain decoding; only the number of 7B forward
+    passes changes. Batched generation (llm_chain.batch) is not assisted:
+    transformers only supports it for batch size 1.
+    """
+
+    def __init__(self, mode=SPECULATIVE_MODE, backend=None, draft_model_name=DRAFT_MODEL_NAME,
+                 prompt_lookup_tokens=PROMPT_LOOKUP_TOKENS):
+        if mode not in SPECULATIVE_MODES:
+            raise ValueError(f"Unknown speculative mode '{mode}'. Choose one of: {', '.join(SPECULATIVE_MODES)}")
+        self.mode = mode
+        self.prompt_lookup_tokens = prompt_lookup_tokens
+        self.draft_model_name = draft_model_name if mode == "draft" else None
+        self.draft_model = None
+        self.draft_tokenizer = None
+        self.tokenizer = backend.tokenizer if backend is not None else None
+        if mode == "draft":
+            self._load_draft(backend)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.new_tokens = 0
+        self.rounds = 0
+        self.drafted = 0
+        self.accepted = 0
+        self.decode_sec = 0.0
+
+    def _load_draft(self, backend):
+        if not self.draft_model_name:
+            raise ValueError("RAG_SPECULATIVE=draft needs a draft model (set RAG_DRAFT_MODEL).")
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        logger.info(f"Loading draft model {self.draft_model_name}...")
+        device = backend.model.device
+        self.draft_model = AutoModelForCausalLM.from_pretrained(
+            self.draft_model_name, torch_dtype=backend.model.dtype if device.type == "cuda" else torch.float32,
+            cache_dir=HF_CACHE_DIR, low_cpu_mem_usage=True,
+        ).to(device)
+        self.draft_model.eval()
+        draft_tokenizer = AutoTokenizer.from_pretrained(self.draft_model_name, cache_dir=HF_CACHE_DIR)
+        if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            # Different vocabulary: drafts are re-tokenized between the two models
+            logger.info("Draft model uses another tokenizer: universal assisted decoding")
+            self.draft_tokenizer = draft_tokenizer
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def generate_kwargs(self):
+        """Keyword arguments that switch generate() (or the text-generation pipeline) to assisted decoding."""
+        if self.mode == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": self.prompt_lookup_tokens}
+        if self.mode == "draft":
+            kwargs = {"assistant_model": self.draft_model}
+            if self.draft_tokenizer is not None:
+                kwargs.update(tokenizer=self.tokenizer, assistant_tokenizer=self.draft_tokenizer)
+            return kwargs
+        return {}
+
+    def record(self, tracker, decode_sec):
+        with self._lock:
+            self.calls += 1
+            self.new_tokens += tracker.new_tokens
+            self.rounds += tracker.rounds
+            self.drafted += tracker.drafted
+            self.accepted += tracker.accepted
+            self.decode_sec += decode_sec
+        _DRAFT_TOKENS.inc(tracker.drafted, mode=self.mode, kind="drafted")
+        _DRAFT_TOKENS.inc(tracker.accepted, mode=self.mode, kind="accepted")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "draft_model": self.draft_model_name,
+                "calls": self.calls,
+                "new_tokens": self.new_tokens,
+                "target_forwards": self.rounds,
+                "drafted_tokens": self.drafted,
+                "accepted_tokens": self.accepted,
+                "acceptance_rate": round(self.accepted / self.drafted, 4) if self.drafted else 0.0,
+                "tokens_per_forward": round(self.new_tokens / self.rounds, 3) if self.rounds else 0.0,
+                "tokens_per_sec": round(self.new_tokens / self.decode_sec, 2) if self.decode_sec > 0 else 0.0,
+            }
+
+__all__ = ["SpeculativeDecoder", "SpeculationTracker", "SPECULATIVE_MODES"]
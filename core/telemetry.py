@@ -0,0 +1,326 @@
+import os
+import sys
+import time
+import bisect
+import resource
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans a sub-millisecond BM25 lookup up to a long batched generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 250)
+
+# -----------------------------
+# Metric Types
+# -----------------------------
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[n]) for n in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._tracked = {}      # label key -> last external total seen by track()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def track(self, total, **labels):
+        """
+        Advance by the growth of an external running total (a cache's hit
+        count). A total lower than the last one seen means its source was
+        replaced, so the new total counts in full; the counter never drops.
+        """
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            last = self._tracked.get(key, 0)
+            self._values[key] = self._values.get(key, 0) + (total - last if total >= last else total)
+            self._tracked[key] = total
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def series(self):
+        """{label values tuple: value} copy."""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + _format_labels(self.labelnames, k), v) for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) with quantile estimates."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}   # label key -> [bucket counts (+Inf last), sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def quantile(self, q, **labels):
+        """Linear interpolation inside the bucket holding the q-th observation (as histogram_quantile does)."""
+        with self._lock:
+            series = self._series.get(_label_key(self.labelnames, labels))
+            if series is None or series[2] == 0:
+                return None
+            counts, _, count = series[0], series[1], series[2]
+            rank = q * count
+            seen = 0
+            for i, c in enumerate(counts):
+                if seen + c >= rank and c > 0:
+                    if i == len(self.buckets):
+                        return self.buckets[-1]
+                    lower = self.buckets[i - 1] if i > 0 else 0.0
+                    return lower + (self.buckets[i] - lower) * (rank - seen) / c
+                seen += c
+            return self.buckets[-1]
+
+    def label_keys(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def snapshot(self, **labels):
+        with self._lock:
+            series = self._series.get(_label_key(self.labelnames, labels))
+            return (series[2], series[1]) if series else (0, 0.0)
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, c in zip(list(self.buckets) + ["+Inf"], counts):
+                    cumulative += c
+                    le = bound if bound == "+Inf" else repr(float(bound))
+                    lines.append((self.name + "_bucket" + _format_labels(self.labelnames, key, [("le", le)]), cumulative))
+                lines.append((self.name + "_sum" + _format_labels(self.labelnames, key), total))
+                lines.append((self.name + "_count" + _format_labels(self.labelnames, key), count))
+        return lines
+
+# -----------------------------
+# Metrics Registry
+# -----------------------------
+class MetricsRegistry:
+    """
+    Thread-safe set of named metrics plus collectors, callbacks that refresh
+    gauges (queue depth, memory) right before each scrape.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{name}' already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def register_collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+
+    def collect(self):
+        for fn in list(self._collectors):
+            try:
+                fn()
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(fn, '__name__', fn)} failed: {e}")
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        self.collect()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{sample} {value}" for sample, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# Shared registry for the API process
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "rag_stage_seconds", "Wall time per pipeline stage call (batched calls count once).", ("stage",)
+)
+REQUEST_SECONDS = registry.histogram(
+    "rag_http_request_seconds", "End-to-end HTTP request latency, queueing included.", ("path", "status")
+)
+TOKENS = registry.counter("rag_tokens_total", "Prompt and generated tokens.", ("kind", "source"))
+ANSWERS = registry.counter("rag_answers_total", "Answers generated (answer-cache hits excluded).", ("source",))
+DECODE_RATE = registry.histogram(
+    "rag_decode_tokens_per_second", "Decode throughput per generate() call.", buckets=RATE_BUCKETS
+)
+
+# -----------------------------
+# Stage Tracing
+# -----------------------------
+@contextmanager
+def trace(stage):
+    """with trace("bm25"): ... -> one rag_stage_seconds observation."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+class GenerationTimer:
+    """
+    Logits processor that splits one generate() call into prefill and
+    decode: the first call happens right after the prompt forward pass,
+    every later call after one more decode step.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first = None
+        self.steps = 0
+
+    def __call__(self, input_ids, scores):
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.steps += 1
+        return scores
+
+    def finish(self, tokens=None):
+        """
+        Record prefill / decode stages and decode tokens/sec; returns the
+        number of generated tokens. Pass tokens when calls != tokens
+        (assisted decoding verifies several positions per forward pass).
+        """
+        end = time.perf_counter()
+        if self.first is None:
+            observe_stage("prefill", end - self.start)
+            return 0
+        tokens = self.steps if tokens is None else tokens
+        observe_stage("prefill", self.first - self.start)
+        decode_sec = end - self.first
+        observe_stage("decode", decode_sec)
+        if tokens > 1 and decode_sec > 0:
+            DECODE_RATE.observe((tokens - 1) / decode_sec)
+        return tokens
+
+
+def record_tokens(source, input_tokens, output_tokens, answers=1):
+    TOKENS.inc(input_tokens, kind="input", source=source)
+    TOKENS.inc(output_tokens, kind="output", source=source)
+    ANSWERS.inc(answers, source=source)
+
+
+def token_stats(source=None):
+    """{input_tokens, output_tokens, num_queries} for one source ("query", "evaluation") or all of them."""
+    sources = [source] if source else sorted({key[1] for key in TOKENS.series()})
+    return {
+        "input_tokens": sum(TOKENS.value(kind="input", source=s) for s in sources),
+        "output_tokens": sum(TOKENS.value(kind="output", source=s) for s in sources),
+        "num_queries": sum(ANSWERS.value(source=s) for s in sources),
+    }
+
+
+def latency_summary(quantiles=(0.5, 0.95, 0.99)):
+    """{stage: {count, avg_ms, p50_ms, p95_ms, p99_ms}} estimated from the stage histograms."""
+    summary = {}
+    for (stage,) in STAGE_SECONDS.label_keys():
+        count, total = STAGE_SECONDS.snapshot(stage=stage)
+        row = {"count": count, "avg_ms": round(total * 1000 / count, 2) if count else 0.0}
+        for q in quantiles:
+            value = STAGE_SECONDS.quantile(q, stage=stage)
+            row[f"p{int(q * 100)}_ms"] = round(value * 1000, 2) if value is not None else None
+        summary[stage] = row
+    return summary
+
+# -----------------------------
+# Process Gauges
+# -----------------------------
+_PROCESS_MEMORY = registry.gauge("rag_process_memory_bytes", "Host memory of this process.", ("kind",))
+_GPU_MEMORY = registry.gauge("rag_gpu_memory_bytes", "CUDA memory held by PyTorch.", ("device", "kind"))
+
+
+def _collect_memory():
+    page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+    try:
+        with open("/proc/self/statm") as f:
+            _PROCESS_MEMORY.set(int(f.read().split()[1]) * page, kind="rss")
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux
+    _PROCESS_MEMORY.set(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, kind="peak_rss")
+    # Only once the models have pulled torch in: a /metrics scrape must not import it
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        for d in range(torch.cuda.device_count()):
+            _GPU_MEMORY.set(torch.cuda.memory_allocated(d), device=str(d), kind="allocated")
+            _GPU_MEMORY.set(torch.cuda.memory_reserved(d), device=str(d), kind="reserved")
+            _GPU_MEMORY.set(torch.cuda.max_memory_allocated(d), device=str(d), kind="peak_allocated")
+
+
+registry.register_collector(_collect_memory)
+
+__all__ = [
+    "MetricsRegistry", "Counter", "Gauge", "Histogram", "registry", "trace", "observe_stage",
+    "GenerationTimer", "record_tokens", "token_stats", "latency_summary",
+    "STAGE_SECONDS", "REQUEST_SECONDS", "TOKENS", "ANSWERS", "DECODE_RATE",
+]
@@ -0,0 +1,25 @@
+import re
+
+# Part of the index cache key: bump when tokenization changes
+TOKENIZER_VERSION = "clinical-v1"
+
+# A token is a run of letters/digits that may continue through inner
+# . / - + ' : (mL/min/1.73, b.i.d, co-trimoxazole, 5-FU, IL-6/IL-10) or a
+# thousands comma between digits (3,234), with an optional trailing %.
+# Sentence punctuation, brackets and comparison signs split tokens.
+_WORD = r"[0-9A-Za-zÀ-ɏ]+"
+_TOKEN_RE = re.compile(rf"{_WORD}(?:[./\-+'’:]{_WORD}|(?<=\d),\d+)*%?")
+
+
+def clinical_tokenize(text):
+    """Lower-cased clinical tokens: 'eGFR < 30 mL/min/1.73 m2.' -> ['egfr', '30', 'ml/min/1.73', 'm2']."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group(0).lower()
+        # Possessive "DPP's" -> "dpp"
+        if token.endswith(("'s", "’s")) and len(token) > 2:
+            token = token[:-2]
+        tokens.append(token)
+    return tokens
+
+__all__ = ["clinical_tokenize", "TOKENIZER_VERSION"]
@@ -0,0 +1,102 @@
+import sys
+import time
+import logging
+
+import numpy as np
+
+from config.settings import DENSE_INDEX
+from core import models
+from core.ann import make_dense_index
+from core.corpus import corpus
+from core.hybrid import TOP_K
+from data.gold_dataset import GOLD_DATASET
+from evaluation.evaluator import retrieval_metrics
+
+logger = logging.getLogger(__name__)
+
+# Configurations compared by default: exact baseline, HNSW at two ef values, IVF-PQ with / without refine
+DEFAULT_CONFIGS = [
+    ("flat", {}),
+    ("hnsw", {"ef_search": 32}),
+    ("hnsw", {"ef_search": 128}),
+    ("ivfpq", {"nprobe": 16, "refine": 0}),
+    ("ivfpq", {"nprobe": 16, "refine": 4}),
+]
+
+# -----------------------------
+# Dense Index Recall vs Latency
+# -----------------------------
+def run_ann_benchmark(configs=None, doc_ids=None, k=TOP_K):
+    """
+    Compare dense index configurations on the loaded corpus with the gold
+    questions: dense recall@k against exact search, dense latency per query,
+    index memory, and the end-to-end hybrid Recall@k / Precision@k that
+    evaluate_single_query reports.
+    """
+    configs = configs or DEFAULT_CONFIGS
+    if corpus.is_empty():
+        raise RuntimeError("Corpus is empty. Index or restore a protocol first.")
+    models.load_embedding_model()
+    questions = [item["question"] for item in GOLD_DATASET]
+    Q = np.asarray(models.embedding_model.embed_queries(questions), dtype=np.float32)
+    mask = corpus.index.row_mask(doc_ids) if doc_ids else None
+
+    exact = make_dense_index("flat")
+    exact.build(corpus.index.segment_vectors())
+    exact_rows = exact.search(Q, k, mask)
+
+    results = []
+    for kind, params in configs:
+        try:
+            index = make_dense_index(kind, **params)
+            start = time.time()
+            index.build(corpus.index.segment_vectors())
+            build_sec = time.time() - start
+
+            start = time.time()
+            rows = index.search(Q, k, mask)
+            latency_ms = (time.time() - start) * 1000 / len(questions)
+            overlap = [len(set(a.tolist()) & set(b.tolist())) / max(len(a), 1) for a, b in zip(exact_rows, rows)]
+
+            # End-to-end hybrid retrieval with this dense side
+            retrieved = corpus.retrieve_batch(questions, doc_ids=doc_ids, k=k, query_vectors=Q, dense_index=index)
+            gold = [retrieval_metrics(docs, item["source_page"]) for docs, item in zip(retrieved, GOLD_DATASET)]
+            results.append({
+                "index": kind,
+                "params": index.params(),
+                "build_sec": round(build_sec, 2),
+                "memory_mb": round(index.memory_bytes() / 2**20, 2),
+                "dense_ms_per_query": round(latency_ms, 3),
+                f"recall@{k}_vs_exact": round(float(np.mean(overlap)), 4),
+                f"Recall@{k}": round(float(np.mean([r for r, _ in gold])), 4),
+                f"Precision@{k}": round(float(np.mean([p for _, p in gold])), 4),
+            })
+        except Exception as e:
+            logger.error(f"Dense index {kind} {params} failed: {e}")
+            results.append({"index": kind, "params": params, "error": str(e)})
+    return results
+
+
+def format_ann_results(results, k=TOP_K):
+    lines = [
+        f"| Index | Params | Build (s) | Memory (MB) | Dense ms/query | recall@{k} vs exact | Recall@{k} | Precision@{k} |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for r in results:
+        if "error" in r:
+            lines.append(f"| {r['index']} | {r['params']} | failed: {r['error']} | | | | | |")
+        else:
+            lines.append(
+                f"| {r['index']} | {r['params']} | {r['build_sec']} | {r['memory_mb']} | {r['dense_ms_per_query']} "
+                f"| {r[f'recall@{k}_vs_exact']} | {r[f'Recall@{k}']} | {r[f'Precision@{k}']} |"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m evaluation.ann_benchmark [doc_id ...]   (uses the restored on-disk corpus)
+    corpus.restore()
+    logger.info(f"Serving dense index: {DENSE_INDEX}")
+    print(format_ann_results(run_ann_benchmark(doc_ids=sys.argv[1:] or None)))
+
+__all__ = ["run_ann_benchmark", "format_ann_results", "DEFAULT_CONFIGS"]
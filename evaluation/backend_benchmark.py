@@ -0,0 +1,122 @@
+import gc
+import sys
+import time
+import logging
+
+import torch
+from langchain_core.prompts import ChatPromptTemplate
+
+from config.settings import LLM_MODEL_NAME
+from core.backends import BACKENDS, GENERATION_KWARGS, load_backend
+from core.embeddings import EmbeddingService
+from core.models import ANSWER_TEMPLATE
+from data.gold_dataset import GOLD_DATASET
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Engine Throughput Benchmark
+# -----------------------------
+def benchmark_prompts(num_prompts=8):
+    """Answer prompts built from the gold set (the gold answer stands in for retrieved context)."""
+    prompt = ChatPromptTemplate.from_template(ANSWER_TEMPLATE)
+    items = GOLD_DATASET[:num_prompts]
+    return [prompt.invoke({"context": item["expected"], "question": item["question"]}).to_string() for item in items]
+
+
+def benchmark_backend(name, prompts):
+    """Load one engine, warm it up, then time sequential generation over prompts."""
+    start = time.time()
+    backend = load_backend(name)
+    load_sec = time.time() - start
+
+    backend.llm.invoke(prompts[0])    # warm-up (kernels, allocator, ORT session)
+    output_tokens = 0
+    start = time.time()
+    for p in prompts:
+        output_tokens += len(backend.tokenizer.encode(backend.llm.invoke(p), add_special_tokens=False))
+    elapsed = time.time() - start
+
+    result = {
+        "backend": name,
+        "load_sec": round(load_sec, 2),
+        "prompts": len(prompts),
+        "output_tokens": output_tokens,
+        "gen_sec": round(elapsed, 3),
+        "tokens_per_sec": round(output_tokens / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    # Free the engine before the next one is loaded
+    del backend
+    gc.collect()
+    torch.cuda.empty_cache()
+    return result
+
+
+def run_backend_benchmark(backend_names=None, num_prompts=8):
+    """tokens/sec per engine on the same prompts; engines that fail to load are reported, not fatal."""
+    backend_names = backend_names or list(BACKENDS)
+    prompts = benchmark_prompts(num_prompts)
+    logger.info(f"Backend benchmark: {LLM_MODEL_NAME}, {len(prompts)} prompts, max_new_tokens={GENERATION_KWARGS['max_new_tokens']}")
+    results = []
+    for name in backend_names:
+        try:
+            results.append(benchmark_backend(name, prompts))
+        except Exception as e:
+            logger.error(f"Backend '{name}' failed: {e}")
+            results.append({"backend": name, "error": str(e)})
+    return results
+
+
+def format_backend_results(results):
+    lines = ["| Backend | Load (s) | Output tokens | Gen (s) | Tokens/sec |", "|---|---|---|---|---|"]
+    for r in results:
+        if "error" in r:
+            lines.append(f"| {r['backend']} | failed: {r['error']} | | | |")
+        else:
+            lines.append(f"| {r['backend']} | {r['load_sec']} | {r['output_tokens']} | {r['gen_sec']} | {r['tokens_per_sec']} |")
+    return "\n".join(lines)
+
+
+# -----------------------------
+# Embedding Encoder Throughput
+# -----------------------------
+EMBEDDING_ENGINES = ["sentence_transformers", "onnx", "int8"]
+
+
+def run_embedding_benchmark(texts, engines=None):
+    """chunks/sec per embedding engine on the same chunks (disk cache off, so every chunk is encoded)."""
+    results = []
+    for engine in engines or EMBEDDING_ENGINES:
+        try:
+            service = EmbeddingService(engine=engine, cache_path="")
+            service.embed_array(texts[:8])    # warm-up
+            start = time.time()
+            service.embed_array(texts)
+            elapsed = time.time() - start
+            results.append({
+                "engine": engine,
+                "chunks": len(texts),
+                "sec": round(elapsed, 3),
+                "chunks_per_sec": round(len(texts) / elapsed, 2) if elapsed > 0 else 0.0,
+                "padding_efficiency": service.stats()["padding_efficiency"],
+            })
+            del service
+            gc.collect()
+        except Exception as e:
+            logger.error(f"Embedding engine '{engine}' failed: {e}")
+            results.append({"engine": engine, "error": str(e)})
+    return results
+
+
+if __name__ == "__main__":
+    # python -m evaluation.backend_benchmark [backend ...]
+    # python -m evaluation.backend_benchmark --embeddings path/to/protocol.pdf [engine ...]
+    if sys.argv[1:2] == ["--embeddings"]:
+        from core.retriever import parse_pdf
+        chunks, _ = parse_pdf(sys.argv[2])
+        for row in run_embedding_benchmark(chunks, sys.argv[3:] or None):
+            print(row)
+    else:
+        print(format_backend_results(run_backend_benchmark(sys.argv[1:] or None)))
+
+__all__ = ["benchmark_prompts", "benchmark_backend", "run_backend_benchmark", "format_backend_results", "run_embedding_benchmark"]
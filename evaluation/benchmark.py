@@ -1,20 +1,103 @@
 # NEW
+import gc
+import os
 import json
+import hashlib
 import logging
+import torch
 import gradio as gr
 
-from evaluation.evaluator import evaluate_single_query
-from core.retriever import ensemble_retriever, vectorstore
-from evaluation.metrics import token_stats
+from config.settings import (
+    EMBEDDING_MODEL_NAME, LLM_MODEL_NAME, llm_backend, EVAL_BATCH_SIZE, EVAL_CHECKPOINT_PATH,
+    CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD, RERANK_ENABLED, RERANK_MODEL_NAME, RERANK_CANDIDATES, RERANK_TOP_N,
+    DENSE_INDEX, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, IVF_NLIST, IVF_NPROBE, PQ_M, IVF_REFINE,
+    PREFIX_CACHE_ENABLED,
+)
+from evaluation.evaluator import evaluate_queries
+from evaluation.metrics import BINARY_PROMPTS, JUDGE_PROMPT_VERSION
+from core import models
+from core.corpus import corpus
+from core.decoding import PROFILES
+from core.hybrid import TOP_K
+from core.retriever import index_config
 from data.gold_dataset import GOLD_DATASET
 
 logger = logging.getLogger(__name__)
+
+# -----------------------------
+#  Resumable Checkpoints (append-only JSONL)
+# -----------------------------
+def evaluation_config():
+    """Every setting outside the gold item that changes retrieval, answers or verdicts."""
+    dense = {
+        "flat": {},
+        "hnsw": {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION, "ef_search": HNSW_EF_SEARCH},
+        "ivfpq": {"nlist": IVF_NLIST, "nprobe": IVF_NPROBE, "pq_m": PQ_M, "refine": IVF_REFINE},
+    }.get(DENSE_INDEX, {})
+    backend = models.backend
+    return {
+        "llm": [LLM_MODEL_NAME, llm_backend()],
+        "embeddings": EMBEDDING_MODEL_NAME,
+        # Extractor, chunking and BM25 tokenizer of new indexes (the scope has the keys of existing ones)
+        "index": index_config(),
+        "retrieval": {"top_k": TOP_K, "dense_index": DENSE_INDEX, **dense},
+        "context": [CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD],
+        "rerank": [RERANK_MODEL_NAME, RERANK_CANDIDATES, RERANK_TOP_N] if RERANK_ENABLED else None,
+        "decoding": PROFILES,
+        # Prefix-cache generation runs unpadded, one prompt at a time: its answers can differ from padded batches
+        "generation": "prefix_cache" if PREFIX_CACHE_ENABLED and models.prefix_cache is not None else "batch",
+        "judge": {
+            "mode": "logits" if backend is not None and backend.supports_logits else "generation",
+            "prompts": BINARY_PROMPTS,
+            "version": JUDGE_PROMPT_VERSION,
+        },
+    }
+
+
+def question_fingerprint(item, scope, config=None):
+    """Changes whenever the question, its gold labels, the indexed documents, the models or evaluation_config() change."""
+    payload = json.dumps({
+        "question": item["question"],
+        "expected": item["expected"],
+        "source_page": item.get("source_page", 0),
+        "scope": scope,
+        "config": evaluation_config() if config is None else config,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_checkpoint(path):
+    """fingerprint -> metrics for every complete line (a torn last line is ignored)."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record["fingerprint"]] = record["metrics"]
+    return done
+
+
+def append_checkpoint(path, records):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
 # -----------------------------
 #  Metrics Evaluation
 # -----------------------------
-def run_rag_benchmark(progress=gr.Progress()):
-    # Ensemble Retriever
-    global ensemble_retriever
+def run_rag_benchmark(progress=gr.Progress(), doc_ids=None, resume=True, checkpoint_path=EVAL_CHECKPOINT_PATH):
+    """
+    Evaluate the gold dataset in batches of EVAL_BATCH_SIZE, stage by stage
+    (retrieval -> generation -> judging). Each finished batch is appended to
+    a JSONL checkpoint, so a rerun only recomputes missing or changed questions.
+    """
     total_stats = {
         "Recall@k": 0, "Precision@k": 0, "ROUGE": 0, 
         "Ret_Lat": 0, "Ans_Lat": 0, "Triad": 0, "Faithfulness": 0,
@@ -23,16 +106,36 @@ def run_rag_benchmark(progress=gr.Progress()):
     file_log_content = [] # List to store data for the .txt file
     num_queries = len(GOLD_DATASET)
 
+    scope = corpus.scope_key(doc_ids)
+    config = evaluation_config()
+    fingerprints = [question_fingerprint(item, scope, config) for item in GOLD_DATASET]
+    done = load_checkpoint(checkpoint_path) if resume else {}
+    todo = [i for i, fp in enumerate(fingerprints) if fp not in done]
+    logger.info(f"Benchmark: {num_queries - len(todo)} questions restored from checkpoint, {len(todo)} to run")
 
+    for start in progress.tqdm(range(0, len(todo), EVAL_BATCH_SIZE), desc="Evaluating Protocol Queries"):
+        batch = todo[start:start + EVAL_BATCH_SIZE]
+        # Free memory once per batch, not once per question
+        torch.cuda.empty_cache()
+        gc.collect()
+        results = evaluate_queries([GOLD_DATASET[i] for i in batch], doc_ids=doc_ids)
+        records = []
+        for i, metrics in zip(batch, results):
+            done[fingerprints[i]] = metrics
+            records.append({"fingerprint": fingerprints[i], "qn_no": i + 1, "question": GOLD_DATASET[i]["question"], "metrics": metrics})
+        append_checkpoint(checkpoint_path, records)
 
-    for i, item in enumerate(progress.tqdm(GOLD_DATASET, desc="Evaluating Protocol Queries")):
-        metrics = evaluate_single_query(
-            query=item["question"],
-            retriever=ensemble_retriever,
-            # llm=llm_chain,
-            expected_ans=item["expected"],
-            expected_page=item.get("source_page", 0), qn_no =i+1
-        )
+    input_tokens, output_tokens, tokens_saved = 0, 0, 0
+    ttfts, prompt_lens, prefix_lens = [], [], []
+    for i, item in enumerate(GOLD_DATASET):
+        metrics = done[fingerprints[i]]
+        input_tokens += metrics.get("Input_Tokens", 0)
+        output_tokens += metrics.get("Output_Tokens", 0)
+        tokens_saved += metrics.get("Context_Tokens_Saved", 0)
+        if metrics.get("TTFT_Sec") is not None:
+            ttfts.append(metrics["TTFT_Sec"])
+            prompt_lens.append(metrics["Prompt_Tokens"])
+            prefix_lens.append(metrics["Prefix_Tokens"])
 
         # Accumulate Statistics
         total_stats["Recall@k"] += metrics["Recall@k"]
@@ -59,8 +162,9 @@ def run_rag_benchmark(progress=gr.Progress()):
         file_entry += "="*50 + "\n"
         file_log_content.append(file_entry)
 
-    avg_input_tokens = token_stats["input_tokens"] / token_stats["num_queries"]
-    avg_output_tokens = token_stats["output_tokens"] / token_stats["num_queries"]
+    # Per-question token counts survive resumes, unlike the process-wide token counters
+    avg_input_tokens = input_tokens / num_queries
+    avg_output_tokens = output_tokens / num_queries
     total_time = total_stats["Ret_Lat"] + total_stats["Ans_Lat"]
     throughput_qps = num_queries / total_time if total_time > 0 else 0
     #  Save the .txt file to  project directory
@@ -93,9 +197,16 @@ def run_rag_benchmark(progress=gr.Progress()):
         "avg_retrieval_latency_sec": round(total_stats["Ret_Lat"] / num_queries, 4),
         "avg_generation_latency_sec": round(total_stats["Ans_Lat"] / num_queries, 4),
         "throughput_qps": round(throughput_qps, 3)},
+    # Prefix-cache generation: time to first token against the cached prefix length
+    "Time_To_First_Token": {
+        "avg_ttft_sec": round(sum(ttfts) / len(ttfts), 4),
+        "avg_prompt_tokens": int(sum(prompt_lens) / len(prompt_lens)),
+        "avg_prefix_tokens": int(sum(prefix_lens) / len(prefix_lens)),
+    } if ttfts else None,
     "Efficiency": {
         "avg_input_tokens": int(avg_input_tokens),
-        "avg_output_tokens": int(avg_output_tokens)}
+        "avg_output_tokens": int(avg_output_tokens),
+        "avg_context_tokens_saved": int(tokens_saved / num_queries)}
     }
 
     logger.info(f"Completed evaluation for {num_queries} queries")
@@ -146,10 +257,19 @@ def format_metrics_for_ui(summary):
 - **Avg Retrieval Latency**: `{perf['avg_retrieval_latency_sec']} sec`
 - **Avg Generation Latency**: `{perf['avg_generation_latency_sec']} sec`
 - **Throughput**: `{perf['throughput_qps']} QPS`
-
+{_format_ttft(summary.get("Time_To_First_Token"))}
 ### ⚡ Efficiency
 - **Avg Input Tokens**: `{eff['avg_input_tokens']}`
 - **Avg Output Tokens**: `{eff['avg_output_tokens']}`
+- **Avg Context Tokens Saved** (merge + dedup + budget): `{eff.get('avg_context_tokens_saved', 0)}`
 """
 
+def _format_ttft(ttft):
+    if not ttft:
+        return ""
+    return (
+        f"- **Avg Time to First Token**: `{ttft['avg_ttft_sec']} sec` "
+        f"(cached prefix `{ttft['avg_prefix_tokens']}` of `{ttft['avg_prompt_tokens']}` prompt tokens)\n"
+    )
+
 __all__ = ["run_rag_benchmark", "run_full_benchmark", "format_metrics_for_ui"]
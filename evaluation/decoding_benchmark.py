@@ -0,0 +1,124 @@
+import sys
+import time
+import logging
+
+import numpy as np
+
+from config.settings import llm_backend, NOT_FOUND_MIN_SIMILARITY
+from core import decoding
+from core.backends import GENERATION_KWARGS, load_backend
+from core.speculative import SpeculationTracker
+from data.gold_dataset import GOLD_DATASET
+from evaluation.metrics import binary_query
+from evaluation.speculative_benchmark import speculative_prompts
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Decode Steps: fixed kwargs vs per-task profiles
+# -----------------------------
+def _run(backend, prompts, profile):
+    """(outputs, avg new tokens, avg sec) with the legacy fixed kwargs (profile None) or a profile."""
+    outputs, tokens, start = [], 0, time.time()
+    for prompt in prompts:
+        tracker = SpeculationTracker()
+        if profile is None:
+            from transformers import LogitsProcessorList, StoppingCriteriaList
+            kwargs = dict(GENERATION_KWARGS, logits_processor=LogitsProcessorList([tracker.logits_processor]),
+                          stopping_criteria=StoppingCriteriaList([tracker.stopping_criterion]))
+        else:
+            kwargs = decoding.generate_kwargs(profile, backend.tokenizer, logits_processor=[tracker.logits_processor],
+                                              stopping_criteria=[tracker.stopping_criterion])
+        text = backend.pipeline(prompt, **kwargs)[0]["generated_text"]
+        outputs.append(decoding.trim(profile, text) if profile else text)
+        tokens += tracker.new_tokens
+    return outputs, tokens / len(prompts), (time.time() - start) / len(prompts)
+
+
+def run_decoding_benchmark(num_prompts=8):
+    """
+    Decode steps and latency per call for answers and judge verdicts, with
+    the old fixed settings (max_new_tokens=250 everywhere) vs the profiles,
+    plus how many answers change once trimmed (should be 0: stop strings
+    only cut text the old path generated after the answer).
+    """
+    backend = load_backend(llm_backend())
+    if backend.pipeline is None:
+        raise ValueError(f"The decoding benchmark needs a HF pipeline backend, not '{backend.name}'.")
+    prompts = speculative_prompts(num_prompts)
+    from langchain_core.prompts import ChatPromptTemplate
+    from core.models import AUDITOR_TEMPLATE
+    auditor = ChatPromptTemplate.from_template(AUDITOR_TEMPLATE)
+    verdict_prompts = [
+        auditor.invoke({"query": binary_query("relevance", item["expected"], item["question"])}).to_string()
+        for item in GOLD_DATASET[:num_prompts]
+    ]
+    backend.pipeline(prompts[0], max_new_tokens=4)    # warm-up
+
+    rows = []
+    for task, task_prompts, profile in [("answer", prompts, "answer"), ("verdict", verdict_prompts, "verdict")]:
+        before, before_tokens, before_sec = _run(backend, task_prompts, None)
+        after, after_tokens, after_sec = _run(backend, task_prompts, profile)
+        changed = sum(decoding.trim(profile, b).strip() != a.strip() for a, b in zip(after, before)) if task == "answer" \
+            else sum(b.strip()[:1] != a.strip()[:1] for a, b in zip(after, before))
+        rows.append({
+            "task": task,
+            "calls": len(task_prompts),
+            "tokens_before": round(before_tokens, 1),
+            "tokens_after": round(after_tokens, 1),
+            "sec_before": round(before_sec, 3),
+            "sec_after": round(after_sec, 3),
+            "changed": changed,
+        })
+    return rows
+
+
+def retrieval_confidence_profile(num_questions=None):
+    """
+    Best query/chunk cosine similarity for every gold question (all of them
+    are answerable), to place RAG_NOT_FOUND_MIN_SIMILARITY safely below.
+    """
+    from core import models
+    from core.corpus import corpus
+    from core.retriever import restore_index
+    restore_index()
+    if corpus.is_empty():
+        raise ValueError("No indexed protocol to measure retrieval similarity on.")
+    models.load_embedding_model()
+    questions = [item["question"] for item in GOLD_DATASET[:num_questions]]
+    vectors = models.embedding_model.embed_queries(questions)
+    scores = np.array([
+        decoding.retrieval_confidence(v, models.embedding_model.embed_array([d.page_content for d in docs]))
+        for v, docs in zip(vectors, corpus.retrieve_batch(questions, query_vectors=vectors))
+    ])
+    return {
+        "questions": len(scores),
+        "min": round(float(scores.min()), 4),
+        "p5": round(float(np.percentile(scores, 5)), 4),
+        "median": round(float(np.median(scores)), 4),
+        "threshold": NOT_FOUND_MIN_SIMILARITY,
+        "would_shortcut": int((scores < NOT_FOUND_MIN_SIMILARITY).sum()) if NOT_FOUND_MIN_SIMILARITY > 0 else 0,
+    }
+
+
+def format_decoding_results(rows):
+    lines = ["| Task | Calls | Tokens/call before | after | Sec/call before | after | Changed outputs |",
+             "|---|---|---|---|---|---|---|"]
+    for r in rows:
+        lines.append(
+            f"| {r['task']} | {r['calls']} | {r['tokens_before']} | {r['tokens_after']} "
+            f"| {r['sec_before']} | {r['sec_after']} | {r['changed']} |"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m evaluation.decoding_benchmark            decode steps before / after the profiles
+    # python -m evaluation.decoding_benchmark --confidence  calibrate RAG_NOT_FOUND_MIN_SIMILARITY
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:2] == ["--confidence"]:
+        print(retrieval_confidence_profile())
+    else:
+        print(format_decoding_results(run_decoding_benchmark()))
+
+__all__ = ["run_decoding_benchmark", "retrieval_confidence_profile", "format_decoding_results"]
@@ -1,23 +1,148 @@
 import torch
-from core.models import auditor_chain
-token_stats = {
-    "input_tokens": 0,
-    "output_tokens": 0,
-    "num_queries": 0
+from config.settings import JUDGE_BATCH_SIZE, PREFIX_CACHE_ENABLED
+from core import models
+from core.decoding import label_token_ids, profile_llm
+from core.telemetry import trace
+
+BINARY_PROMPTS = {
+    "faithfulness": "Is this ACTUAL ANSWER supported ONLY by the CONTEXT? Answer 1 for Yes, 0 for No.",
+    "relevance": "Does this ACTUAL ANSWER directly address the QUESTION? Answer 1 for Yes, 0 for No.",
+    "precision": "Does the CONTEXT contain the exact information in the GOLD STANDARD? Answer 1 for Yes, 0 for No."
 }
+
+def binary_query_parts(metric_name, input_a, input_b):
+    """(static instruction head, per-item rest) of an auditor query; the head is shared by every item of a metric."""
+    head = f"<s>[INST] {BINARY_PROMPTS[metric_name]}\nA: "
+    return head, f"{input_a}\nB: {input_b}\nOutput ONLY '1' or '0'. [/INST]"
+
+
+def binary_query(metric_name, input_a, input_b):
+    return "".join(binary_query_parts(metric_name, input_a, input_b))
+
+# -----------------------------
+# Judge Rows: context first
+# -----------------------------
+# Metrics judged against the retrieved context: (metric, context, other) rows are rendered on
+# the answer prompt, context first, so they share the [system, context] prefix the generation
+# stage prefilled for the same question and only the instruction + other input is new.
+CONTEXT_METRICS = {"faithfulness": "ACTUAL ANSWER", "precision": "GOLD STANDARD"}
+# Part of the benchmark checkpoint fingerprint: bump whenever the judge prompts change
+JUDGE_PROMPT_VERSION = 2
+
+
+def context_judge_question(metric_name, other):
+    return f"{BINARY_PROMPTS[metric_name]}\n{CONTEXT_METRICS[metric_name]}: {other}\nOutput ONLY '1' or '0'."
+
+
+def judge_prompt(metric_name, input_a, input_b):
+    """Full prompt text of one judge row, exactly as its chain would render it."""
+    if metric_name in CONTEXT_METRICS:
+        question = context_judge_question(metric_name, input_b)
+        return models.answer_prompt.invoke({"context": input_a, "question": question}).to_string()
+    return models.auditor_prompt.invoke({"query": binary_query(metric_name, input_a, input_b)}).to_string()
+
+
+def judge_segments(metric_name, input_a, input_b):
+    """(cacheable prefix segments, tail) of one judge row: [system, context] or [auditor preamble + instruction]."""
+    if metric_name in CONTEXT_METRICS:
+        segments = models.answer_segments(input_a, context_judge_question(metric_name, input_b))
+    else:
+        segments = models.auditor_segments(*binary_query_parts(metric_name, input_a, input_b))
+    return tuple(segments[:-1]), segments[-1]
+
+# -----------------------------
+# Logit Judge: verdict read from next-token logits of '0' / '1'
+# -----------------------------
+def _label_token_ids(label):
+    return label_token_ids(models.tokenizer, label)
+
+
+def _verdict_probs(logits):
+    """Renormalise next-token logits over the '1' / '0' verdicts -> P('1') per row."""
+    yes_ids = torch.tensor(_label_token_ids("1"), device=logits.device)
+    no_ids = torch.tensor(_label_token_ids("0"), device=logits.device)
+    log_yes = torch.logsumexp(logits[:, yes_ids], dim=-1)
+    log_no = torch.logsumexp(logits[:, no_ids], dim=-1)
+    return torch.sigmoid(log_yes - log_no).tolist()
+
+
+@torch.no_grad()
+def judge_probabilities(prompts, batch_size=JUDGE_BATCH_SIZE):
+    """
+    P('1') for each rendered judge prompt, from a single prefill forward
+    pass per batch (no generate / sampling loop). Prompts are left-padded,
+    so the last position of every row is the real next-token position.
+    """
+    tokenizer = models.tokenizer
+    backend = models.backend
+
+    probs = []
+    for start in range(0, len(prompts), batch_size):
+        batch = prompts[start:start + batch_size]
+        inputs = tokenizer(batch, return_tensors="pt", padding=True).to(backend.model.device)
+        # Only the last position's logits are needed
+        logits = backend.last_token_logits(inputs)
+        probs.extend(_verdict_probs(logits))
+    return probs
+
+
+def judge_by_generation(prompts):
+    """
+    Fallback for backends without local logits (stub, remote): one
+    generated token constrained to '0' / '1' (verdict profile), P('1') is 0 or 1.
+    """
+    outputs = profile_llm(models.backend, "verdict").batch(prompts)
+    return [1.0 if out.strip().startswith("1") else 0.0 for out in outputs]
+
+
+def judge_probabilities_cached(requests, batch_size=JUDGE_BATCH_SIZE):
+    """
+    Same verdicts as judge_probabilities, but rows are grouped by their
+    cacheable prefix and every batch only runs the per-row tail on top of
+    the cached KV. Context rows reuse the question's [system, context]
+    prefix (already prefilled when its answer was generated), relevance
+    rows the auditor preamble + instruction.
+    """
+    by_prefix = {}
+    for i, request in enumerate(requests):
+        prefix, tail = judge_segments(*request)
+        by_prefix.setdefault(prefix, []).append((i, tail))
+
+    probs = [0.0] * len(requests)
+    for prefix, rows in by_prefix.items():
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            logits = models.prefix_cache.last_token_logits(list(prefix), [tail for _, tail in chunk])
+            for (i, _), p in zip(chunk, _verdict_probs(logits)):
+                probs[i] = p
+    return probs
+
 # -----------------------------
 # Evaluation  6-Auditor Micro-Service Logic
+def get_binary_judgements(requests):
+    """
+    Batched Pass 1: [(metric_name, input_a, input_b), ...] -> [(0/1, P(1)), ...]
+    in one logit pass. Faithfulness and precision rows are (metric, context, other).
+    """
+    if not requests:
+        return []
+    with trace("judge"):
+        if not models.backend.supports_logits:
+            probs = judge_by_generation([judge_prompt(*r) for r in requests])
+        elif PREFIX_CACHE_ENABLED and models.prefix_cache is not None:
+            probs = judge_probabilities_cached(requests)
+        else:
+            probs = judge_probabilities([judge_prompt(*r) for r in requests])
+    return [(1 if p >= 0.5 else 0, p) for p in probs]
+
+
+def get_binary_scores(requests):
+    return [score for score, _ in get_binary_judgements(requests)]
+
+
 def get_binary_score(metric_name, input_a, input_b):
-    """Pass 1: High-speed Scorer (1 token output)"""
-    prompts = {
-        "faithfulness": "Is this ACTUAL ANSWER supported ONLY by the CONTEXT? Answer 1 for Yes, 0 for No.",
-        "relevance": "Does this ACTUAL ANSWER directly address the QUESTION? Answer 1 for Yes, 0 for No.",
-        "precision": "Does the CONTEXT contain the exact information in the GOLD STANDARD? Answer 1 for Yes, 0 for No."
-    }
-    query = f"<s>[INST] {prompts[metric_name]}\nA: {input_a}\nB: {input_b}\nOutput ONLY '1' or '0'. [/INST]"
-    query = f"<s>[INST] {prompts[metric_name]}\nA: {input_a}\nB: {input_b}\nOutput ONLY '1' or '0'. [/INST]"
-    response = auditor_chain.invoke({"query": query},config={"max_new_tokens": 1})  #1 as binary audit
-    return 1 if "1" in response else 0
+    """Pass 1: High-speed Scorer (reads the 1-token verdict from logits)"""
+    return get_binary_scores([(metric_name, input_a, input_b)])[0]
 
 
 def get_micro_reason(metric_name, input_a, input_b):
@@ -29,6 +154,6 @@ def get_micro_reason(metric_name, input_a, input_b):
         "precision": "Identify the specific clinical fact from the Gold Standard that is missing in the retrieved context."
     }
     query = f"<s>[INST] {prompts[metric_name]}\nInput A: {input_a}\nInput B: {input_b} [/INST]"
-    return auditor_chain.invoke({"query": query})
+    return models.auditor_chain.invoke({"query": query})
 
-__all__ = ["get_binary_score", "get_micro_reason", "token_stats"]
\ No newline at end of file
+__all__ = ["get_binary_score", "get_binary_scores", "get_binary_judgements", "judge_prompt", "judge_segments", "judge_probabilities", "judge_probabilities_cached", "judge_by_generation", "get_micro_reason"]
@@ -0,0 +1,113 @@
+import sys
+import time
+import logging
+
+import numpy as np
+
+from config.settings import RERANK_MODEL_NAME, RERANK_LATENCY_BUDGET_MS
+from core import models
+from core.corpus import corpus
+from core.hybrid import TOP_K
+from data.gold_dataset import GOLD_DATASET
+from evaluation.evaluator import retrieval_metrics
+
+logger = logging.getLogger(__name__)
+
+# Candidate pool / kept N / per-query latency budget (ms, 0 = unbounded) compared against plain fusion
+DEFAULT_CONFIGS = [
+    {"candidates": 10, "top_n": 6, "budget_ms": RERANK_LATENCY_BUDGET_MS},
+    {"candidates": 30, "top_n": 6, "budget_ms": RERANK_LATENCY_BUDGET_MS},
+    {"candidates": 30, "top_n": 3, "budget_ms": RERANK_LATENCY_BUDGET_MS},
+    {"candidates": 30, "top_n": 6, "budget_ms": 0},
+]
+
+# -----------------------------
+# Rerank Latency vs Retrieval Quality
+# -----------------------------
+def _gold_metrics(retrieved):
+    gold = [retrieval_metrics(docs, item["source_page"]) for docs, item in zip(retrieved, GOLD_DATASET)]
+    return round(float(np.mean([r for r, _ in gold])), 4), round(float(np.mean([p for _, p in gold])), 4)
+
+
+def run_rerank_benchmark(configs=None, doc_ids=None, k=TOP_K):
+    """
+    Gold-set Recall@k / Precision@k (as evaluate_single_query reports them)
+    and per-query latency of plain hybrid fusion and of each rerank
+    configuration. Every configuration starts with an empty rerank cache, so
+    rerank latencies are cold.
+    """
+    configs = configs or DEFAULT_CONFIGS
+    if corpus.is_empty():
+        raise RuntimeError("Corpus is empty. Index or restore a protocol first.")
+    models.load_embedding_model()
+    reranker = models.load_reranker()
+    questions = [item["question"] for item in GOLD_DATASET]
+    query_vectors = models.embedding_model.embed_queries(questions)
+
+    start = time.time()
+    fused = corpus.retrieve_batch(questions, doc_ids=doc_ids, k=k, query_vectors=query_vectors, rerank=False)
+    fusion_ms = (time.time() - start) * 1000 / len(questions)
+    recall, precision = _gold_metrics(fused)
+    results = [{
+        "stage": "fusion", "params": {"k": k}, "retrieve_ms": round(fusion_ms, 2), "rerank_ms": 0.0,
+        "avg_docs": round(float(np.mean([len(d) for d in fused])), 2), "budget_cutoffs": 0,
+        "Recall@k": recall, "Precision@k": precision,
+    }]
+
+    for params in configs:
+        try:
+            start = time.time()
+            pools = corpus.retrieve_batch(
+                questions, doc_ids=doc_ids, k=max(k, params["candidates"]), query_vectors=query_vectors, rerank=False
+            )
+            retrieve_ms = (time.time() - start) * 1000 / len(questions)
+
+            reranker.clear()
+            cutoffs_before = reranker.stats()["budget_cutoffs"]
+            start = time.time()
+            # One query at a time: the latency budget is per query
+            retrieved = [
+                reranker.rerank(q, docs[:params["candidates"]], top_n=params["top_n"], latency_budget_ms=params["budget_ms"])
+                for q, docs in zip(questions, pools)
+            ]
+            rerank_ms = (time.time() - start) * 1000 / len(questions)
+            recall, precision = _gold_metrics(retrieved)
+            results.append({
+                "stage": "rerank",
+                "params": params,
+                "retrieve_ms": round(retrieve_ms, 2),
+                "rerank_ms": round(rerank_ms, 2),
+                "avg_docs": round(float(np.mean([len(d) for d in retrieved])), 2),
+                "budget_cutoffs": reranker.stats()["budget_cutoffs"] - cutoffs_before,
+                "Recall@k": recall,
+                "Precision@k": precision,
+            })
+        except Exception as e:
+            logger.error(f"Rerank config {params} failed: {e}")
+            results.append({"stage": "rerank", "params": params, "error": str(e)})
+    return results
+
+
+def format_rerank_results(results):
+    lines = [
+        "| Stage | Params | Retrieve ms/query | Rerank ms/query | Docs kept | Budget cut-offs | Recall@k | Precision@k |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for r in results:
+        if "error" in r:
+            lines.append(f"| {r['stage']} | {r['params']} | failed: {r['error']} | | | | | |")
+        else:
+            lines.append(
+                f"| {r['stage']} | {r['params']} | {r['retrieve_ms']} | {r['rerank_ms']} | {r['avg_docs']} "
+                f"| {r['budget_cutoffs']} | {r['Recall@k']} | {r['Precision@k']} |"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m evaluation.rerank_benchmark [doc_id ...]   (uses the restored on-disk corpus)
+    corpus.restore()
+    logger.info(f"Reranker: {RERANK_MODEL_NAME}")
+    print(format_rerank_results(run_rerank_benchmark(doc_ids=sys.argv[1:] or None)))
+
+__all__ = ["run_rerank_benchmark", "format_rerank_results", "DEFAULT_CONFIGS"]
@@ -0,0 +1,128 @@
+import sys
+import time
+import logging
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from config.settings import llm_backend, DRAFT_MODEL_NAME, PROMPT_LOOKUP_TOKENS
+from core import decoding
+from core.backends import load_backend
+from core.models import ANSWER_TEMPLATE
+from core.speculative import SpeculativeDecoder, SpeculationTracker, SPECULATIVE_MODES
+from data.gold_dataset import GOLD_DATASET
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Speculative Decoding Benchmark
+# -----------------------------
+def speculative_prompts(num_prompts=8):
+    """
+    Answer prompts for the gold questions, with the packed retrieved context
+    when an index can be restored (what prompt lookup copies from in
+    production), else the gold answer as context.
+    """
+    prompt = ChatPromptTemplate.from_template(ANSWER_TEMPLATE)
+    items = GOLD_DATASET[:num_prompts]
+    from core.retriever import restore_index
+    from core.corpus import corpus
+    restore_index()
+    if corpus.is_empty():
+        logger.warning("No indexed protocol: using the gold answers as context")
+        contexts = [item["expected"] for item in items]
+    else:
+        from core import models
+        from core.context import pack_context
+        models.load_embedding_model()
+        contexts = [pack_context(docs)["text"] for docs in corpus.retrieve_batch([i["question"] for i in items])]
+    return [prompt.invoke({"context": c, "question": i["question"]}).to_string() for c, i in zip(contexts, items)]
+
+
+def benchmark_mode(backend, mode, prompts):
+    """Greedy generation of every prompt with one speculative mode: (answers, result row)."""
+    decoder = SpeculativeDecoder(mode, backend)
+
+    def generate(prompt):
+        tracker = SpeculationTracker()
+        # Same answer profile (budget, stop strings) as live generation
+        kwargs = decoding.generate_kwargs(
+            "answer", backend.tokenizer,
+            logits_processor=[tracker.logits_processor], stopping_criteria=[tracker.stopping_criterion],
+        )
+        kwargs.update(decoder.generate_kwargs(), do_sample=False)
+        output = backend.pipeline(prompt, **kwargs)
+        return decoding.trim("answer", output[0]["generated_text"]), tracker
+
+    generate(prompts[0])    # warm-up (draft model kernels included)
+    answers = []
+    start = time.time()
+    for p in prompts:
+        call_start = time.time()
+        answer, tracker = generate(p)
+        decoder.record(tracker, time.time() - call_start)
+        answers.append(answer)
+    elapsed = time.time() - start
+    stats = decoder.stats()
+    return answers, {
+        "mode": mode,
+        "prompts": len(prompts),
+        "gen_sec": round(elapsed, 3),
+        "avg_latency_sec": round(elapsed / len(prompts), 3),
+        "new_tokens": stats["new_tokens"],
+        "tokens_per_sec": stats["tokens_per_sec"],
+        "acceptance_rate": stats["acceptance_rate"],
+        "tokens_per_forward": stats["tokens_per_forward"],
+    }
+
+
+def run_speculative_benchmark(modes=None, num_prompts=8):
+    """
+    Latency, tokens/sec and acceptance rate per mode against plain greedy
+    decoding ("off", always run first), plus how many answers are identical
+    to it - all of them should be.
+    """
+    modes = ["off"] + [m for m in (modes or SPECULATIVE_MODES) if m != "off"]
+    prompts = speculative_prompts(num_prompts)
+    backend = load_backend(llm_backend())
+    if not backend.supports_kv_cache:
+        raise ValueError(f"Speculative decoding needs a HF torch backend, not '{backend.name}'.")
+    logger.info(
+        f"Speculative benchmark: {backend.name}, {len(prompts)} prompts, max_new_tokens={decoding.PROFILES['answer']['max_new_tokens']}, "
+        f"draft={DRAFT_MODEL_NAME or '-'}, prompt_lookup_tokens={PROMPT_LOOKUP_TOKENS}"
+    )
+    results, baseline = [], None
+    for mode in modes:
+        try:
+            answers, row = benchmark_mode(backend, mode, prompts)
+        except Exception as e:
+            logger.error(f"Speculative mode '{mode}' failed: {e}")
+            results.append({"mode": mode, "error": str(e)})
+            continue
+        if baseline is None:
+            baseline = (answers, row["avg_latency_sec"])
+        row["identical"] = sum(a == b for a, b in zip(answers, baseline[0]))
+        row["speedup"] = round(baseline[1] / row["avg_latency_sec"], 2) if row["avg_latency_sec"] > 0 else 0.0
+        results.append(row)
+    return results
+
+
+def format_speculative_results(results):
+    lines = ["| Mode | Avg latency (s) | Tokens/sec | Acceptance | Tokens / 7B forward | Speedup | Identical to greedy |",
+             "|---|---|---|---|---|---|---|"]
+    for r in results:
+        if "error" in r:
+            lines.append(f"| {r['mode']} | failed: {r['error']} | | | | | |")
+        else:
+            lines.append(
+                f"| {r['mode']} | {r['avg_latency_sec']} | {r['tokens_per_sec']} | {r['acceptance_rate']} "
+                f"| {r['tokens_per_forward']} | {r['speedup']}x | {r['identical']}/{r['prompts']} |"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m evaluation.speculative_benchmark [prompt_lookup] [draft]
+    logging.basicConfig(level=logging.INFO)
+    print(format_speculative_results(run_speculative_benchmark(sys.argv[1:] or None)))
+
+__all__ = ["speculative_prompts", "benchmark_mode", "run_speculative_benchmark", "format_speculative_results"]
@@ -0,0 +1,96 @@
+import sys
+import json
+import time
+import logging
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Modules that should only be imported once the models load, not with the app
+HEAVY_MODULES = ["torch", "transformers", "sentence_transformers", "bitsandbytes", "langchain_huggingface", "gradio", "rouge_score"]
+
+# -----------------------------
+# Startup Time (measured in a fresh interpreter)
+# -----------------------------
+def measure_startup():
+    """
+    Run inside a fresh process: app import time and which heavy modules it
+    pulled in (torch must not be one of them), index restore, background load + warm-up (per-step seconds
+    from models.readiness()), then cold vs warm retrieval latency.
+    """
+    start = time.perf_counter()
+    import api
+    import rag_core
+    from core import models
+    from core.corpus import corpus
+    result = {"import_sec": round(time.perf_counter() - start, 3)}
+    result["heavy_modules_at_import"] = [m for m in HEAVY_MODULES if m in sys.modules]
+    assert "torch" not in sys.modules, "importing the app pulled in torch"
+
+    t = time.perf_counter()
+    rag_core.restore_index()
+    result["restore_index_sec"] = round(time.perf_counter() - t, 3)
+
+    t = time.perf_counter()
+    ready = models.wait_until_ready()
+    result["time_to_ready_sec"] = round(time.perf_counter() - t, 3)
+    result["ready"] = ready
+    result["steps"] = models.readiness()["timings"]
+    if not ready:
+        result["error"] = models.load_state["error"]
+        return result
+
+    if not corpus.is_empty():
+        from data.gold_dataset import GOLD_DATASET
+        questions = [item["question"] for item in GOLD_DATASET[:3]]
+        timings = []
+        for q in questions:
+            t = time.perf_counter()
+            corpus.retrieve(q)
+            timings.append(round((time.perf_counter() - t) * 1000, 2))
+        result["first_retrieval_ms"] = timings[0]
+        result["next_retrievals_ms"] = timings[1:]
+    result["total_sec"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_startup_benchmark(runs=1):
+    """measure_startup() in `runs` fresh subprocesses, so import and load times are cold each time."""
+    results = []
+    for i in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-m", "evaluation.startup_benchmark", "--child"],
+            capture_output=True, text=True,
+        )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            logger.error(f"Startup run {i + 1} failed: {proc.stderr[-2000:]}")
+            results.append({"run": i + 1, "error": proc.stderr.strip().splitlines()[-1:] or "no output"})
+            continue
+        results.append(dict(json.loads(lines[-1]), run=i + 1))
+    return results
+
+
+def format_startup_results(results):
+    lines = ["| Run | Import (s) | Heavy modules at import | Restore (s) | Time to ready (s) | Steps (s) | First / next retrieval (ms) |",
+             "|---|---|---|---|---|---|---|"]
+    for r in results:
+        if "error" in r:
+            lines.append(f"| {r['run']} | failed: {r['error']} | | | | | |")
+            continue
+        retrieval = f"{r.get('first_retrieval_ms', '-')} / {r.get('next_retrievals_ms', '-')}"
+        lines.append(
+            f"| {r['run']} | {r['import_sec']} | {', '.join(r['heavy_modules_at_import']) or 'none'} | {r['restore_index_sec']} "
+            f"| {r['time_to_ready_sec']} | {r['steps']} | {retrieval} |"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m evaluation.startup_benchmark [runs]
+    if sys.argv[1:2] == ["--child"]:
+        print(json.dumps(measure_startup()))
+    else:
+        print(format_startup_results(run_startup_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1)))
+
+__all__ = ["measure_startup", "run_startup_benchmark", "format_startup_results"]
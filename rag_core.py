@@ -0,0 +1,98 @@
+# Single entrypoint the FastAPI app talks to
+from core import models
+from core.models import load_models, start_background_load
+from core.corpus import corpus
+from core.cache import answer_cache
+from core.context import context_packer
+from core.decoding import SHORTCUTS
+from core.scheduler import scheduler, MicroBatcher
+from core.jobs import ingestion_jobs
+from core.telemetry import registry, latency_summary, token_stats
+from core.retriever import process_pdf, remove_pdf, restore_index
+from core.qa import ask_question, ask_questions, ask_question_stream, answer_requests
+
+# Concurrent /query requests are coalesced into padded generation batches
+query_batcher = MicroBatcher(scheduler, answer_requests)
+
+# -----------------------------
+# Metrics (Prometheus text format, see core.telemetry)
+# -----------------------------
+_QUEUE = registry.gauge("rag_inference_queue", "Inference scheduler queue state.", ("kind",))
+_CACHE_HITS = registry.counter("rag_cache_hits_total", "Cache hits.", ("cache",))
+_CACHE_MISSES = registry.counter("rag_cache_misses_total", "Cache misses.", ("cache",))
+
+
+def _collect_runtime():
+    stats = scheduler.stats()
+    for kind in ("queue_depth", "queue_capacity", "in_flight", "rejected", "timed_out"):
+        _QUEUE.set(stats[kind], kind=kind)
+    caches = {"answer": answer_cache, "prefix": models.prefix_cache}
+    for name, cache in caches.items():
+        if cache is not None:
+            cache_stats = cache.stats()
+            _CACHE_HITS.track(cache_stats["hits"], cache=name)
+            _CACHE_MISSES.track(cache_stats["misses"], cache=name)
+
+
+registry.register_collector(_collect_runtime)
+
+
+def metrics_text():
+    return registry.render()
+
+# -----------------------------
+# Health Check
+# -----------------------------
+def health_check():
+    return {
+        "status": "ok",
+        "models_loaded": models.llm_chain is not None,
+        "ready": models.is_ready(),
+        "loading": models.readiness(),
+        "num_documents": len(corpus.documents),
+        "snapshot": corpus.snapshot_dir,
+        "answer_cache": answer_cache.stats(),
+        "scheduler": scheduler.stats(),
+        "micro_batching": query_batcher.stats(),
+        "ingestion_jobs": ingestion_jobs.stats(),
+        "embedding": models.embedding_model.stats() if models.embedding_model is not None else None,
+        "prefix_cache": models.prefix_cache.stats() if models.prefix_cache is not None else None,
+        "speculative": models.speculative.stats() if models.speculative is not None else None,
+        "not_found_shortcuts": SHORTCUTS.value(),
+        "context_packing": context_packer.stats(),
+        "reranker": models.reranker.stats() if models.reranker is not None else None,
+        "tokens": token_stats(),
+        "latency": latency_summary(),
+    }
+
+
+def liveness():
+    """The process is up and serving HTTP (models may still be loading)."""
+    return {"status": "alive"}
+
+
+def readiness():
+    """(ready, details): ready once models are loaded and warmed up and the inference worker runs."""
+    details = models.readiness()
+    details["scheduler_running"] = scheduler.running
+    return models.is_ready() and details["scheduler_running"], details
+
+
+def run_rag_benchmark(*args, **kwargs):
+    # Imported on first use: the evaluation stack pulls in gradio and rouge_score
+    from evaluation.benchmark import run_rag_benchmark as run
+    return run(*args, **kwargs)
+
+
+def list_documents():
+    return corpus.list_documents()
+
+
+def is_read_only():
+    """True when serving a read-only snapshot (uploads and deletes are refused)."""
+    return corpus.snapshot_dir is not None
+
+__all__ = [
+    "load_models", "process_pdf", "remove_pdf", "restore_index", "ask_question", "ask_questions", "ask_question_stream", "answer_requests", "query_batcher",
+    "run_rag_benchmark", "health_check", "liveness", "readiness", "start_background_load", "list_documents", "is_read_only", "metrics_text",
+]
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from core import decoding
+from core.backends import Backend, NOT_FOUND_ANSWER, StubLLM, load_backend
+from core.models import ANSWER_TEMPLATE
+
+
+@pytest.fixture
+def torch():
+    pytest.importorskip("torch.nn")
+    import torch
+    return torch
+
+
+class _RecordingModel:
+    def __init__(self, torch):
+        self.torch = torch
+
+    def __call__(self, **inputs):
+        self.inputs = inputs
+        batch, width = inputs["input_ids"].shape
+        return SimpleNamespace(logits=self.torch.zeros(batch, width, 4))
+
+
+def test_stub_backend_answers_through_the_answer_chain():
+    backend = load_backend("stub")
+    assert backend.name == "stub" and isinstance(backend.llm, StubLLM)
+    assert not backend.supports_logits and not backend.supports_kv_cache
+    chain = ChatPromptTemplate.from_template(ANSWER_TEMPLATE) | decoding.profile_llm(backend, "answer") | StrOutputParser()
+    context = "Metformin is stopped when eGFR falls below 30. Lactic acidosis is rare."
+    assert chain.invoke({"context": context, "question": "When is metformin stopped?"}) == \
+        "Metformin is stopped when eGFR falls below 30."
+    assert chain.batch([{"context": context, "question": "q"}, {"context": "", "question": "q"}]) == \
+        ["Metformin is stopped when eGFR falls below 30.", NOT_FOUND_ANSWER]
+    assert backend.tokenizer.encode("two words", add_special_tokens=False) == backend.tokenizer.encode("two words")[1:]
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="Unknown LLM backend"):
+        load_backend("vllm")
+
+
+def test_left_padded_rows_get_positions_from_their_first_token(torch):
+    model = _RecordingModel(torch)
+    backend = Backend("hf", llm=None, tokenizer=None, model=model)
+    backend.last_token_logits({
+        "input_ids": torch.tensor([[0, 0, 7, 8], [5, 6, 7, 8]]),
+        "attention_mask": torch.tensor([[0, 0, 1, 1], [1, 1, 1, 1]]),
+    })
+    assert model.inputs["position_ids"].tolist() == [[0, 0, 0, 1], [0, 1, 2, 3]]
+
+
+def test_verdict_logits_do_not_depend_on_batch_neighbours(torch):
+    transformers = pytest.importorskip("transformers")
+    torch.manual_seed(0)
+    config = transformers.MistralConfig(
+        vocab_size=32, hidden_size=16, intermediate_size=32, num_hidden_layers=2,
+        num_attention_heads=2, num_key_value_heads=1, max_position_embeddings=64,
+    )
+    model = transformers.MistralForCausalLM(config).eval()
+    backend = Backend("hf", llm=None, tokenizer=None, model=model, trims_logits=True)
+    short = [3, 4, 5]
+    alone = backend.last_token_logits({"input_ids": torch.tensor([short]), "attention_mask": torch.ones(1, 3, dtype=torch.long)})
+    batched = backend.last_token_logits({
+        "input_ids": torch.tensor([[0, 0, 0] + short, [1, 2, 3, 4, 5, 6]]),
+        "attention_mask": torch.tensor([[0, 0, 0, 1, 1, 1], [1] * 6]),
+    })
+    torch.testing.assert_close(batched[0], alone[0], atol=1e-4, rtol=1e-4)
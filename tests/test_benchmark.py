@@ -0,0 +1,35 @@
+import copy
+
+import pytest
+
+pytest.importorskip("gradio")
+
+from evaluation import benchmark
+
+ITEM = {"question": "When is metformin stopped?", "expected": "eGFR < 30", "source_page": 4}
+SCOPE = (("protocol", "key-1"),)
+
+
+def test_fingerprint_is_stable_for_the_same_run():
+    config = benchmark.evaluation_config()
+    assert benchmark.question_fingerprint(ITEM, SCOPE, config) == benchmark.question_fingerprint(ITEM, SCOPE, config)
+
+
+@pytest.mark.parametrize("change", [
+    lambda c: c["decoding"]["answer"].update(max_new_tokens=1),
+    lambda c: c["judge"].update(mode="generation" if c["judge"]["mode"] == "logits" else "logits"),
+    lambda c: c["judge"].update(version=c["judge"]["version"] + 1),
+    lambda c: c.update(generation="batch" if c["generation"] == "prefix_cache" else "prefix_cache"),
+    lambda c: c["retrieval"].update(dense_index="ivfpq"),
+    lambda c: c["index"].update(extractor="text", bm25_tokenizer="other"),
+])
+def test_fingerprint_changes_with_the_evaluation_config(change):
+    config = benchmark.evaluation_config()
+    changed = copy.deepcopy(config)
+    change(changed)
+    assert benchmark.question_fingerprint(ITEM, SCOPE, config) != benchmark.question_fingerprint(ITEM, SCOPE, changed)
+
+
+def test_fingerprint_changes_when_a_document_is_reindexed():
+    config = benchmark.evaluation_config()
+    assert benchmark.question_fingerprint(ITEM, SCOPE, config) != benchmark.question_fingerprint(ITEM, (("protocol", "key-2"),), config)
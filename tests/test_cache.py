@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from core import cache as cache_module
+from core.cache import SemanticCache
+
+DPP = (("dpp", "k1"),)
+BOTH = (("dpp", "k1"), ("ukpds", "k2"))
+
+
+def _unit(i, dim=8):
+    v = np.zeros(dim, dtype=np.float32)
+    v[i] = 1.0
+    return v
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_paraphrase_hits_within_the_same_scope_only():
+    cache = SemanticCache(threshold=0.9, max_entries=8, ttl_sec=0)
+    cache.put(DPP, _unit(0), "31%", "ctx")
+    paraphrase = _unit(0) * 3 + _unit(1) * 0.3
+    assert cache.lookup(DPP, paraphrase) == ("31%", "ctx")
+    assert cache.lookup(BOTH, paraphrase) is None
+    assert cache.lookup(DPP, _unit(1)) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = SemanticCache(threshold=0.9, max_entries=8, ttl_sec=60)
+    cache.put(DPP, _unit(0), "31%", "ctx")
+    clock[0] += 59
+    assert cache.lookup(DPP, _unit(0)) is not None
+    clock[0] += 2
+    assert cache.lookup(DPP, _unit(0)) is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["evictions"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticCache(threshold=0.9, max_entries=2, ttl_sec=0)
+    cache.put(DPP, _unit(0), "a", "ctx")
+    cache.put(DPP, _unit(1), "b", "ctx")
+    assert cache.lookup(DPP, _unit(0)) == ("a", "ctx")     # a is now the most recent
+    cache.put(DPP, _unit(2), "c", "ctx")
+    assert cache.lookup(DPP, _unit(1)) is None
+    assert cache.lookup(DPP, _unit(0)) == ("a", "ctx") and cache.lookup(DPP, _unit(2)) == ("c", "ctx")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_drops_every_scope_with_the_document():
+    cache = SemanticCache(threshold=0.9, max_entries=8, ttl_sec=0)
+    cache.put(DPP, _unit(0), "a", "ctx")
+    cache.put(BOTH, _unit(0), "b", "ctx")
+    cache.put((("ukpds", "k2"),), _unit(0), "c", "ctx")
+    assert cache.invalidate("dpp") == 2
+    assert cache.lookup(DPP, _unit(0)) is None and cache.lookup(BOTH, _unit(0)) is None
+    assert cache.lookup((("ukpds", "k2"),), _unit(0)) == ("c", "ctx")
+    assert cache.invalidate("dpp") == 0
+
+
+def test_zero_entries_disables_the_cache():
+    cache = SemanticCache(threshold=0.9, max_entries=0, ttl_sec=0)
+    cache.put(DPP, _unit(0), "a", "ctx")
+    assert cache.lookup(DPP, _unit(0)) is None and cache.stats()["entries"] == 0
@@ -0,0 +1,75 @@
+import pytest
+from langchain_core.documents import Document
+
+from core import models
+from core.context import ContextPacker, dedup_sentences, group_passages, merge_texts, overlap_length, split_sentences
+
+
+def doc(text, chunk, page=1, doc_id="p"):
+    return Document(page_content=text, metadata={"doc_id": doc_id, "page": page, "chunk": chunk})
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # No generator tokenizer: token counts fall back to clinical tokens
+    monkeypatch.setattr(models, "tokenizer", None)
+
+
+def test_splitter_overlap_is_written_once():
+    left = "Participants receive metformin twice daily with meals."
+    right = "twice daily with meals. Dose is titrated at week 4."
+    assert overlap_length(left, right) == len("twice daily with meals.")
+    assert merge_texts([left, right]) == "Participants receive metformin twice daily with meals. Dose is titrated at week 4."
+    # Short coincidental matches are not overlap
+    assert merge_texts(["Visit 1.", "Visit 2."]) == "Visit 1.\nVisit 2."
+
+
+def test_adjacent_chunks_of_a_page_form_one_passage_at_their_best_rank():
+    docs = [doc("C three.", 3), doc("Other page.", 0, page=2), doc("B two.", 2), doc("A one.", 1), doc("C three.", 3)]
+    assert group_passages(docs) == ["A one.\nB two.\nC three.", "Other page."]
+
+
+def test_non_adjacent_chunks_stay_separate():
+    assert group_passages([doc("Five.", 5), doc("One.", 1)]) == ["Five.", "One."]
+
+
+def test_split_sentences_round_trips():
+    text = "First sentence. Second one?  Third\n\nFourth;"
+    assert "".join(s + sep for s, sep in split_sentences(text)) == text
+
+
+def test_near_duplicate_sentences_keep_the_higher_ranked_copy():
+    passages = [
+        "Metformin is given twice daily with meals. Visits are monthly.",
+        "Metformin is given twice daily with food. Yes. Yes.",
+    ]
+    kept, dropped = dedup_sentences(passages, threshold=0.6)
+    assert dropped == 1
+    assert [s for s, _ in kept[0]] == ["Metformin is given twice daily with meals.", "Visits are monthly."]
+    # Fragments below MIN_DEDUP_TOKENS are never treated as duplicates
+    assert [s for s, _ in kept[1]] == ["Yes.", "Yes."]
+
+
+def test_packing_stops_at_the_budget_on_a_sentence_boundary():
+    docs = [
+        doc("Alpha beta gamma delta. Epsilon zeta eta theta.", 1),
+        doc("Iota kappa lambda mu. Nu xi omicron pi. Rho sigma tau upsilon.", 5),
+    ]
+    packer = ContextPacker(budget=12, dedup_threshold=0.9)
+    packed = packer.pack(docs)
+    assert packed["text"] == "Alpha beta gamma delta. Epsilon zeta eta theta.\n\nIota kappa lambda mu."
+    assert packed["truncated"] and packed["passages"] == 2
+    assert packed["tokens"] == 12 and packed["tokens_saved"] == packed["raw_tokens"] - 12
+    assert packer.stats()["truncated"] == 1
+
+
+def test_zero_budget_packs_everything():
+    docs = [doc("One two three four.", 1), doc("Five six seven eight.", 4)]
+    packed = ContextPacker(budget=0).pack(docs)
+    assert packed["text"] == "One two three four.\n\nFive six seven eight."
+    assert not packed["truncated"]
+
+
+def test_no_docs_is_an_empty_context():
+    packed = ContextPacker().pack([])
+    assert packed["text"] == "" and packed["tokens"] == 0
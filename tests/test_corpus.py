@@ -0,0 +1,127 @@
+import json
+
+import numpy as np
+import pytest
+
+from core import corpus as corpus_module, models, qa
+from core.corpus import CorpusManager
+from core.snapshot import build_snapshot, ShardedIndex
+from core.sparse import build_postings
+
+TEXTS = {
+    "dpp": ["metformin reduced diabetes incidence", "lifestyle intervention weight loss", "placebo group outcomes"],
+    "ukpds": ["sulfonylurea and insulin therapy", "intensive glucose control"],
+}
+
+
+class _NoEmbeddings:
+    def embed_array(self, texts):
+        raise AssertionError("retrieved chunks must not be re-embedded")
+
+
+@pytest.fixture
+def corpus(monkeypatch):
+    rng = np.random.default_rng(0)
+    vectors = {d: rng.normal(size=(len(t), 8)).astype(np.float32) for d, t in TEXTS.items()}
+    saved = {
+        d: {"texts": t, "metadatas": [{"page": i} for i in range(len(t))], "bm25": build_postings(t), "vectors": vectors[d]}
+        for d, t in TEXTS.items()
+    }
+    monkeypatch.setattr(corpus_module, "load_index", lambda key, index_dir: saved[key])
+    monkeypatch.setattr(models, "embedding_model", _NoEmbeddings())
+    manager = CorpusManager()
+    for doc_id in TEXTS:
+        manager.add_document(doc_id, doc_id, persist=False)
+    return manager, vectors
+
+
+def test_chunk_vectors_are_the_indexed_rows(corpus):
+    manager, vectors = corpus
+    docs = manager.retrieve("metformin diabetes", query_vector=vectors["dpp"][0], rerank=False)
+    got = manager.chunk_vectors(docs)
+    want = np.stack([vectors[d.metadata["doc_id"]][d.metadata["chunk"]] for d in docs])
+    np.testing.assert_array_equal(got, want)
+
+
+def test_chunks_of_a_replaced_document_are_skipped(corpus):
+    manager, vectors = corpus
+    docs = manager.retrieve("insulin therapy", doc_ids=["ukpds"], query_vector=vectors["ukpds"][0], rerank=False)
+    # Re-indexed between retrieval and the lookup: new Document objects for the same rows
+    manager.add_document("ukpds", "dpp", persist=False)
+    assert manager.chunk_vectors(docs).shape[0] == 0
+
+
+def test_not_found_uses_indexed_vectors(corpus, monkeypatch):
+    manager, vectors = corpus
+    monkeypatch.setattr(qa, "corpus", manager)
+    monkeypatch.setattr(qa, "NOT_FOUND_MIN_SIMILARITY", 0.99)
+    docs = manager.retrieve("metformin", query_vector=vectors["dpp"][0], rerank=False)
+    assert not qa._not_found(vectors["dpp"][0], docs)
+    assert qa._not_found(-vectors["dpp"][0], docs)
+
+
+def test_snapshot_chunk_vectors_match_the_corpus(corpus, tmp_path):
+    manager, vectors = corpus
+    build_snapshot(manager, str(tmp_path / "snapshot"), num_shards=2)
+    index = ShardedIndex(str(tmp_path / "snapshot"), shard_servers={})
+    refs = [("ukpds", 1), ("dpp", 2), ("dpp", 0)]
+    np.testing.assert_array_equal(index.chunk_vectors(refs), np.stack([vectors[d][r] for d, r in refs]))
+
+
+class _RecordingCache:
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, doc_id):
+        self.invalidated.append(doc_id)
+
+
+VERSIONS = {
+    "dpp@1": ("dpp", TEXTS["dpp"]),
+    "ukpds@1": ("ukpds", TEXTS["ukpds"]),
+    "ukpds@2": ("ukpds", ["metformin in overweight patients", "insulin dose titration", "microvascular endpoints"]),
+}
+
+
+@pytest.fixture
+def writable(monkeypatch, tmp_path):
+    rng = np.random.default_rng(1)
+    saved = {
+        key: {"texts": t, "metadatas": [{"page": i} for i in range(len(t))], "bm25": build_postings(t),
+              "vectors": rng.normal(size=(len(t), 8)).astype(np.float32)}
+        for key, (_, t) in VERSIONS.items()
+    }
+    monkeypatch.setattr(corpus_module, "load_index", lambda key, index_dir: saved[key])
+    return CorpusManager(index_dir=str(tmp_path), cache=_RecordingCache()), saved
+
+
+def _rows(manager):
+    """Every (doc_id, text) a query can reach: k covers the whole corpus."""
+    docs = manager.retrieve("metformin insulin", query_vector=np.ones(8, dtype=np.float32), k=50, rerank=False)
+    return sorted((d.metadata["doc_id"], d.page_content) for d in docs)
+
+
+def _expected(*keys):
+    return sorted((VERSIONS[k][0], text) for k in keys for text in VERSIONS[k][1])
+
+
+def test_add_replace_remove_leave_only_that_documents_rows(writable, tmp_path):
+    manager, saved = writable
+    assert manager.add_document("dpp", "dpp@1") and manager.add_document("ukpds", "ukpds@1")
+    assert len(manager.index) == 5 and _rows(manager) == _expected("dpp@1", "ukpds@1")
+
+    # Replacing swaps the document's rows and vectors; the other document is untouched
+    assert manager.add_document("ukpds", "ukpds@2")
+    assert len(manager.index) == 6 and _rows(manager) == _expected("dpp@1", "ukpds@2")
+    np.testing.assert_array_equal(manager.index.chunk_vectors([("ukpds", 2)])[0], saved["ukpds@2"]["vectors"][2])
+    np.testing.assert_array_equal(manager.index.chunk_vectors([("dpp", 0)])[0], saved["dpp@1"]["vectors"][0])
+    assert not manager.add_document("ukpds", "ukpds@2")
+
+    assert manager.remove_document("ukpds")
+    assert not manager.remove_document("ukpds")
+    assert len(manager.index) == 3 and _rows(manager) == _expected("dpp@1")
+    assert manager.list_documents() == [{"doc_id": "dpp", "key": "dpp@1", "num_chunks": 3}]
+    # Cached answers of a changed document are dropped on every change
+    assert manager.cache.invalidated == ["dpp", "ukpds", "ukpds", "ukpds"]
+    with open(tmp_path / "corpus.json") as f:
+        assert json.load(f) == {"dpp": "dpp@1"}
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from core.backends import NOT_FOUND_ANSWER
+from core.decoding import retrieval_confidence, trim, trim_stream
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_trim_cuts_at_the_first_stop_string():
+    assert trim("answer", "Twice daily.\nQuestion: and then?") == "Twice daily."
+    assert trim("answer", "Twice daily. [INST] more\nQ: x") == "Twice daily."
+    assert trim("answer", "No stop here.") == "No stop here."
+
+
+def test_trim_keeps_stop_after_strings():
+    text = f"{NOT_FOUND_ANSWER} It may be in the appendix."
+    assert trim("answer", text) == NOT_FOUND_ANSWER
+
+
+TEXTS = [
+    "Metformin 500 mg twice daily.\nQuestion: what about week 4?",
+    f"Sorry. {NOT_FOUND_ANSWER} Extra words.",
+    "Dose is titrated at week 4 [INST] ignore",
+    "A long answer without any stop string at all, emitted in full.",
+    "Ends on a partial stop\nQue",
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, 64])
+def test_stream_matches_trim_for_any_chunking(text, size):
+    pieces = list(trim_stream("answer", chunked(text, size)))
+    assert "".join(pieces).rstrip() == trim("answer", text)
+
+
+def test_stop_string_split_across_chunks_is_never_emitted():
+    pieces = ["Week 12 visit.\nQu", "est", "ion: next"]
+    out = list(trim_stream("answer", pieces))
+    assert all("Qu" not in piece for piece in out)
+    assert "".join(out) == "Week 12 visit."
+
+
+def test_stream_stops_reading_after_a_stop():
+    consumed = []
+
+    def pieces():
+        for piece in ["Done.", "\nQuestion:", " more", " text"]:
+            consumed.append(piece)
+            yield piece
+
+    assert "".join(trim_stream("answer", pieces())) == "Done."
+    assert consumed == ["Done.", "\nQuestion:"]
+
+
+def test_retrieval_confidence():
+    q = np.array([1.0, 0.0], dtype=np.float32)
+    assert retrieval_confidence(q, np.zeros((0, 2), dtype=np.float32)) == -1.0
+    assert retrieval_confidence(q, [[0.0, 2.0], [3.0, 3.0]]) == pytest.approx(np.sqrt(0.5))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from core import embeddings
+from core.embeddings import EmbeddingService, VectorCache
+
+
+def _vector(text):
+    return np.array([len(text), text.count(" "), sum(map(ord, text)) % 97], dtype=np.float32)
+
+
+class _FakeEncoder:
+    """Word-count tokenizer and a deterministic vector per text; records every encode batch."""
+    max_seq_length = 512
+
+    def __init__(self):
+        self.batches = []
+
+    def tokenizer(self, texts, truncation=True, max_length=None):
+        return {"input_ids": [t.split() for t in texts]}
+
+    def get_sentence_embedding_dimension(self):
+        return 3
+
+    def encode(self, texts, batch_size=None, convert_to_numpy=True, show_progress_bar=False):
+        self.batches.append(list(texts))
+        return np.stack([_vector(t) for t in texts])
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    monkeypatch.setattr(embeddings, "load_encoder", lambda engine: _FakeEncoder())
+    return lambda **kw: EmbeddingService(engine="sentence_transformers", cache_path=str(tmp_path / "vectors.sqlite"), **kw)
+
+
+def test_vector_cache_round_trip(tmp_path):
+    path = str(tmp_path / "vectors.sqlite")
+    cache = VectorCache(path, "model|a")
+    cache.put_many([(cache.key("dose"), [1.0, 2.0]), (cache.key("route"), [3.0, 4.0])])
+    reopened = VectorCache(path, "model|a")
+    found = reopened.get_many([reopened.key("dose"), reopened.key("missing")])
+    assert list(found) == [reopened.key("dose")]
+    np.testing.assert_array_equal(found[reopened.key("dose")], np.array([1.0, 2.0], dtype=np.float32))
+    assert len(reopened) == 2
+    # Another model or engine never sees these vectors
+    assert VectorCache(path, "model|b").get_many([VectorCache(path, "model|b").key("dose")]) == {}
+
+
+def test_duplicates_are_encoded_once_and_repeats_come_from_disk(service):
+    texts = ["Exclusion criteria apply.", "Dose is 500 mg twice daily with meals.", "Exclusion criteria apply."]
+    first = service(batch_size=2)
+    out = first.embed_array(texts)
+    np.testing.assert_array_equal(out, np.stack([_vector(t) for t in texts]))
+    assert sorted(t for b in first.encoder.batches for t in b) == sorted(set(texts))
+    assert first.stats()["encoded"] == 2 and first.stats()["cache_hits"] == 1
+
+    # A new process (new service, same cache file) encodes only the new text
+    second = service(batch_size=2)
+    out = second.embed_array(texts + ["Visit 3 is at week 12."])
+    np.testing.assert_array_equal(out[:3], np.stack([_vector(t) for t in texts]))
+    assert second.encoder.batches == [["Visit 3 is at week 12."]]
+    assert second.stats()["cache_hits"] == 3
+
+
+def test_misses_are_encoded_in_length_sorted_batches(service):
+    texts = ["a b c d e f", "a", "a b c d", "a b"]
+    svc = service(batch_size=2)
+    svc.embed_array(texts)
+    assert svc.encoder.batches == [["a", "a b"], ["a b c d", "a b c d e f"]]
+    # 13 real tokens over (2 + 6) * 2 padded positions
+    assert svc.stats()["padding_efficiency"] == round(13 / 16, 4)
+
+
+def test_queries_skip_the_disk_cache(service):
+    svc = service()
+    svc.embed_query("Dose?")
+    svc.embed_query("Dose?")
+    assert svc.encoder.batches == [["Dose?"], ["Dose?"]] and len(svc.cache) == 0
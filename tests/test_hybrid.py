@@ -0,0 +1,123 @@
+import numpy as np
+
+from core.ann import FlatDenseIndex, IVFPQDenseIndex, top_k
+from core.hybrid import HybridIndex, weighted_rrf
+from core.sparse import build_postings
+
+
+def _index(dense_index=None):
+    index = HybridIndex(dense_index=dense_index or FlatDenseIndex())
+    rng = np.random.default_rng(0)
+    texts = ["metformin reduced diabetes incidence", "lifestyle intervention weight loss", "placebo group outcomes"]
+    index.add_segment("doc", build_postings(texts), rng.normal(size=(3, 8)).astype(np.float32))
+    return index, texts
+
+
+def test_empty_document_does_not_break_queries():
+    index, _ = _index()
+    # Saved before the fix: no chunks and a (0, 0) vector array
+    index.add_segment("scanned", build_postings([]), np.zeros((0, 0), dtype=np.float32))
+    bm25, dense = index.search(["metformin"], np.ones(8, dtype=np.float32), k=2)
+    assert bm25[0] == ("doc", 0)
+    assert len(dense) == 2 and all(seg == "doc" for seg, _ in dense)
+
+
+def test_empty_segments_are_skipped_by_ivfpq():
+    rng = np.random.default_rng(1)
+    index = IVFPQDenseIndex(nlist=2, nprobe=2, pq_m=2, refine=0, train_size=64, nbits=2)
+    index.build([np.zeros((0, 0), dtype=np.float32), rng.normal(size=(16, 4)).astype(np.float32)])
+    assert len(index) == 16
+    assert len(index.search(rng.normal(size=(1, 4)).astype(np.float32), 3)[0]) == 3
+
+
+def test_top_k_breaks_ties_by_row():
+    assert list(top_k(np.array([1.0, 3.0, 3.0, 2.0]), 3)) == [1, 2, 3]
+
+
+def test_weighted_rrf_sums_weights_and_dedups():
+    fused = weighted_rrf([(0.4, ["a", "b"]), (0.6, ["b", "c"])], c=60)
+    assert fused[0] == "b"
+    assert sorted(fused) == ["a", "b", "c"]
+
+
+class _RecordingFlat(FlatDenseIndex):
+    def __init__(self, gate=None):
+        super().__init__()
+        self.calls = []
+        self.gate = gate
+
+    def build(self, segment_vectors):
+        self.calls.append(("build", len(segment_vectors)))
+        if self.gate is not None:
+            self.gate.wait(5)
+        super().build(segment_vectors)
+
+    def extend(self, segment_vectors):
+        self.calls.append(("extend", len(segment_vectors)))
+        super().build([self.vectors] + list(segment_vectors))
+
+
+def _vectors(n, seed):
+    return np.random.default_rng(seed).normal(size=(n, 8)).astype(np.float32)
+
+
+def test_new_segments_extend_the_dense_index():
+    dense = _RecordingFlat()
+    index = HybridIndex(dense_index=dense)
+    index.add_segment("a", build_postings(["metformin dose"] * 3), _vectors(3, 0))
+    index.build_dense()
+    index.add_segment("b", build_postings(["insulin dose"] * 2), _vectors(2, 1))
+    assert not index.dense_ready
+    index.build_dense()
+    assert dense.calls == [("build", 1), ("extend", 1)]
+    # Replacing a document moves it to the end: rows shift, so the index is rebuilt
+    index.add_segment("a", build_postings(["metformin"] * 3), _vectors(3, 2))
+    index.build_dense()
+    assert dense.calls[-1] == ("build", 2)
+    assert index.build_dense() is False
+    np.testing.assert_array_equal(dense.vectors, np.vstack(index.segment_vectors()))
+
+
+def test_queries_use_exact_search_while_the_dense_index_builds():
+    import threading
+    gate = threading.Event()
+    index = HybridIndex(dense_index=_RecordingFlat(gate))
+    index.add_segment("a", build_postings(["metformin dose", "insulin dose"]), _vectors(2, 0))
+    lock = threading.RLock()
+    builder = threading.Thread(target=index.build_dense, args=(lock,))
+    builder.start()
+    try:
+        with lock:
+            bm25, dense = index.search(["metformin"], _vectors(2, 0)[1], k=1)
+        assert dense == [("a", 1)]
+        assert not index.dense_ready
+    finally:
+        gate.set()
+        builder.join(5)
+    assert index.dense_ready
+
+
+def test_exact_scores_reuse_one_flat_index():
+    rng = np.random.default_rng(3)
+    index, _ = _index(IVFPQDenseIndex(nlist=1, nprobe=1, pq_m=2, refine=0, nbits=1))
+    index.build_dense()
+    first = index.dense_scores(rng.normal(size=8).astype(np.float32))
+    exact = index.exact_index()
+    index.dense_scores(rng.normal(size=8).astype(np.float32))
+    assert index.exact_index() is exact and first.shape == (3,)
+    index.add_segment("more", build_postings(["insulin"]), _vectors(1, 4))
+    assert index.exact_index() is not exact
+
+
+def test_ivfpq_extend_matches_a_build_with_the_same_quantizers():
+    a, b = _vectors(40, 5), _vectors(12, 6)
+    extended = IVFPQDenseIndex(nlist=4, nprobe=4, pq_m=2, refine=0, train_size=64, nbits=3)
+    extended.build([a])
+    extended.extend([b])
+    rebuilt = IVFPQDenseIndex(nlist=4, nprobe=4, pq_m=2, refine=0, train_size=64, nbits=3)
+    rebuilt.coarse, rebuilt.codebooks, rebuilt._trained_on = extended.coarse, extended.codebooks, extended._trained_on
+    rebuilt.build([a, b])
+    assert len(extended) == 52
+    np.testing.assert_array_equal(extended.list_rows, rebuilt.list_rows)
+    np.testing.assert_array_equal(extended.codes, rebuilt.codes)
+    np.testing.assert_array_equal(extended.list_offsets, rebuilt.list_offsets)
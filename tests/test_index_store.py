@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from core import index_store
+from core.index_store import (
+    compute_index_key, has_index, save_index, load_index, save_corpus_manifest, load_corpus_manifest,
+)
+from core.sparse import build_postings
+
+TEXTS = ["metformin reduced diabetes incidence", "lifestyle intervention weight loss"]
+CONFIG = {"chunk_size": 512, "chunk_overlap": 100}
+
+
+def _pdf(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def _save(key, index_dir, vectors=None):
+    vectors = np.arange(16, dtype=np.float64).reshape(2, 8) if vectors is None else vectors
+    metadatas = [{"page": 1}, {"page": 2}]
+    return save_index(key, TEXTS, metadatas, vectors, build_postings(TEXTS), CONFIG, index_dir=index_dir)
+
+
+def test_key_depends_on_content_and_config_not_path(tmp_path):
+    a = compute_index_key(_pdf(tmp_path, "a.pdf", b"%PDF protocol"), CONFIG)
+    assert compute_index_key(_pdf(tmp_path, "renamed.pdf", b"%PDF protocol"), CONFIG) == a
+    assert compute_index_key(_pdf(tmp_path, "edited.pdf", b"%PDF protocol v2"), CONFIG) != a
+    assert compute_index_key(_pdf(tmp_path, "a.pdf", b"%PDF protocol"), dict(CONFIG, chunk_size=256)) != a
+
+
+def test_save_load_round_trip(tmp_path):
+    key = compute_index_key(_pdf(tmp_path, "a.pdf", b"%PDF protocol"), CONFIG)
+    index_dir = str(tmp_path / "store")
+    assert not has_index(key, index_dir)
+    _save(key, index_dir)
+    assert has_index(key, index_dir)
+
+    loaded = load_index(key, index_dir)
+    assert loaded["texts"] == TEXTS
+    assert loaded["metadatas"] == [{"page": 1}, {"page": 2}]
+    assert loaded["manifest"]["num_chunks"] == 2 and loaded["manifest"]["config"] == CONFIG
+    # Stored as float32 and memory-mapped
+    assert isinstance(loaded["vectors"], np.memmap) and loaded["vectors"].dtype == np.float32
+    np.testing.assert_array_equal(loaded["vectors"], np.arange(16, dtype=np.float32).reshape(2, 8))
+    for name, array in build_postings(TEXTS).items():
+        np.testing.assert_array_equal(loaded["bm25"][name], array)
+
+
+def test_existing_key_is_not_rewritten(tmp_path):
+    index_dir = str(tmp_path / "store")
+    _save("k" * 64, index_dir)
+    _save("k" * 64, index_dir, vectors=np.zeros((2, 8)))
+    assert load_index("k" * 64, index_dir)["vectors"].sum() > 0
+
+
+def test_failed_save_leaves_no_index(tmp_path, monkeypatch):
+    index_dir = str(tmp_path / "store")
+
+    def fail(path, postings):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(index_store, "save_postings", fail)
+    with pytest.raises(OSError):
+        _save("k" * 64, index_dir)
+    assert not has_index("k" * 64, index_dir)
+    assert (tmp_path / "store").exists() and not list((tmp_path / "store").iterdir())
+
+
+def test_corpus_manifest_drops_deleted_indexes(tmp_path):
+    index_dir = str(tmp_path / "store")
+    _save("a" * 64, index_dir)
+    save_corpus_manifest({"dpp": "a" * 64, "ukpds": "b" * 64}, index_dir)
+    assert load_corpus_manifest(index_dir) == {"dpp": "a" * 64}
+    assert load_corpus_manifest(str(tmp_path / "empty")) == {}
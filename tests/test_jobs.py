@@ -0,0 +1,68 @@
+import threading
+import time
+
+from core.jobs import IngestionJobs
+
+
+def _wait(jobs, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while jobs.get(job_id)["status"] not in ("succeeded", "failed"):
+        assert time.monotonic() < deadline, "job did not finish"
+        time.sleep(0.01)
+    return jobs.get(job_id)
+
+
+def _upload(tmp_path, name="protocol.pdf"):
+    path = tmp_path / name
+    path.write_bytes(b"%PDF")
+    return str(path)
+
+
+def test_progress_is_visible_while_running(tmp_path):
+    jobs = IngestionJobs(workers=1)
+    reported, release = threading.Event(), threading.Event()
+
+    def index(pdf_path, doc_id, progress):
+        progress(pages_total=4, pages_parsed=2)
+        reported.set()
+        release.wait(5)
+        progress(pages_parsed=4, chunks_total=10, chunks_embedded=10)
+        return {"doc_id": doc_id, "chunks": 10}
+
+    pdf = _upload(tmp_path)
+    job_id = jobs.submit(index, pdf, "dpp")
+    assert reported.wait(5)
+    job = jobs.get(job_id)
+    assert job["status"] == "running" and job["doc_id"] == "dpp"
+    assert job["progress"] == {"pages_total": 4, "pages_parsed": 2, "chunks_total": 0, "chunks_embedded": 0}
+    # get() hands out copies
+    job["progress"]["pages_parsed"] = 99
+    assert jobs.get(job_id)["progress"]["pages_parsed"] == 2
+
+    release.set()
+    job = _wait(jobs, job_id)
+    assert job["status"] == "succeeded" and job["result"] == {"doc_id": "dpp", "chunks": 10}
+    assert job["progress"]["chunks_embedded"] == 10 and job["finished_at"] is not None
+    assert not (tmp_path / "protocol.pdf").exists()
+
+
+def test_failure_is_recorded(tmp_path):
+    jobs = IngestionJobs(workers=1)
+
+    def index(pdf_path, doc_id, progress):
+        raise ValueError("no text layer")
+
+    job_id = jobs.submit(index, _upload(tmp_path), "dpp", cleanup=False)
+    job = _wait(jobs, job_id)
+    assert job["status"] == "failed" and job["error"] == "no text layer" and job["result"] is None
+    assert (tmp_path / "protocol.pdf").exists()
+    assert jobs.stats() == {"queued": 0, "running": 0, "succeeded": 0, "failed": 1}
+
+
+def test_history_forgets_the_oldest_finished_jobs(tmp_path):
+    jobs = IngestionJobs(workers=1, history_size=2)
+    done = [_wait(jobs, jobs.submit(lambda p, doc_id, progress: doc_id, _upload(tmp_path, f"{i}.pdf"), str(i)))["job_id"]
+            for i in range(3)]
+    jobs.submit(lambda p, doc_id, progress: doc_id, _upload(tmp_path, "3.pdf"), "3")
+    assert jobs.get(done[0]) is None and jobs.get(done[1]) is None
+    assert jobs.get(done[2]) is not None and len(jobs.list()) == 2
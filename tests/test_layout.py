@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from core.layout import SectionChunker, load_page, save_page
+
+
+def heading(text, level=1):
+    return {"kind": "heading", "text": text, "level": level}
+
+
+def text(body):
+    return {"kind": "text", "text": body}
+
+
+def table(*rows):
+    return {"kind": "table", "rows": list(rows)}
+
+
+@pytest.fixture
+def chunker():
+    return SectionChunker(chunk_size=80, chunk_overlap=0, separators=["\n\n", "\n", " ", ""])
+
+
+def test_chunks_never_cross_sections(chunker):
+    texts, metadatas = chunker.chunk_pages([
+        (3, [heading("1. Objectives"), text("Primary objective."), heading("2. Design"), text("Randomized.")], False),
+    ])
+    assert texts == ["1. Objectives\n\nPrimary objective.", "2. Design\n\nRandomized."]
+    assert [m["section"] for m in metadatas] == ["1. Objectives", "2. Design"]
+    assert all(m["page"] == 3 and m["kind"] == "text" for m in metadatas)
+
+
+def test_section_carries_over_to_the_next_page(chunker):
+    texts, metadatas = chunker.chunk_pages([
+        (0, [heading("3. Population"), heading("3.1 Inclusion", level=2)], False),
+        (1, [text("Adults aged 18 to 65.")], True),
+    ])
+    # The lone heading waits for its text on the next page
+    assert texts == ["3.1 Inclusion\n\nAdults aged 18 to 65."]
+    assert metadatas == [{"page": 1, "section": "3.1 Inclusion", "kind": "text"}]
+    assert (chunker.pages, chunker.cache_hits) == (2, 1)
+
+
+def test_a_lower_level_heading_closes_deeper_sections(chunker):
+    chunker.chunk_pages([(0, [heading("1. A"), heading("1.1 B", level=2), heading("2. C"), text("x")], False)])
+    assert chunker.sections == [(1, "2. C")]
+
+
+def test_table_rows_are_packed_whole_under_the_section_title(chunker):
+    rows = [f"Visit: Month {i}; HbA1c: yes" for i in range(6)]
+    texts, metadatas = chunker.chunk_pages([(2, [heading("Schedule"), text("See below."), table(*rows)], False)])
+
+    table_chunks = [t for t, m in zip(texts, metadatas) if m["kind"] == "table"]
+    assert len(table_chunks) > 1
+    for chunk in table_chunks:
+        assert chunk.startswith("Schedule\n") and len(chunk) <= 80
+    packed = [line for chunk in table_chunks for line in chunk.split("\n")[1:]]
+    assert packed == rows
+    # The paragraph before the table is its own text chunk
+    assert texts[0] == "Schedule\n\nSee below."
+
+
+def test_save_page_round_trips(tmp_path):
+    elements = [heading("Title"), text("Body")]
+    save_page(str(tmp_path), "ab" * 32, elements)
+    assert load_page(str(tmp_path), "ab" * 32) == elements
+    assert load_page(str(tmp_path), "cd" * 32) is None
+
+
+def test_save_page_removes_its_temp_file_on_failure(tmp_path):
+    with pytest.raises(TypeError):
+        save_page(str(tmp_path), "ab" * 32, [{"kind": "text", "text": object()}])
+    assert os.listdir(tmp_path / "ab") == []
@@ -0,0 +1,40 @@
+import pytest
+from langchain_core.prompts import ChatPromptTemplate
+
+from core import models
+from core.backends import load_stub
+from evaluation import metrics
+
+CONTEXT = "Metformin is stopped if eGFR < 30."
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    monkeypatch.setattr(models, "answer_prompt", ChatPromptTemplate.from_template(models.ANSWER_TEMPLATE))
+    monkeypatch.setattr(models, "auditor_prompt", ChatPromptTemplate.from_template(models.AUDITOR_TEMPLATE))
+
+
+@pytest.mark.parametrize("metric", ["faithfulness", "precision"])
+def test_context_rows_reuse_the_answer_prefix(prompts, metric):
+    prefix, tail = metrics.judge_segments(metric, CONTEXT, "Stop metformin below 30.")
+    # Same [system, context] segments the answer was generated from, so the prefix cache hits
+    assert prefix == tuple(models.answer_segments(CONTEXT, "When is metformin stopped?")[:-1])
+    assert "".join(prefix) + tail == metrics.judge_prompt(metric, CONTEXT, "Stop metformin below 30.")
+    assert metrics.judge_prompt(metric, CONTEXT, "x").index(CONTEXT) < metrics.judge_prompt(metric, CONTEXT, "x").index("Output ONLY")
+
+
+def test_relevance_rows_share_the_metric_instruction(prompts):
+    a = metrics.judge_segments("relevance", "Stop it.", "When is metformin stopped?")
+    b = metrics.judge_segments("relevance", "Give insulin.", "What is started?")
+    assert a[0] == b[0] and a[1] != b[1]
+    assert "".join(a[0]) + a[1] == metrics.judge_prompt("relevance", "Stop it.", "When is metformin stopped?")
+
+
+def test_generated_verdicts_on_the_stub_backend(prompts, monkeypatch):
+    monkeypatch.setattr(models, "backend", load_stub())
+    judgements = metrics.get_binary_judgements([
+        ("faithfulness", CONTEXT, "Stop metformin."),
+        ("relevance", "Stop metformin.", "When is metformin stopped?"),
+        ("precision", CONTEXT, "eGFR < 30"),
+    ])
+    assert judgements == [(1, 1.0)] * 3
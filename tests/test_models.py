@@ -0,0 +1,151 @@
+import sys
+import queue
+import threading
+import types
+
+import pytest
+
+from core import models
+
+
+class _FakeStreamer:
+    """TextIteratorStreamer's queue protocol: put pieces, end() sends the stop signal."""
+
+    def __init__(self, tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=None):
+        self.queue = queue.Queue()
+        self.timeout = timeout
+
+    def put(self, text):
+        self.queue.put(text)
+
+    def end(self):
+        self.queue.put(None)
+
+    def __iter__(self):
+        while True:
+            piece = self.queue.get(timeout=self.timeout)
+            if piece is None:
+                return
+            yield piece
+
+
+@pytest.fixture
+def streaming(monkeypatch):
+    monkeypatch.setitem(sys.modules, "transformers", types.SimpleNamespace(TextIteratorStreamer=_FakeStreamer))
+    monkeypatch.setattr(models, "PREFIX_CACHE_ENABLED", False)
+    monkeypatch.setattr(models, "answer_prompt", types.SimpleNamespace(
+        invoke=lambda values: types.SimpleNamespace(to_string=lambda: "prompt")
+    ))
+    monkeypatch.setattr(models, "_generation_hooks", lambda timer: ({"stopping_criteria": []}, None))
+    monkeypatch.setattr(models, "_stop_when_set", lambda event: event)
+    monkeypatch.setattr(models, "_finish_generation", lambda timer, tracker: None)
+
+    def use(pipeline, timeout=5.0):
+        monkeypatch.setattr(models, "generation_pipeline", pipeline)
+        monkeypatch.setattr(models, "STREAM_TOKEN_TIMEOUT_SEC", timeout)
+    return use
+
+
+def test_stream_answer_yields_pieces(streaming):
+    def pipeline(prompt, streamer, **kwargs):
+        for piece in ["Metformin ", "is stopped ", "below 30."]:
+            streamer.put(piece)
+        streamer.end()
+
+    streaming(pipeline)
+    assert "".join(models.stream_answer("ctx", "q")) == "Metformin is stopped below 30."
+
+
+def test_stream_answer_reraises_generation_errors(streaming):
+    def pipeline(prompt, streamer, **kwargs):
+        streamer.put("Partial answer ")
+        raise RuntimeError("CUDA out of memory")
+
+    streaming(pipeline)
+    pieces = []
+    with pytest.raises(RuntimeError, match="out of memory"):
+        for piece in models.stream_answer("ctx", "q"):
+            pieces.append(piece)
+    assert "".join(pieces).startswith("Partial")
+
+
+def test_stream_answer_times_out_and_stops_generation(streaming):
+    stopped = threading.Event()
+
+    def pipeline(prompt, streamer, stopping_criteria, **kwargs):
+        # A hung decode step: waits until stream_answer sets its stop event
+        stop = stopping_criteria[0]
+        stop.wait(5)
+        stopped.set()
+        streamer.end()
+
+    streaming(pipeline, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        list(models.stream_answer("ctx", "q"))
+    assert stopped.wait(5)
+
+
+def test_closing_the_stream_stops_generation(streaming):
+    stopped = threading.Event()
+
+    def pipeline(prompt, streamer, stopping_criteria, **kwargs):
+        streamer.put("First piece of a long answer. " * 10)
+        stopping_criteria[0].wait(5)
+        stopped.set()
+        streamer.end()
+
+    streaming(pipeline)
+    stream = models.stream_answer("ctx", "q")
+    next(stream)
+    stream.close()
+    assert stopped.wait(5)
+
+
+def test_embedding_load_does_not_wait_for_the_llm(monkeypatch):
+    llm_started, release = threading.Event(), threading.Event()
+
+    def slow_backend(name):
+        llm_started.set()
+        release.wait(5)
+        raise RuntimeError("stop here")
+
+    monkeypatch.setattr(models, "load_backend", slow_backend)
+    monkeypatch.setattr(models, "RERANK_ENABLED", False)
+    monkeypatch.setattr(models, "embedding_model", object())
+    monkeypatch.setattr(models, "llm_chain", None)
+    loader = threading.Thread(target=lambda: pytest.raises(RuntimeError, models.load_models))
+    loader.start()
+    try:
+        assert llm_started.wait(5)
+        monkeypatch.setattr(models, "embedding_model", None)
+        monkeypatch.setattr(models, "EmbeddingService", lambda: "embeddings")
+        done = []
+        worker = threading.Thread(target=lambda: done.append(models.load_embedding_model()))
+        worker.start()
+        worker.join(2)
+        assert done == ["embeddings"]
+    finally:
+        release.set()
+        loader.join(5)
+
+
+def test_background_load_starts_one_thread(monkeypatch):
+    release = threading.Event()
+    starts = []
+
+    def load_and_warm():
+        starts.append(1)
+        release.wait(5)
+        models.load_state["phase"] = "ready"
+
+    monkeypatch.setattr(models, "_load_and_warm", load_and_warm)
+    monkeypatch.setattr(models, "_loader_thread", None)
+    monkeypatch.setattr(models, "load_state", dict(models.load_state, phase="idle"))
+    callers = [threading.Thread(target=models.start_background_load) for _ in range(8)]
+    for t in callers:
+        t.start()
+    for t in callers:
+        t.join(5)
+    release.set()
+    models._loader_thread.join(5)
+    assert starts == [1]
@@ -0,0 +1,70 @@
+import re
+
+import pytest
+
+from core.prefix_cache import PrefixKVCache
+
+
+class _SentencePieceLike:
+    """Words with their leading space, like SentencePiece's '▁word' pieces; BOS at offset (0, 0)."""
+
+    def __init__(self):
+        self.vocab = {"<s>": 1}
+
+    def __call__(self, text, return_offsets_mapping=False):
+        ids, offsets = [1], [(0, 0)]
+        for m in re.finditer(r"\s*\S+|\s+$", text):
+            ids.append(self.vocab.setdefault(m.group(), len(self.vocab) + 1))
+            offsets.append(m.span())
+        return {"input_ids": ids, "offset_mapping": offsets}
+
+
+def test_segments_are_cut_from_the_full_prompt_tokenization():
+    tokenizer = _SentencePieceLike()
+    cache = PrefixKVCache(model=None, tokenizer=tokenizer)
+    segments = ["System. Context: ", "eGFR below 30.", " Question: when? [/INST]"]
+    ids, cuts = cache._tokenize(segments)
+    assert ids == tokenizer("".join(segments))["input_ids"]
+    # "Context:" ends the first part; " eGFR" crosses the boundary and goes to the next part
+    assert cuts == [3, 6]
+
+
+def test_prefix_stays_stable_across_contexts():
+    cache = PrefixKVCache(model=None, tokenizer=_SentencePieceLike())
+    a, cuts_a = cache._tokenize(["System. Context: ", "Metformin is stopped.", " Q?"])
+    b, cuts_b = cache._tokenize(["System. Context: ", "Insulin is started.", " Q?"])
+    assert a[:cuts_a[0]] == b[:cuts_b[0]]
+
+
+@pytest.fixture
+def tiny_cache():
+    pytest.importorskip("torch.nn")
+    import torch
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+    words = "<pad> <s> system . context : metformin insulin is stopped started question when ? a b".split()
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel({w: i for i, w in enumerate(words)}, unk_token="<pad>"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", bos_token="<s>")
+    torch.manual_seed(0)
+    config = transformers.MistralConfig(
+        vocab_size=len(words), hidden_size=16, intermediate_size=32, num_hidden_layers=2,
+        num_attention_heads=2, num_key_value_heads=1, max_position_embeddings=64,
+    )
+    model = transformers.MistralForCausalLM(config).eval()
+    return PrefixKVCache(model, tokenizer), model, tokenizer, torch
+
+
+def test_cached_logits_match_a_full_forward(tiny_cache):
+    cache, model, tokenizer, torch = tiny_cache
+    prefix = "system . context :"
+    suffixes = [" metformin is stopped . question when ?", " insulin is started . a"]
+    logits = cache.last_token_logits([prefix], suffixes)
+    for row, suffix in zip(logits, suffixes):
+        ids = torch.tensor([tokenizer(prefix + suffix)["input_ids"]])
+        torch.testing.assert_close(row, model(input_ids=ids).logits[0, -1].float(), atol=1e-4, rtol=1e-4)
+    # Second call: the prefix KV comes from the cache and is unchanged by the first call's suffixes
+    again = cache.last_token_logits([prefix], suffixes)
+    torch.testing.assert_close(again, logits)
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["hits"] == 1
@@ -0,0 +1,117 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from core import corpus as corpus_module, models, qa
+from core.backends import NOT_FOUND_ANSWER
+from core.cache import SemanticCache
+from core.corpus import CorpusManager
+from core.sparse import build_postings
+
+TEXTS = {
+    "dpp": ["Metformin reduced diabetes incidence by 31 percent. It was well tolerated.",
+            "Lifestyle intervention reduced diabetes incidence by 58 percent."],
+    "ukpds": ["Intensive glucose control reduced microvascular endpoints. Sulfonylurea and insulin were used."],
+}
+
+
+def _vector(text):
+    """Hashed bag of words: questions sharing words with a chunk point towards it."""
+    v = np.zeros(32, dtype=np.float32)
+    for word in text.lower().split():
+        v[zlib.crc32(word.strip(".?").encode("utf-8")) % 32] += 1.0
+    return v
+
+
+class _Embeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_queries(self, texts):
+        self.calls += 1
+        return [_vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+
+class _CountingChain:
+    def __init__(self, chain):
+        self.chain = chain
+        self.batches = []
+
+    def batch(self, inputs):
+        self.batches.append(len(inputs))
+        return self.chain.batch(inputs)
+
+
+@pytest.fixture
+def stub_qa(monkeypatch, tmp_path):
+    saved = {
+        d: {"texts": t, "metadatas": [{"page": i} for i in range(len(t))], "bm25": build_postings(t),
+            "vectors": np.stack([_vector(text) for text in t])}
+        for d, t in TEXTS.items()
+    }
+    monkeypatch.setattr(corpus_module, "load_index", lambda key, index_dir: saved[key])
+    cache = SemanticCache(threshold=0.99, max_entries=16, ttl_sec=0)
+    manager = CorpusManager(index_dir=str(tmp_path), cache=cache)
+    for doc_id in TEXTS:
+        manager.add_document(doc_id, doc_id, persist=False)
+    monkeypatch.setattr(qa, "corpus", manager)
+    monkeypatch.setattr(qa, "answer_cache", cache)
+    monkeypatch.setattr(qa, "NOT_FOUND_MIN_SIMILARITY", 0.0)
+
+    # The real chains on the deterministic stub engine
+    embeddings = _Embeddings()
+    for name in ("llm_chain", "auditor_chain", "tokenizer", "generation_pipeline", "answer_prompt",
+                 "auditor_prompt", "prefix_cache", "backend", "speculative"):
+        monkeypatch.setattr(models, name, None)
+    monkeypatch.setattr(models, "embedding_model", embeddings)
+    monkeypatch.setattr(models, "load_embedding_model", lambda: embeddings)
+    monkeypatch.setattr(models, "llm_backend", lambda: "stub")
+    monkeypatch.setattr(models, "RERANK_ENABLED", False)
+    monkeypatch.setattr(models, "SPECULATIVE_MODE", "off")
+    models.load_models()
+    chain = _CountingChain(models.llm_chain)
+    monkeypatch.setattr(models, "llm_chain", chain)
+    return embeddings, chain
+
+
+def test_answer_requests_batches_every_miss(stub_qa):
+    embeddings, chain = stub_qa
+    results = qa.answer_requests([
+        ("Which endpoints did intensive glucose control reduce?", ["ukpds"]),
+        ("How much did metformin reduce diabetes incidence?", ["dpp"]),
+        ("What did lifestyle intervention do?", ["missing"]),
+        ("How much did metformin reduce diabetes incidence?", None),
+    ])
+    # One embedding pass and one generation batch for the three answerable requests, in order
+    assert embeddings.calls == 1 and chain.batches == [3]
+    assert results[0][0] == "Intensive glucose control reduced microvascular endpoints."
+    answer, context = results[1]
+    assert answer.rstrip(".") in context and "Intensive glucose" not in context
+    assert results[2] == "None of the requested documents are indexed."
+    assert isinstance(results[3], tuple)
+
+
+def test_ask_questions_reuses_cached_answers(stub_qa):
+    _, chain = stub_qa
+    questions = ["Which endpoints did intensive glucose control reduce?", "Were sulfonylurea and insulin used?"]
+    first = qa.ask_questions(questions, doc_ids=["ukpds"])
+    assert qa.ask_questions(questions, doc_ids=["ukpds"]) == first
+    assert chain.batches == [2]
+
+
+def test_ask_questions_errors(stub_qa, monkeypatch):
+    monkeypatch.setattr(qa, "MAX_BATCH_QUESTIONS", 2)
+    assert qa.ask_questions(["a", "b", "c"]) == "At most 2 questions per batch."
+    monkeypatch.setattr(models, "llm_chain", None)
+    assert qa.ask_questions(["a"]).startswith("System is still loading")
+
+
+def test_unsupported_questions_skip_generation(stub_qa, monkeypatch):
+    _, chain = stub_qa
+    monkeypatch.setattr(qa, "NOT_FOUND_MIN_SIMILARITY", 0.99)
+    [(answer, _)] = qa.answer_requests([("pediatric dosing schedule", ["ukpds"])])
+    assert answer == NOT_FOUND_ANSWER and chain.batches == []
@@ -0,0 +1,83 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.documents import Document
+
+from core import rerank as rerank_module
+from core.rerank import CrossEncoderReranker
+
+SCORES = {"a": 0.1, "b": 0.9, "c": 0.5, "d": 0.7, "e": 0.3, "f": 0.8}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake wall clock; every predict() call takes batch_ms."""
+    now = [0.0]
+    monkeypatch.setattr(rerank_module, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def reranker(monkeypatch, clock):
+    class FakeCrossEncoder:
+        batch_ms = 30
+
+        def __init__(self, model_name, device=None, cache_folder=None):
+            self.batches = []
+
+        def predict(self, pairs, batch_size=None, show_progress_bar=False):
+            self.batches.append([text for _, text in pairs])
+            clock[0] += self.batch_ms / 1000
+            return [SCORES[text] for _, text in pairs]
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(CrossEncoder=FakeCrossEncoder))
+    return lambda **kw: CrossEncoderReranker(model_name="fake", **kw)
+
+
+def _docs(texts="abcdef"):
+    return [Document(page_content=t) for t in texts]
+
+
+def _texts(docs):
+    return "".join(d.page_content for d in docs)
+
+
+def test_candidates_are_reordered_by_score(reranker):
+    r = reranker(top_n=3, batch_size=4, latency_budget_ms=0)
+    assert _texts(r.rerank("q", _docs())) == "bfd"
+    assert r.model.batches == [list("abcd"), list("ef")]
+
+
+def test_budget_cutoff_keeps_fused_order_for_unscored(reranker):
+    r = reranker(top_n=6, batch_size=2, latency_budget_ms=50)
+    # 30 ms for the first batch; a second one would end at 60 ms
+    assert _texts(r.rerank("q", _docs())) == "bacdef"
+    assert r.model.batches == [list("ab")]
+    assert r.stats()["budget_cutoffs"] == 1 and r.stats()["pairs_scored"] == 2
+    # Without a budget every batch runs
+    assert _texts(r.rerank("q", _docs(), latency_budget_ms=0)) == "bfdcea"
+    assert r.stats()["budget_cutoffs"] == 1
+
+
+def test_scores_are_cached_per_query_and_text(reranker):
+    r = reranker(top_n=6, batch_size=8, latency_budget_ms=0, cache_entries=4)
+    r.rerank("q", _docs("abc"))
+    assert _texts(r.rerank("q", _docs("cab"))) == "bca"
+    assert r.model.batches == [list("abc")]
+    assert r.stats()["cache_hits"] == 3
+    # Another query is scored afresh; the LRU keeps the 4 most recently used pairs
+    r.rerank("other", _docs("ab"))
+    assert r.model.batches[-1] == list("ab") and r.stats()["cache_entries"] == 4
+    # ("q", "c") was the least recently used (looked up first above), so only it is re-scored
+    r.rerank("q", _docs("bc"))
+    assert r.model.batches[-1] == ["c"]
+    assert [d.page_content for d in r.rerank("q", _docs("a"))] == ["a"]
+    assert r.stats()["queries"] == 4    # a single candidate is returned unscored
+
+
+def test_cached_scores_do_not_count_against_the_budget(reranker):
+    r = reranker(top_n=6, batch_size=2, latency_budget_ms=50)
+    r.rerank("q", _docs("ab"))
+    assert _texts(r.rerank("q", _docs())) == "bdcaef"
+    assert r.model.batches == [list("ab"), list("cd")]
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from core import models, retriever
+
+
+class _FakeEmbeddings:
+    dimension = 8
+
+    def embed_array(self, texts):
+        return np.ones((len(texts), self.dimension), dtype=np.float32)
+
+
+@pytest.fixture
+def no_text_pdf(tmp_path, monkeypatch):
+    pdf = tmp_path / "scanned.pdf"
+    pdf.write_bytes(b"%PDF-1.4 image only")
+    monkeypatch.setattr(models, "embedding_model", _FakeEmbeddings())
+    monkeypatch.setattr(retriever, "iter_pdf_chunks", lambda *args, **kwargs: iter(()))
+    monkeypatch.setattr(retriever, "count_pages", lambda path: 1)
+    return str(pdf)
+
+
+def test_parse_and_embed_keeps_embedding_width_when_empty(no_text_pdf):
+    texts, metadatas, vectors = retriever.parse_and_embed(no_text_pdf)
+    assert texts == [] and metadatas == []
+    assert vectors.shape == (0, 8)
+
+
+def test_process_pdf_rejects_documents_without_text(no_text_pdf, monkeypatch):
+    added, saved = [], []
+    monkeypatch.setattr(retriever, "has_index", lambda key: False)
+    monkeypatch.setattr(retriever, "save_index", lambda *args: saved.append(args))
+    monkeypatch.setattr(retriever.corpus, "add_document", lambda *args, **kwargs: added.append(args))
+    with pytest.raises(ValueError, match="no extractable text"):
+        retriever.process_pdf(no_text_pdf, doc_id="scanned")
+    assert added == [] and saved == []
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from core.rpc import RPCServer, RPCClient, RemoteError, encode_message, decode_message
+from core.snapshot import merge_shard_hits
+
+KEY = b"test-secret"
+
+
+@pytest.fixture
+def server():
+    handlers = {
+        "echo": lambda x: x,
+        "sleep": lambda sec: time.sleep(sec) or "done",
+        "fail": lambda: 1 / 0,
+    }
+    srv = RPCServer(("127.0.0.1", 0), handlers, authkey=KEY)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    while srv._listener is None:
+        time.sleep(0.01)
+    yield srv
+    srv.close()
+
+
+def _client(server, **kwargs):
+    return RPCClient(server._listener.address, authkey=KEY, **kwargs)
+
+
+def test_roundtrip_keeps_arrays_and_structure():
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    header, buffers = encode_message({"q": [["a", "b"]], "v": vectors, "k": np.int64(5), "empty": np.zeros((0, 4))})
+    out = decode_message(header, [bytes(b) for b in buffers])
+    assert out["q"] == [["a", "b"]] and out["k"] == 5
+    np.testing.assert_array_equal(out["v"], vectors)
+    assert out["v"].dtype == np.float32 and out["empty"].shape == (0, 4)
+
+
+def test_object_arrays_are_refused():
+    with pytest.raises(TypeError):
+        encode_message(np.array([object()]))
+
+
+def test_call_returns_value_and_remote_errors(server):
+    client = _client(server)
+    np.testing.assert_array_equal(client.call("echo", np.ones(3)), np.ones(3))
+    with pytest.raises(RemoteError, match="ZeroDivisionError"):
+        client.call("fail")
+    with pytest.raises(RemoteError, match="unknown method"):
+        client.call("os.system", "true")
+
+
+def test_slow_reply_times_out_and_next_call_reconnects(server):
+    client = _client(server, timeout=0.2)
+    with pytest.raises(TimeoutError):
+        client.call("sleep", 1.0)
+    # The late "done" of the timed-out call must not answer this one
+    assert client.call("echo", "fresh") == "fresh"
+
+
+def test_wrong_authkey_is_rejected(server):
+    with pytest.raises(Exception):
+        RPCClient(server._listener.address, authkey=b"wrong").call("echo", 1)
+
+
+def test_missing_authkey_refuses_to_start():
+    with pytest.raises(RuntimeError, match="RAG_RPC_AUTHKEY"):
+        RPCServer(("0.0.0.0", 0), {}, authkey=b"")
+    with pytest.raises(RuntimeError, match="RAG_RPC_AUTHKEY"):
+        RPCClient(("127.0.0.1", 1), authkey=b"")
+
+
+def test_merge_shard_hits_orders_by_score_then_global_row():
+    # (score, global_row, doc_id, local_row) per query, per side (bm25, dense)
+    shard_a = [([(2.0, 5, "a", 0), (1.0, 1, "a", 1)], [(0.9, 5, "a", 0)])]
+    shard_b = [([(2.0, 3, "b", 7), (1.5, 4, "b", 8)], [(0.95, 3, "b", 7)])]
+    (bm25, dense), = merge_shard_hits([shard_a, shard_b], num_queries=1, k=3)
+    assert bm25 == [("b", 7), ("a", 0), ("b", 8)]
+    assert dense == [("b", 7), ("a", 0)]
@@ -0,0 +1,184 @@
+import asyncio
+import gc
+import threading
+
+import pytest
+
+from core.scheduler import InferenceScheduler, MicroBatcher, QueueFullError
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_submit_runs_on_the_inference_worker():
+    async def main():
+        scheduler = InferenceScheduler(max_queue=4, workers=1, timeout_sec=5)
+        await scheduler.start()
+        try:
+            return await scheduler.submit(lambda: threading.current_thread().name)
+        finally:
+            await scheduler.stop()
+
+    assert run(main()).startswith("inference")
+
+
+def test_full_queue_is_rejected():
+    async def main():
+        scheduler = InferenceScheduler(max_queue=1, workers=1, timeout_sec=5)
+        await scheduler.start()
+        release = threading.Event()
+        try:
+            first = asyncio.ensure_future(scheduler.submit(release.wait, 5))
+            await asyncio.sleep(0.05)      # picked up by the worker
+            second = asyncio.ensure_future(scheduler.submit(lambda: None))
+            await asyncio.sleep(0)
+            with pytest.raises(QueueFullError):
+                await scheduler.submit(lambda: None)
+            release.set()
+            await asyncio.gather(first, second)
+        finally:
+            release.set()
+            await scheduler.stop()
+        return scheduler.rejected
+
+    assert run(main()) == 1
+
+
+def test_micro_batcher_routes_results_and_keeps_dispatch_tasks():
+    calls = []
+
+    def batch_fn(items):
+        calls.append(list(items))
+        return [item * 10 for item in items]
+
+    async def main():
+        scheduler = InferenceScheduler(max_queue=16, workers=1, timeout_sec=5)
+        await scheduler.start()
+        batcher = MicroBatcher(scheduler, batch_fn, max_batch=8, window_ms=50)
+        await batcher.start()
+        try:
+            pending = [asyncio.ensure_future(batcher.submit(i)) for i in range(5)]
+            await asyncio.sleep(0.08)
+            # Dispatch tasks are strongly referenced until they finish, even across a GC
+            gc.collect()
+            results = await asyncio.gather(*pending)
+            await asyncio.sleep(0)
+            return results, len(batcher._tasks), batcher.stats()
+        finally:
+            await batcher.stop()
+            await scheduler.stop()
+
+    results, running, stats = run(main())
+    assert results == [0, 10, 20, 30, 40]
+    assert calls == [[0, 1, 2, 3, 4]]
+    assert running == 0 and stats["batches"] == 1
+
+
+def test_stopping_the_batcher_cancels_waiting_callers():
+    release = threading.Event()
+
+    async def main():
+        scheduler = InferenceScheduler(max_queue=16, workers=1, timeout_sec=5)
+        await scheduler.start()
+        batcher = MicroBatcher(scheduler, lambda items: release.wait(5) and items, max_batch=1, window_ms=1)
+        await batcher.start()
+        caller = asyncio.ensure_future(batcher.submit("q"))
+        await asyncio.sleep(0.05)
+        assert len(batcher._tasks) == 1
+        await batcher.stop()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        release.set()
+        await scheduler.stop()
+
+    run(main())
+
+
+def _stream_scheduler(timeout_sec=5):
+    scheduler = InferenceScheduler(max_queue=4, workers=1, timeout_sec=timeout_sec)
+    closed = threading.Event()
+
+    def pieces(n, delay=0.0):
+        try:
+            for i in range(n):
+                if delay:
+                    threading.Event().wait(delay)
+                yield i
+        finally:
+            closed.set()
+    return scheduler, pieces, closed
+
+
+def test_submit_stream_reyields_items_in_order():
+    scheduler, pieces, closed = _stream_scheduler()
+
+    async def main():
+        await scheduler.start()
+        try:
+            return [item async for item in scheduler.submit_stream(pieces, 5)]
+        finally:
+            await scheduler.stop()
+
+    assert run(main()) == [0, 1, 2, 3, 4]
+    assert closed.is_set()
+
+
+def test_submit_stream_deadline_closes_the_generator():
+    scheduler, pieces, closed = _stream_scheduler()
+
+    async def main():
+        await scheduler.start()
+        got = []
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                async for item in scheduler.submit_stream(pieces, 1000, delay=0.02, timeout=0.1):
+                    got.append(item)
+            # The worker notices at the next item and closes the generator
+            await asyncio.get_running_loop().run_in_executor(None, closed.wait, 5)
+        finally:
+            await scheduler.stop()
+        return got
+
+    got = run(main())
+    assert 0 < len(got) < 1000
+    assert closed.is_set() and scheduler.timed_out == 1
+
+
+def test_consumer_leaving_early_closes_the_generator():
+    scheduler, pieces, closed = _stream_scheduler()
+
+    async def main():
+        await scheduler.start()
+        try:
+            events = scheduler.submit_stream(pieces, 1000, delay=0.01)
+            assert await events.__anext__() == 0
+            # What the API does when the client disconnects
+            await events.aclose()
+            await asyncio.get_running_loop().run_in_executor(None, closed.wait, 5)
+        finally:
+            await scheduler.stop()
+
+    run(main())
+    assert closed.is_set()
+
+
+def test_submit_stream_propagates_generator_errors():
+    scheduler = InferenceScheduler(max_queue=4, workers=1, timeout_sec=5)
+
+    def failing():
+        yield "partial"
+        raise RuntimeError("generation failed")
+
+    async def main():
+        await scheduler.start()
+        got = []
+        try:
+            with pytest.raises(RuntimeError, match="generation failed"):
+                async for item in scheduler.submit_stream(failing):
+                    got.append(item)
+        finally:
+            await scheduler.stop()
+        return got
+
+    assert run(main()) == ["partial"]
@@ -0,0 +1,91 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from core.sparse import BM25Index, BM25_K1, BM25_B, BM25_EPSILON, build_postings, load_postings, save_postings
+from core.tokenizer import clinical_tokenize
+
+DOCS = {
+    "a": [
+        "Patients with eGFR < 30 mL/min/1.73 m2 are excluded.",
+        "Metformin 500 mg b.i.d. for 12 weeks.",
+        "Adverse events are recorded at every visit.",
+    ],
+    "b": [
+        "HbA1c is measured at baseline and week 12.",
+        "Dose reduction of metformin if eGFR drops below 45.",
+        "Serious adverse events are reported within 24 hours.",
+        "The visit schedule is in table 3.",
+    ],
+}
+
+
+def reference_scores(texts, query):
+    """BM25Okapi as rank_bm25 computes it, one chunk at a time."""
+    corpus = [clinical_tokenize(t) for t in texts]
+    avgdl = sum(len(d) for d in corpus) / len(corpus)
+    df = Counter(term for d in corpus for term in set(d))
+    idf = {t: math.log(len(corpus) - n + 0.5) - math.log(n + 0.5) for t, n in df.items()}
+    floor = BM25_EPSILON * sum(idf.values()) / len(idf)
+    idf = {t: floor if v < 0 else v for t, v in idf.items()}
+    scores = []
+    for d in corpus:
+        tf = Counter(d)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(d) / avgdl)
+        scores.append(sum(idf.get(t, 0.0) * tf[t] * (BM25_K1 + 1) / (tf[t] + norm) for t in clinical_tokenize(query)))
+    return np.asarray(scores, dtype=np.float32)
+
+
+@pytest.fixture
+def index():
+    index = BM25Index(pruning=True)
+    for doc_id, texts in DOCS.items():
+        index.add_segment(doc_id, build_postings(texts))
+    return index
+
+
+def test_tokenizer_keeps_clinical_units():
+    assert clinical_tokenize("eGFR < 30 mL/min/1.73 m2.") == ["egfr", "30", "ml/min/1.73", "m2"]
+    assert clinical_tokenize("3,234 patients (12.5%), DPP's") == ["3,234", "patients", "12.5%", "dpp"]
+
+
+@pytest.mark.parametrize("query", ["metformin eGFR", "adverse events visit", "adverse adverse week 12", "unknown words"])
+def test_scores_match_bm25okapi(index, query):
+    texts = DOCS["a"] + DOCS["b"]
+    scores = index.scores_batch([clinical_tokenize(query)])[:, 0]
+    np.testing.assert_allclose(scores, reference_scores(texts, query), rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("query", ["metformin eGFR", "adverse events visit week", "table 3 visit schedule"])
+@pytest.mark.parametrize("k", [1, 3, 7])
+def test_pruned_top_k_matches_exhaustive(index, query, k):
+    terms = clinical_tokenize(query)
+    scores = index.scores_batch([terms])[:, 0]
+    pruned = index.top_k(terms, k)
+    np.testing.assert_allclose(scores[pruned], np.sort(scores)[::-1][:k], rtol=1e-6)
+
+
+def test_mask_limits_results_to_selected_rows(index):
+    mask = np.zeros(len(index), dtype=bool)
+    mask[3:] = True
+    rows = index.top_k(clinical_tokenize("metformin eGFR"), 5, mask)
+    assert len(rows) == 4 and all(mask[rows])
+
+
+def test_removing_a_segment_updates_document_frequencies(index):
+    index.remove_segment("b")
+    scores = index.scores_batch([clinical_tokenize("metformin eGFR")])[:, 0]
+    np.testing.assert_allclose(scores, reference_scores(DOCS["a"], "metformin eGFR"), rtol=1e-5, atol=1e-6)
+    assert index.merged()["seg_ids"] == ["a"]
+
+
+def test_postings_round_trip(tmp_path):
+    postings = build_postings(DOCS["b"])
+    path = str(tmp_path / "bm25.npz")
+    save_postings(path, postings)
+    loaded = load_postings(path)
+    assert set(loaded) == set(postings)
+    for name in postings:
+        np.testing.assert_array_equal(loaded[name], postings[name])
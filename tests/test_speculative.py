@@ -0,0 +1,66 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from core.speculative import SpeculativeDecoder, SpeculationTracker
+
+PROMPT_LEN = 10
+
+
+@pytest.fixture(autouse=True)
+def fake_torch(monkeypatch):
+    # The stopping criterion only builds its "never stop" answer with torch
+    monkeypatch.setitem(sys.modules, "torch", SimpleNamespace(bool=bool, zeros=lambda n, dtype, device: [False] * n))
+
+
+def _ids(length):
+    return SimpleNamespace(shape=(1, length), device="cpu")
+
+
+def _generate(tracker, rounds):
+    """Replay generate()'s hook calls: rounds = [(drafted, accepted), ...]."""
+    length = PROMPT_LEN
+    for drafted, accepted in rounds:
+        # One logits-processor call per verified position: the drafts plus the target's own token
+        for position in range(drafted + 1):
+            tracker.logits_processor(_ids(length + position), scores=None)
+        length += accepted + 1
+        assert tracker.stopping_criterion(_ids(length), scores=None) == [False]
+
+
+def test_plain_decoding_is_one_token_per_round():
+    tracker = SpeculationTracker()
+    _generate(tracker, [(0, 0)] * 5)
+    assert (tracker.new_tokens, tracker.rounds, tracker.drafted, tracker.accepted) == (5, 5, 0, 0)
+
+
+def test_assisted_rounds_count_drafted_and_accepted_tokens():
+    tracker = SpeculationTracker()
+    _generate(tracker, [(4, 2), (4, 4), (0, 0)])
+    assert tracker.prompt_len == PROMPT_LEN
+    assert (tracker.new_tokens, tracker.rounds, tracker.drafted, tracker.accepted) == (9, 3, 8, 6)
+
+
+def test_nothing_generated():
+    tracker = SpeculationTracker()
+    assert (tracker.new_tokens, tracker.rounds, tracker.accepted) == (0, 0, 0)
+
+
+def test_decoder_aggregates_calls():
+    decoder = SpeculativeDecoder("prompt_lookup", prompt_lookup_tokens=4)
+    assert decoder.generate_kwargs() == {"prompt_lookup_num_tokens": 4}
+    for rounds in ([(4, 2), (4, 4), (0, 0)], [(4, 0)]):
+        tracker = SpeculationTracker()
+        _generate(tracker, rounds)
+        decoder.record(tracker, decode_sec=0.5)
+    stats = decoder.stats()
+    assert (stats["calls"], stats["new_tokens"], stats["target_forwards"]) == (2, 10, 4)
+    assert (stats["drafted_tokens"], stats["accepted_tokens"]) == (12, 6)
+    assert stats["acceptance_rate"] == 0.5 and stats["tokens_per_forward"] == 2.5 and stats["tokens_per_sec"] == 10.0
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError, match="Unknown speculative mode"):
+        SpeculativeDecoder("medusa")
+    assert SpeculativeDecoder("off").generate_kwargs() == {}
@@ -0,0 +1,35 @@
+import pytest
+
+from core.telemetry import MetricsRegistry
+
+
+def test_tracked_counter_only_grows():
+    registry = MetricsRegistry()
+    hits = registry.counter("rag_cache_hits_total", "Cache hits.", ("cache",))
+
+    hits.track(3, cache="answer")
+    hits.track(5, cache="answer")
+    assert hits.value(cache="answer") == 5
+
+    # The cache was replaced (model reload): its new total counts in full
+    hits.track(2, cache="answer")
+    assert hits.value(cache="answer") == 7
+    hits.track(2, cache="answer")
+    assert hits.value(cache="answer") == 7
+
+
+def test_counters_render_as_prometheus_counters():
+    registry = MetricsRegistry()
+    misses = registry.counter("rag_cache_misses_total", "Cache misses.", ("cache",))
+    misses.track(4, cache="prefix")
+
+    text = registry.render()
+    assert "# TYPE rag_cache_misses_total counter" in text
+    assert 'rag_cache_misses_total{cache="prefix"} 4' in text
+
+
+def test_metric_kind_is_fixed_by_its_name():
+    registry = MetricsRegistry()
+    registry.counter("rag_cache_hits_total", "Cache hits.", ("cache",))
+    with pytest.raises(ValueError):
+        registry.gauge("rag_cache_hits_total", "Cache hits.", ("cache",))